@@ -0,0 +1,430 @@
+"""Replays stored order books and OHLCV through the strategies"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from TraderBetty.managers.store import ASK, BID
+from TraderBetty.strategies import depth
+from TraderBetty.strategies.triangular import TriangularArbitrageScanner
+
+
+# Length of a replay window in ms, only one window is held in memory
+DAY = 86400000
+
+
+def top_of_book(records):
+    """
+    Return the timestamps, best bids and best asks of stored snapshots.
+
+    :param records: level records of one symbol in time order, e.g. a
+        memory-mapped range from ``OrderBookStore.read``
+    """
+    timestamps = records["timestamp"]
+    if not len(timestamps):
+        return np.empty(0, dtype="i8"), np.empty(0), np.empty(0)
+    snapshots = timestamps[np.concatenate(
+        [[0], np.flatnonzero(np.diff(timestamps)) + 1])]
+    bid = np.full(len(snapshots), np.nan)
+    ask = np.full(len(snapshots), np.nan)
+    best = records["level"] == 0
+    for side, values in [(BID, bid), (ASK, ask)]:
+        mask = best & (records["side"] == side)
+        values[np.searchsorted(snapshots, timestamps[mask])] = (
+            records["price"][mask])
+    return np.asarray(snapshots), bid, ask
+
+
+def forward_fill(timeline, timestamps, values, max_age=None):
+    """
+    Values at every point of the timeline, carried forward from the last
+    snapshot at or before it.
+
+    :param max_age: ms after which a snapshot counts as stale, NaN then
+    """
+    positions = np.searchsorted(timestamps, timeline, side="right") - 1
+    missing = positions < 0
+    positions = np.maximum(positions, 0)
+    if not len(values):
+        return np.full(len(timeline), np.nan)
+    filled = values[positions].astype(float)
+    if max_age is not None:
+        missing |= timeline - timestamps[positions] > max_age
+    filled[missing] = np.nan
+    return filled
+
+
+class Replay(object):
+    """Streams the stored order books of many symbols in time order.
+
+    History is read one window at a time from the memory-mapped store, so
+    a month of snapshots never has to fit in memory at once.
+    """
+    def __init__(self, store, keys=None, start=None, end=None, window=DAY):
+        """
+        :param store: the OrderBookStore, e.g. ``DataManager.book_store``
+        :param keys: (exchange, symbol) pairs to replay, defaults to all
+        :param start: first timestamp in ms, defaults to the oldest stored
+        :param end: last timestamp in ms, defaults to the newest stored
+        """
+        self.store = store
+        self.keys = list(keys or store.keys())
+        self.window = window
+        self.start, self.end = start, end
+        if start is None or end is None:
+            first, last = self._stored_range()
+            self.start = first if start is None else start
+            self.end = last if end is None else end
+
+    def _stored_range(self):
+        first, last = None, None
+        for key in self.keys:
+            timestamps = self.store.read(*key)["timestamp"]
+            if not len(timestamps):
+                continue
+            first = timestamps[0] if first is None else min(first,
+                                                            timestamps[0])
+            last = timestamps[-1] if last is None else max(last,
+                                                           timestamps[-1])
+        return first, last
+
+    def windows(self):
+        """Yield the (start, end) of every window, both inclusive."""
+        if self.start is None:
+            return
+        for lo in range(int(self.start), int(self.end) + 1, self.window):
+            yield lo, min(lo + self.window - 1, int(self.end))
+
+    def ticks(self):
+        """
+        Yield the snapshots of all keys in time order.
+
+        :return: iterator of (timestamp, dict of (exchange, symbol) to
+            order book) with every book that changed at that time
+        """
+        for lo, hi in self.windows():
+            snapshots = []
+            for key in self.keys:
+                records = self.store.read(*key, start=lo, end=hi)
+                if not len(records):
+                    continue
+                timestamps = np.asarray(records["timestamp"])
+                starts = np.concatenate(
+                    [[0], np.flatnonzero(np.diff(timestamps)) + 1])
+                stops = np.append(starts[1:], len(records))
+                # Levels of the window in one array, books are views of it
+                levels = np.column_stack([records["price"],
+                                          records["volume"]])
+                # Bids come before the asks in every snapshot
+                splits = starts + np.add.reduceat(
+                    records["side"] == BID, starts)
+                snapshots.extend(zip(
+                    timestamps[starts].tolist(),
+                    itertools.repeat((key, levels)), starts.tolist(),
+                    splits.tolist(), stops.tolist()))
+            # Stable, so snapshots at the same time keep the order of keys
+            snapshots.sort(key=lambda snapshot: snapshot[0])
+            for timestamp, group in itertools.groupby(
+                    snapshots, key=lambda snapshot: snapshot[0]):
+                yield timestamp, {
+                    key: {"bids": levels[start:split],
+                          "asks": levels[split:stop],
+                          "timestamp": timestamp}
+                    for _, (key, levels), start, split, stop in group}
+
+    def _last_before(self, key, timestamp):
+        """Return the records of the last snapshot before the timestamp."""
+        records = self.store.read(*key, end=timestamp - 1)
+        if not len(records):
+            return records
+        last = records["timestamp"][-1]
+        return records[np.searchsorted(records["timestamp"], last,
+                                       side="left"):]
+
+    def top_of_book(self, lo, hi, max_age=None):
+        """
+        Best bids and asks of all keys over one time range.
+
+        The last snapshot before the range is carried into it, so a symbol
+        has its book from the start of the range, not from its first
+        snapshot in it.
+
+        :return: the timeline of all snapshot times in the range and dict
+            of key to (bids, asks) forward filled onto it
+        """
+        series, timelines = {}, []
+        for key in self.keys:
+            records = self.store.read(*key, start=lo, end=hi)
+            timelines.append(np.asarray(records["timestamp"]))
+            series[key] = top_of_book(np.concatenate(
+                [self._last_before(key, lo), records]))
+        timeline = np.unique(np.concatenate(
+            timelines + [np.empty(0, dtype="i8")]))
+        return timeline, {key: (
+            forward_fill(timeline, s[0], s[1], max_age=max_age),
+            forward_fill(timeline, s[0], s[2], max_age=max_age))
+            for key, s in series.items()}
+
+
+class SimulatedExchange(object):
+    """The order methods of a ccxt exchange, filled against the replay.
+
+    Orders are filled right away against the current recorded book at the
+    taker fee of the market, what the book can't fill at the limit price is
+    canceled, like an immediate-or-cancel order.
+    """
+    def __init__(self, PM, exchange_id):
+        self.PM = PM
+        self.id = exchange_id
+        self.rateLimit = 0
+
+    def create_limit_buy_order(self, symbol, amount, price, params=None):
+        return self.PM.fill(self.id, symbol, "buy", amount, price)
+
+    def create_limit_sell_order(self, symbol, amount, price, params=None):
+        return self.PM.fill(self.id, symbol, "sell", amount, price)
+
+    def create_market_buy_order(self, symbol, amount, params=None):
+        return self.PM.fill(self.id, symbol, "buy", amount)
+
+    def create_market_sell_order(self, symbol, amount, params=None):
+        return self.PM.fill(self.id, symbol, "sell", amount)
+
+    def fetch_balance(self, params=None):
+        total = dict(self.PM.balances.get(self.id, {}))
+        return {"total": total, "free": dict(total),
+                "used": {coin: 0.0 for coin in total}}
+
+    def fetch_order_book(self, symbol, limit=None):
+        return self.PM.get_order_book(self.id, symbol)
+
+    def fetch_my_trades(self, symbol=None, since=None, limit=None,
+                        params=None):
+        return [t for t in self.PM.fills if t["exchange"] == self.id and
+                (symbol is None or t["symbol"] == symbol) and
+                (since is None or t["timestamp"] >= since)][:limit]
+
+
+class DirectCalls(object):
+    """Stands in for the RateLimiter, the simulation needs no waiting."""
+    def __init__(self, exchanges):
+        self.exchanges = exchanges
+
+    def call(self, exchange, method, *args, **kwargs):
+        return getattr(self.exchanges[exchange], method)(*args, **kwargs)
+
+
+class SimulatedPortfolioManager(object):
+    """The market data methods of the PortfolioManager at a point in time.
+
+    Traders and strategies see the recorded books as of ``now`` and their
+    orders are filled against them, so they run unchanged in a backtest.
+    """
+    def __init__(self, market_index, exchanges, fx=None, balances=None,
+                 ohlcvs=None, freq="1d"):
+        """
+        :param balances: dict of exchange to dict of coin to amount
+        :param ohlcvs: dict of exchange to the candles keyed by symbol and
+            freq, like ``DataManager.ohlcvs``, for the last prices of
+            symbols without books
+        """
+        self.market_index = market_index
+        self.exchanges = {exchange: SimulatedExchange(self, exchange) for
+                          exchange in exchanges}
+        self.limiter = DirectCalls(self.exchanges)
+        # Orders are filled or canceled right away, there is nothing to track
+        self.orders = None
+        self.fx = fx
+        self.balances = {exchange: dict((balances or {}).get(exchange, {}))
+                         for exchange in exchanges}
+        self.ohlcvs = ohlcvs or {}
+        self.freq = freq
+        self.now = None
+        self.books = {}
+        self.fills = []
+        self._candles = {}
+
+    @property
+    def c(self):
+        return self.fx
+
+    def update(self, timestamp, books):
+        self.now = timestamp
+        self.books.update(books)
+
+    # -------------------------------------------------------------------------
+    # Market data
+    # -------------------------------------------------------------------------
+    def get_order_book(self, exchange, symbol, max_age=None):
+        book = self.books.get((exchange, symbol))
+        if book is None:
+            return None
+        if max_age is not None and self.now - book["timestamp"] > (
+                max_age * 1000):
+            return None
+        return book
+
+    def get_best_order(self, exchange, symbol, verbose=False):
+        book = self.get_order_book(exchange, symbol)
+        if book is None:
+            return {"bid": None, "ask": None}
+        return {"bid": book["bids"][0, 0] if len(book["bids"]) else None,
+                "ask": book["asks"][0, 0] if len(book["asks"]) else None}
+
+    def get_bid_ask_snapshot(self, exchange, max_age=None):
+        tickers = {}
+        for (ex, symbol) in self.books:
+            if ex == exchange:
+                tickers[symbol] = self.get_best_order(exchange, symbol)
+        return tickers
+
+    def get_last_price(self, exchange, symbol, verbose=True, max_age=None):
+        """Mid of the current book, else the close of the last candle."""
+        order = self.get_best_order(exchange, symbol)
+        if order["bid"] is not None and order["ask"] is not None:
+            return (order["bid"] + order["ask"]) / 2
+        candles = self._candle_arrays(exchange, symbol)
+        if candles is None:
+            return None
+        timestamps, closes = candles
+        position = np.searchsorted(timestamps, self.now, side="right") - 1
+        return closes[position] if position >= 0 else None
+
+    def _candle_arrays(self, exchange, symbol):
+        key = (exchange, symbol + self.freq)
+        if key not in self._candles:
+            frames = self.ohlcvs.get(exchange, {})
+            ohlcv = (frames[symbol + self.freq] if
+                     symbol + self.freq in frames else None)
+            self._candles[key] = None if ohlcv is None else (
+                ohlcv["timestamp"].to_numpy(dtype="i8"),
+                ohlcv["close"].to_numpy(dtype=float))
+        return self._candles[key]
+
+    # -------------------------------------------------------------------------
+    # Fills
+    # -------------------------------------------------------------------------
+    def fill(self, exchange, symbol, side, amount, price=None):
+        """
+        Fill an order against the current book.
+
+        :param price: limit price, None for a market order
+        :return: the order like ccxt's create_order
+        """
+        book = self.get_order_book(exchange, symbol)
+        levels = np.empty((0, 2)) if book is None else (
+            book["asks"] if side == "buy" else book["bids"])
+        levels = np.asarray(levels, dtype=float).reshape(-1, 2)
+        if price is not None:
+            within = (levels[:, 0] <= price if side == "buy" else
+                      levels[:, 0] >= price)
+            levels = levels[within]
+        filled = min(amount, levels[:, 1].sum()) if len(levels) else 0.0
+        cost = float(depth.walk_book(levels, [filled])[0]) if filled else 0.0
+        market = self.market_index.market(exchange, symbol) or {}
+        fee = cost * (market.get("taker") or 0)
+        base, quote = symbol.split("/")
+        balance = self.balances.setdefault(exchange, {})
+        sign = 1 if side == "buy" else -1
+        balance[base] = balance.get(base, 0) + sign * filled
+        balance[quote] = balance.get(quote, 0) - sign * cost - fee
+        order_id = str(len(self.fills))
+        order = {
+            "id": order_id, "timestamp": self.now, "symbol": symbol,
+            "type": "market" if price is None else "limit", "side": side,
+            "price": cost / filled if filled else price, "amount": amount,
+            "filled": filled, "remaining": amount - filled, "cost": cost,
+            "status": "closed" if filled == amount else "canceled",
+            "fee": {"cost": fee, "currency": quote}}
+        if filled:
+            self.fills.append({
+                "exchange": exchange, "id": order_id, "order": order_id,
+                "timestamp": self.now, "symbol": symbol, "type": order["type"],
+                "side": side, "takerOrMaker": "taker",
+                "price": order["price"], "amount": filled, "cost": cost,
+                "fee": order["fee"]})
+        return order
+
+
+class Backtest(object):
+    """Runs strategies over the stored history.
+
+    ``run`` feeds every snapshot to a callback with a simulated portfolio
+    manager, for traders that place orders. ``scan`` evaluates all
+    triangular opportunities of an exchange over the whole history with
+    the same formula as the live scanner, one window per NumPy pass.
+    """
+    def __init__(self, replay, market_index, fx=None, ohlcvs=None,
+                 freq="1d"):
+        self.replay = replay
+        self.market_index = market_index
+        self.fx = fx
+        self.ohlcvs = ohlcvs
+        self.freq = freq
+
+    @classmethod
+    def from_data(cls, DM, market_index, keys=None, start=None, end=None,
+                  window=DAY, **kwargs):
+        """Replay the order books and candles stored by a DataManager."""
+        replay = Replay(DM.book_store, keys=keys, start=start, end=end,
+                        window=window)
+        return cls(replay, market_index, ohlcvs=DM.ohlcvs, **kwargs)
+
+    def run(self, on_tick, balances=None):
+        """
+        Call ``on_tick(PM)`` at every recorded snapshot.
+
+        :param balances: starting balances, dict of exchange to coin amounts
+        :return: the simulated portfolio manager with its fills and balances
+        """
+        exchanges = sorted({exchange for exchange, _ in self.replay.keys})
+        PM = SimulatedPortfolioManager(
+            self.market_index, exchanges, fx=self.fx, balances=balances,
+            ohlcvs=self.ohlcvs, freq=self.freq)
+        for timestamp, books in self.replay.ticks():
+            PM.update(timestamp, books)
+            on_tick(PM)
+        return PM
+
+    def scan(self, exchange, amount=1, min_return=0.0, max_age=None):
+        """
+        Find every triangular opportunity of the exchange in the history.
+
+        :param max_age: ms after which a book is stale and not used
+        :return: DataFrame of the opportunities above ``min_return`` with
+            their time, triple, return and spreads
+        """
+        scanner = TriangularArbitrageScanner(self.market_index, exchange)
+        keys = [(exchange, symbol) for symbol in scanner.symbols]
+        stored = set(self.replay.keys)
+        found = []
+        for lo, hi in self.replay.windows():
+            timeline, books = self.replay.top_of_book(lo, hi,
+                                                      max_age=max_age)
+            if not len(timeline):
+                continue
+            bid = np.full((len(keys), len(timeline)), np.nan)
+            ask = np.full((len(keys), len(timeline)), np.nan)
+            for i, key in enumerate(keys):
+                if key in stored:
+                    bid[i], ask[i] = books[key]
+            profit = scanner.evaluate_history(bid, ask, amount=amount,
+                                              fx=self.fx)
+            with np.errstate(invalid="ignore"):
+                triples, times = np.nonzero(profit["return"] > min_return)
+            if not len(triples):
+                continue
+            table = scanner.triples.iloc[triples][
+                ["base", "quote1", "quote2"]].reset_index(drop=True)
+            table.insert(0, "timestamp", timeline[times])
+            for column in ["return", "spread_q1", "spread_q2", "cost"]:
+                table[column] = profit[column][triples, times]
+            found.append(table)
+        if not found:
+            return pd.DataFrame(columns=["timestamp", "base", "quote1",
+                                         "quote2", "return", "spread_q1",
+                                         "spread_q2", "cost"])
+        table = pd.concat(found, ignore_index=True)
+        table["datetime"] = pd.to_datetime(table["timestamp"], unit="ms")
+        return table.sort_values(["timestamp", "return"],
+                                 ascending=[True, False])
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for the hot paths of the managers
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+from TraderBetty.fake_exchange import FakeExchange, FakeFxFeed
+from TraderBetty.managers.markets import MarketIndex
+
+
+HISTORY_PATH = "data/benchmarks.json"
+# Relative slowdown against the recent runs that counts as a regression
+TOLERANCE = 0.2
+# Slowdowns below this many seconds are noise
+MIN_DELTA = 0.002
+# Number of saved runs whose median is compared against
+BASELINE_RUNS = 5
+COINS = ["USD", "EUR", "USDT", "BTC", "ETH", "LTC", "XRP"]
+# Modules whose cold import is measured, the dependencies for comparison
+IMPORT_MODULES = ["TraderBetty.managers.handlers",
+                  "TraderBetty.managers.portfolio", "TraderBetty.trader",
+                  "TraderBetty.managers.scheduler",
+                  "TraderBetty.managers.streaming", "pandas", "ccxt",
+                  "matplotlib.pyplot", "forex_python.converter"]
+IMPORT_SCRIPT = """
+import json, resource, time
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"time": elapsed, "rss": rss, "rss_delta": rss - before}}))
+"""
+
+
+class FakeConnectionHandler(object):
+    """Stands in for the ConnectionHandler with fake exchanges."""
+    def __init__(self, exchanges, wallets=None):
+        self.exchanges = exchanges
+        self.wallets = wallets or {}
+        self.market_index = MarketIndex(exchanges)
+        self.unavailable = set()
+
+
+@contextlib.contextmanager
+def sandbox(exchanges, coins=None, extra=""):
+    """Create a throw-away working directory with config and data folders.
+
+    Yields the path of the config file. The data managers use paths relative
+    to the working directory, so the directory is changed for the duration.
+
+    :param extra: further sections appended to the config file
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.ini")
+        with open(config_path, "w") as file:
+            file.write("[main]\nexchanges={:s}\nwallets=\ncoins={:s}\n".format(
+                ",".join(exchanges), ",".join(coins or COINS)))
+            file.write(extra)
+        os.makedirs(os.path.join(tmp, "data", "order_books"))
+        os.makedirs(os.path.join(tmp, "data", "ohlcv"))
+        os.chdir(tmp)
+        try:
+            yield config_path
+        finally:
+            os.chdir(cwd)
+
+
+def make_exchanges(n=5, latency=0.05, rate_limit=10):
+    exchanges = {}
+    for i in range(n):
+        ex = FakeExchange("fake%d" % i, latency=latency,
+                          rate_limit=rate_limit)
+        ex.load_markets()
+        exchanges[ex.id] = ex
+    return exchanges
+
+
+def timeit(func, *args, repeat=5, **kwargs):
+    """Return the best wall time of ``repeat`` calls in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_fan_out(n_exchanges=5, latency=0.05, symbol="ETH/BTC", repeat=5):
+    """Compare serial and concurrent cross-exchange snapshots."""
+    from TraderBetty.managers import config, portfolio
+
+    exchanges = make_exchanges(n_exchanges, latency=latency)
+    results = {}
+    with sandbox(exchanges) as config_path:
+        PM = portfolio.PortfolioManager(FakeConnectionHandler(exchanges),
+                                        config_path, config.FullConfigLoader)
+        for name, func in [("get_all_ex_lp", PM.get_all_ex_lp),
+                           ("get_all_ex_bid_ask", PM.get_all_ex_bid_ask)]:
+            def uncached(*args, **kwargs):
+                # Measure the round trips, not the market data cache
+                PM.cache.clear()
+                return func(*args, **kwargs)
+            serial = timeit(uncached, symbol, parallel=False, repeat=repeat)
+            parallel = timeit(uncached, symbol, parallel=True, repeat=repeat)
+            results[name] = {"serial": serial, "parallel": parallel,
+                             "speedup": serial / parallel}
+        PM.close()
+    return results
+
+
+def bench_rate_limiter(n_exchanges=5, rate_limit=50, requests=20):
+    """Measure the throughput of the limiter against the sum of limits."""
+    from TraderBetty.managers.ratelimit import RateLimiter
+
+    exchanges = make_exchanges(n_exchanges, latency=0, rate_limit=rate_limit)
+    limiter = RateLimiter(exchanges)
+    start = time.perf_counter()
+    futures = [limiter.submit(exchange, "fetch_ticker", "ETH/BTC")
+               for _ in range(requests) for exchange in exchanges]
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    limiter.shutdown()
+    return {"requests_per_sec": len(futures) / elapsed,
+            "limit_per_sec": n_exchanges * 1000 / rate_limit}
+
+
+def bench_scanner(n_bases=300, repeat=100):
+    """Time one evaluation of all triangular triples of an exchange."""
+    from TraderBetty.strategies.triangular import TriangularArbitrageScanner
+
+    quotes = ["BTC", "ETH", "USDT", "USD", "EUR"]
+    symbols = ["C%d/%s" % (i, quote) for i in range(n_bases)
+               for quote in quotes]
+    symbols += ["ETH/BTC", "BTC/USDT", "ETH/USDT", "BTC/USD", "BTC/EUR"]
+    ex = FakeExchange("fake", symbols=symbols, latency=0)
+    ex.load_markets()
+    scanner = TriangularArbitrageScanner(MarketIndex({ex.id: ex}), ex.id)
+    scanner.update(ex.fetch_tickers())
+    elapsed = timeit(scanner.evaluate_arrays, repeat=repeat)
+    return {"triples": len(scanner.triples), "per_tick": elapsed}
+
+
+def make_payloads(n, seed=0):
+    """Return n ccxt-like trades, n candles and a book with n levels."""
+    import random
+
+    rng = random.Random(seed)
+    start = 1500000000000
+    trades = []
+    for i in range(n):
+        timestamp = start + i * 1000
+        trades.append({
+            "info": {}, "id": str(i), "timestamp": timestamp,
+            "datetime": time.strftime(
+                "%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp // 1000)),
+            "symbol": "ETH/BTC", "order": None, "type": "limit",
+            "side": rng.choice(["buy", "sell"]), "takerOrMaker": "taker",
+            "price": rng.uniform(0.05, 0.1), "amount": rng.uniform(0, 10),
+            "cost": None, "fee": {"cost": 0.001, "currency": "BTC"}})
+    ohlcv = [[start + i * 60000] + [rng.uniform(1, 2) for _ in range(5)]
+             for i in range(n)]
+    book = {"bids": [[1 - i * 1e-4, rng.uniform(0, 5)] for i in range(n)],
+            "asks": [[1 + i * 1e-4, rng.uniform(0, 5)] for i in range(n)],
+            "timestamp": start}
+    return trades, ohlcv, book
+
+
+def bench_ingest(n=100000, repeat=3):
+    """Compare the per-record cost of the old and the columnar ingestion."""
+    import io
+    import json
+    import datetime as dt
+    import pandas as pd
+    from TraderBetty.managers import ingest
+    from TraderBetty.managers.store import book_to_records
+
+    trades, ohlcv, book = make_payloads(n)
+
+    def old_trades():
+        tradesdf = pd.read_json(io.StringIO(json.dumps(trades)))
+        tradesdf["date"] = tradesdf["datetime"].apply(lambda d: d.date())
+
+    def old_ohlcv():
+        ohlcvdf = pd.DataFrame(ohlcv, columns=ingest.OHLCV_FIELDS)
+        ohlcvdf["datetime"] = ohlcvdf["timestamp"].apply(
+            lambda d: dt.datetime.fromtimestamp(int(d / 1000)))
+
+    def old_book():
+        asks = pd.DataFrame(book["asks"],
+                            columns=[("asks", "price"), ("asks", "volume")])
+        bids = pd.DataFrame(book["bids"],
+                            columns=[("bids", "price"), ("bids", "volume")])
+        pd.concat([asks, bids], axis=1)
+
+    results = {}
+    for name, old, new, records in [
+            ("trades", old_trades, lambda: ingest.trades_frame(trades), n),
+            ("ohlcv", old_ohlcv, lambda: ingest.ohlcv_frame(ohlcv), n),
+            ("order_book", old_book, lambda: book_to_records(book),
+             2 * n)]:
+        results[name] = {"old": timeit(old, repeat=repeat) / records,
+                         "new": timeit(new, repeat=repeat) / records}
+    return results
+
+
+def bench_imports(modules=None):
+    """
+    Import every module in a fresh interpreter.
+
+    :return: dict of module to import time in s and max RSS in KiB, None
+        for modules that can't be imported here
+    """
+    results = {}
+    for module in modules or IMPORT_MODULES:
+        proc = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT.format(module=module)],
+            capture_output=True, text=True)
+        results[module] = (json.loads(proc.stdout) if proc.returncode == 0
+                           else None)
+    return results
+
+
+@contextlib.contextmanager
+def portfolio_manager(n_exchanges=5, latency=0.005):
+    """Yield a PortfolioManager over fake exchanges in a sandbox."""
+    from TraderBetty.managers import config, portfolio
+    from TraderBetty.managers.fx import FxRates
+
+    exchanges = make_exchanges(n_exchanges, latency=latency)
+    with sandbox(exchanges) as config_path:
+        PM = portfolio.PortfolioManager(FakeConnectionHandler(exchanges),
+                                        config_path, config.FullConfigLoader)
+        PM.fx = FxRates(feed=FakeFxFeed(latency=latency))
+        try:
+            yield PM
+        finally:
+            PM.close()
+
+
+def bench_startup(n_exchanges=5, latency=0.05, repeat=3):
+    """Time the ConnectionHandler with an empty and a warm markets cache."""
+    import shutil
+    from TraderBetty.managers import config
+    from TraderBetty.managers.handlers import ConnectionHandler
+
+    names = ["fake%d" % i for i in range(n_exchanges)]
+    with sandbox(names, extra="[markets]\nbackground_refresh=false\n") as \
+            config_path:
+        with open("keys.json", "w") as file:
+            json.dump({name: {} for name in names}, file)
+
+        def factory(exchange, exchange_config):
+            return FakeExchange(exchange, latency=latency)
+
+        def start(cold):
+            if cold:
+                shutil.rmtree("data/markets", ignore_errors=True)
+            ConnectionHandler(config_path, config.ConnectionConfigLoader,
+                              "keys.json", exchange_factory=factory)
+        return {"cold": timeit(start, True, repeat=repeat),
+                "warm": timeit(start, False, repeat=repeat)}
+
+
+def bench_portfolio(n_exchanges=5, latency=0.005, repeat=5):
+    """
+    Time the portfolio paths that hit the exchanges on every call.
+
+    Caches are cleared before every call, so the round trips are measured.
+    """
+    from TraderBetty.trader import ArbitrageTrader
+    from TraderBetty.strategies.arbitrage import OnExchangeArbitrageStrategy
+
+    with portfolio_manager(n_exchanges, latency=latency) as PM:
+        def uncached(func, *args):
+            PM.cache.clear()
+            return func(*args)
+
+        def arbitrage_loop():
+            PM.cache.clear()
+            for exchange in PM.exchanges:
+                for quote1, quote2 in [("USDT", "BTC"), ("USD", "EUR")]:
+                    arb_dict = trader.get_data(exchange, "ETH", quote1,
+                                               quote2)
+                    trader.calc_profit(arb_dict)
+
+        PM.get_all_ex_balances()
+        trader = ArbitrageTrader(PM, OnExchangeArbitrageStrategy())
+        return {
+            "get_last_prices": timeit(uncached, PM.get_last_prices,
+                                      repeat=repeat),
+            "get_ttl_eurvalue": timeit(uncached, PM.get_ttl_eurvalue,
+                                       repeat=repeat),
+            "arbitrage_loop": timeit(arbitrage_loop, repeat=repeat)}
+
+
+def bench_persistence(n_exchanges=5, trades=1000, repeat=3):
+    """Time updating prices, balances and trades and writing them out."""
+    from TraderBetty.managers import ingest
+
+    payloads = {}
+    best = None
+    for _ in range(repeat):
+        # A fresh data folder every time, so the same trades are new
+        with portfolio_manager(n_exchanges, latency=0) as PM:
+            for exchange in PM.exchanges:
+                if exchange not in payloads:
+                    payloads[exchange] = FakeExchange(
+                        exchange, latency=0, trades=trades).fetch_my_trades()
+            start = time.perf_counter()
+            for exchange, ex in PM.exchanges.items():
+                for symbol, ticker in ex.fetch_tickers().items():
+                    PM.update_ex_price(exchange, symbol, ticker["last"])
+                PM.update_balance(exchange, ex.fetch_balance()["total"])
+                PM.update_trades(exchange, ingest.trades_frame(
+                    payloads[exchange], exchange))
+            PM.flush(force=True)
+            PM.export_trades()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"update_and_flush": best}
+
+
+# -----------------------------------------------------------------------------
+# Regression tracking
+# -----------------------------------------------------------------------------
+def collect():
+    """Run the offline benchmarks, return a flat dict of seconds."""
+    metrics = {}
+    for name, value in bench_startup().items():
+        metrics["startup_" + name] = value
+    metrics.update(bench_portfolio())
+    metrics.update(bench_persistence())
+    for name, value in bench_fan_out().items():
+        metrics["fan_out_" + name] = value["parallel"]
+    metrics["scanner_per_tick"] = bench_scanner()["per_tick"]
+    n = 100000
+    for name, value in bench_ingest(n).items():
+        records = 2 * n if name == "order_book" else n
+        metrics["ingest_" + name] = value["new"] * records
+    return metrics
+
+
+def load_history(path=HISTORY_PATH):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+
+def save_history(metrics, path=HISTORY_PATH):
+    history = load_history(path)
+    history.append({"timestamp": time.time(), "metrics": metrics})
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(history, file, indent=2)
+
+
+def compare(metrics, history, tolerance=TOLERANCE):
+    """
+    Compare the metrics with the median of the recent saved runs.
+
+    :return: dict of metric to (baseline, current) for every metric that
+        got slower by more than the tolerance
+    """
+    regressions = {}
+    recent = [entry["metrics"] for entry in history[-BASELINE_RUNS:]]
+    for name, value in metrics.items():
+        previous = sorted(run[name] for run in recent if name in run)
+        if not previous:
+            continue
+        baseline = previous[len(previous) // 2]
+        if (value > baseline * (1 + tolerance) and
+                value - baseline > MIN_DELTA):
+            regressions[name] = (baseline, value)
+    return regressions
+
+
+def track(history_path=HISTORY_PATH, save=False, tolerance=TOLERANCE):
+    metrics = collect()
+    regressions = compare(metrics, load_history(history_path), tolerance)
+    for name, value in sorted(metrics.items()):
+        flag = "  REGRESSION" if name in regressions else ""
+        print("{:<28s} {:10.3f}ms{:s}".format(name, value * 1000, flag))
+    if save:
+        save_history(metrics, history_path)
+    return 1 if regressions else 0
+
+
+def report():
+    results = bench_fan_out()
+    for name, result in results.items():
+        print("{:<20s} serial {:7.3f}s  parallel {:7.3f}s  x{:.1f}".format(
+            name, result["serial"], result["parallel"], result["speedup"]))
+    result = bench_rate_limiter()
+    print("{:<20s} {:7.1f} req/s of {:.1f} req/s budget".format(
+        "rate_limiter", result["requests_per_sec"], result["limit_per_sec"]))
+    result = bench_scanner()
+    print("{:<20s} {:d} triples in {:.3f}ms".format(
+        "triangular_scanner", result["triples"], result["per_tick"] * 1000))
+    for module, result in bench_imports().items():
+        if result is None:
+            print("{:<32s} not installed".format(module))
+            continue
+        print("{:<32s} {:7.1f}ms  rss {:7.1f}MiB  +{:6.1f}MiB".format(
+            module, result["time"] * 1000, result["rss"] / 1024,
+            result["rss_delta"] / 1024))
+    for name, result in bench_ingest().items():
+        print("{:<20s} old {:6.2f}us  new {:6.2f}us per record  x{:.1f}"
+              .format("ingest_" + name, result["old"] * 1e6,
+                      result["new"] * 1e6, result["old"] / result["new"]))
+    result = bench_startup()
+    print("{:<20s} cold {:7.3f}s  warm {:7.3f}s".format(
+        "startup", result["cold"], result["warm"]))
+    for name, value in bench_portfolio().items():
+        print("{:<20s} {:7.3f}ms".format(name, value * 1000))
+    for name, value in bench_persistence().items():
+        print("{:<20s} {:7.3f}ms".format(name, value * 1000))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--track", action="store_true",
+                        help="compare with the recent saved runs, exit with 1 "
+                             "on regressions")
+    parser.add_argument("--save", action="store_true",
+                        help="append this run to the history")
+    parser.add_argument("--history", default=HISTORY_PATH,
+                        help="history file, default %(default)s")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="allowed slowdown, default %(default)s")
+    args = parser.parse_args(args)
+    if args.track or args.save:
+        return track(os.path.abspath(args.history), save=args.save,
+                     tolerance=args.tolerance)
+    report()
+    return 0
+
+
+if __name__ == "__main__":
+    status = main()
+    sys.exit(status)
@@ -1,29 +1,46 @@
 """Implementation of the etherscan.io API"""
 import os
 import json
-from configparser import ConfigParser
-import requests
+from urllib.parse import urlencode
+
+from TraderBetty.managers.config import load_section
+from TraderBetty.managers.wallets import BalanceChecker, ConnectionPool, \
+    split_addresses
 
 # base url for own scrape
 BASE_URL = "https://api.etherscan.io/api"
 MODULE = "account"
 PATH = "data"
+# Addresses the balancemulti action accepts per call
+MAX_ADDRESSES = 20
+DEFAULTS = {
+    "addresses": "",
+    "interval": 15.0,
+    # The free API allows five calls per second
+    "workers": 4,
+    "timeout": 10.0,
+}
 
 
-class Scanner:
-    def __init__(self, configfile, key_file):
-        self.session = requests.Session()
-
-        self.config = ConfigParser()
+class Scanner(BalanceChecker):
+    """Balances in wei of the addresses of the [ether_wallet] section."""
+    coin = "ETH"
 
+    def __init__(self, configfile, key_file, base_url=BASE_URL):
         if not os.path.isfile(configfile):
             raise ValueError
 
-        self.config.read(configfile)
-        self.config_addresses = self.config.get(
-            'ether_wallet', 'addresses').split(',')
-
+        options = load_section(configfile, "ether_wallet", DEFAULTS)
+        # Addresses are hex, in any case, the first spelling is kept
+        addresses = {}
+        for address in split_addresses(options["addresses"]):
+            addresses.setdefault(address.lower(), address)
+        super().__init__(list(addresses.values()),
+                         options["interval"] * 60, MAX_ADDRESSES,
+                         workers=options["workers"])
         self.API_KEY = self._get_api_key(key_file)
+        self.connections = ConnectionPool(base_url, size=options["workers"],
+                                          timeout=options["timeout"])
 
     def _get_api_key(self, key_file):
         # Load the api keys from keys file
@@ -32,23 +49,21 @@ class Scanner:
         api_key = keys["etherscan"]["apiKey"]
         return api_key
 
-    def check_balance(self):
-        addresses = self.config_addresses
-        if not addresses:
-            print("No valid addresses found. Aborting!")
-            return None
-        if len(addresses) > 1:
-            action = "multibalance"
-            addresses = ",".join(addresses)
-        else:
-            action = "balance"
-            addresses = addresses[0]
-        modact = "?module={:s}&action={:s}".format(MODULE, action)
-        url = BASE_URL + modact + (
-            "&address={:s}&tag=latest&apikey={:s}".format(
-                addresses, self.API_KEY)
-        )
-        r = self.session.get(url)
-        content = r.content.decode('utf-8', 'ignore')
-        balances = json.loads(content)
-        return balances
+    def _fetch(self, addresses):
+        query = urlencode({"module": MODULE, "action": "balancemulti",
+                           "address": ",".join(addresses), "tag": "latest",
+                           "apikey": self.API_KEY}, safe=",")
+        status, data = self.connections.request("GET", "?" + query)
+        content = json.loads(data.decode('utf-8', 'ignore'))
+        if status != 200 or content.get("status") != "1":
+            raise ValueError(content.get("result") or content.get("message")
+                             or status)
+        # Map the accounts back to the addresses as configured
+        configured = {address.lower(): address for address in addresses}
+        return {configured.get(account["account"].lower(),
+                               account["account"]): int(account["balance"])
+                for account in content["result"]}
+
+    def close(self):
+        super().close()
+        self.connections.close()
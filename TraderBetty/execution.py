@@ -0,0 +1,272 @@
+"""Concurrent execution of multi-leg orders"""
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from TraderBetty.managers.metrics import (EXECUTION_LATENCY,
+                                          EXECUTION_OUTCOMES, LEG_LATENCY)
+
+
+# Order states of a leg
+PENDING, OPEN, FILLED, FAILED, CANCELED = (
+    "pending", "open", "filled", "failed", "canceled")
+
+
+class OrderValidationError(ValueError):
+    """A leg doesn't fit the precision or limits of its market."""
+
+
+def round_to_precision(value, precision, down=False):
+    """
+    Round to the precision of a ccxt market.
+
+    :param precision: number of decimal places, or the tick size if it is
+        a fraction
+    :param down: truncate instead of rounding to the nearest step
+    """
+    if precision is None:
+        return value
+    step = precision if 0 < precision < 1 else 10 ** -int(precision)
+    steps = value / step
+    # Don't let float noise push a value on a step to the one below
+    steps = math.floor(steps + 1e-9) if down else round(steps)
+    return float("%.12g" % (steps * step))
+
+
+class Leg(object):
+    """One order of a multi-leg execution and its state."""
+    def __init__(self, exchange, symbol, side, amount, price=None):
+        """:param price: limit price, None for a market order"""
+        self.exchange = exchange
+        self.symbol = symbol
+        self.side = side
+        self.amount = amount
+        self.price = price
+        self.status = PENDING
+        self.order = None
+        self.error = None
+        self.filled = 0.0
+        self.hedge = None
+        # Seconds from sending to the exchange's acknowledgement
+        self.latency = None
+        self.acked = None
+
+    @property
+    def type(self):
+        return "market" if self.price is None else "limit"
+
+    def update(self, order):
+        self.order = order
+        # Cancel responses often leave out the fills, they never shrink
+        self.filled = max(self.filled, order.get("filled") or 0.0)
+        status = order.get("status")
+        if status == "closed" or (self.filled and self.filled >= self.amount):
+            self.status = FILLED
+        elif status in ("canceled", "expired", "rejected"):
+            self.status = CANCELED
+        else:
+            self.status = OPEN
+
+    def report(self):
+        return {"exchange": self.exchange, "symbol": self.symbol,
+                "side": self.side, "amount": self.amount,
+                "price": self.price, "status": self.status,
+                "filled": self.filled, "latency": self.latency,
+                "error": None if self.error is None else str(self.error),
+                "order_id": self.order.get("id") if self.order else None,
+                "hedged": self.hedge is not None}
+
+    def __repr__(self):
+        return "Leg(%s %s %s %s@%s %s)" % (
+            self.exchange, self.side, self.symbol, self.amount, self.price,
+            self.status)
+
+
+class Execution(object):
+    def __init__(self, legs, signal_time):
+        self.legs = legs
+        self.signal_time = signal_time
+        self.finished = None
+
+    @property
+    def success(self):
+        return all(leg.status == FILLED for leg in self.legs)
+
+    @property
+    def signal_to_last_ack(self):
+        """Seconds from the signal until every leg was acknowledged."""
+        acked = [leg.acked for leg in self.legs if leg.acked is not None]
+        if len(acked) < len(self.legs):
+            return None
+        return max(acked) - self.signal_time
+
+    def report(self):
+        return {"success": self.success,
+                "signal_to_last_ack": self.signal_to_last_ack,
+                "legs": [leg.report() for leg in self.legs]}
+
+
+class MultiLegExecutor(object):
+    """Sends the legs of an opportunity at once and follows their fills.
+
+    All legs are checked against the precision and limits of their cached
+    markets before any is sent. Legs are then sent concurrently, each
+    through the rate limiter of its exchange, and followed until they are
+    filled or ``fill_timeout`` passed. If any leg fails, the open legs are
+    canceled and, with ``hedge``, what the others filled is reversed at
+    market, so no position is left over.
+    """
+    def __init__(self, PM, fill_timeout=10.0, poll_interval=0.5, hedge=True,
+                 max_workers=8, tracker=None):
+        """
+        :param PM: manager with the ``limiter`` and ``market_index``
+        :param tracker: OrderTracker to follow the legs with, one bulk
+            refresh per exchange instead of fetching every leg
+        """
+        self.PM = PM
+        self.tracker = tracker
+        self.fill_timeout = fill_timeout
+        self.poll_interval = poll_interval
+        self.hedge = hedge
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+    # -------------------------------------------------------------------------
+    # Validation
+    # -------------------------------------------------------------------------
+    def validate(self, leg):
+        """Round the leg to the precision of its market, check the limits."""
+        market = self.PM.market_index.market(leg.exchange, leg.symbol)
+        if market is None:
+            raise OrderValidationError("%s isn't traded on %s" % (
+                leg.symbol, leg.exchange))
+        precision = market.get("precision") or {}
+        limits = market.get("limits") or {}
+        leg.amount = round_to_precision(leg.amount, precision.get("amount"),
+                                        down=True)
+        if leg.price is not None:
+            leg.price = round_to_precision(leg.price, precision.get("price"))
+        checks = [("amount", leg.amount), ("price", leg.price),
+                  ("cost", None if leg.price is None else
+                   leg.amount * leg.price)]
+        for name, value in checks:
+            limit = limits.get(name) or {}
+            if value is None:
+                continue
+            if limit.get("min") is not None and value < limit["min"]:
+                raise OrderValidationError("%s %s of %s is below %s" % (
+                    leg.symbol, name, value, limit["min"]))
+            if limit.get("max") is not None and value > limit["max"]:
+                raise OrderValidationError("%s %s of %s is above %s" % (
+                    leg.symbol, name, value, limit["max"]))
+        if leg.amount <= 0:
+            raise OrderValidationError("%s amount rounds to 0" % leg.symbol)
+        return leg
+
+    # -------------------------------------------------------------------------
+    # Execution
+    # -------------------------------------------------------------------------
+    def execute(self, legs, signal_time=None):
+        """
+        Execute all legs concurrently.
+
+        :param signal_time: ``time.monotonic()`` when the opportunity was
+            seen, defaults to now
+        :return: the Execution with the state of every leg
+        """
+        signal_time = time.monotonic() if signal_time is None else (
+            signal_time)
+        for leg in legs:
+            self.validate(leg)
+        execution = Execution(legs, signal_time)
+        list(self.pool.map(self._send, legs))
+        if execution.signal_to_last_ack is not None:
+            EXECUTION_LATENCY.observe(execution.signal_to_last_ack)
+        self._follow(legs)
+        if not execution.success:
+            self._unwind(legs)
+        execution.finished = time.monotonic()
+        EXECUTION_OUTCOMES.inc("filled" if execution.success else "unwound")
+        return execution
+
+    def _call(self, leg, method, *args):
+        return self.PM.limiter.call(leg.exchange, method, *args)
+
+    def _send(self, leg):
+        method = "create_%s_%s_order" % (leg.type, leg.side)
+        args = [leg.symbol, leg.amount] + (
+            [] if leg.price is None else [leg.price])
+        start = time.monotonic()
+        try:
+            order = self._call(leg, method, *args)
+        except Exception as e:
+            leg.status, leg.error = FAILED, e
+            print("Leg %s failed: %s" % (leg, e))
+            return leg
+        leg.acked = time.monotonic()
+        leg.latency = leg.acked - start
+        LEG_LATENCY.observe(leg.latency, leg.exchange)
+        leg.update(order)
+        if self.tracker is not None:
+            self.tracker.track(leg.exchange, order)
+        return leg
+
+    def _follow(self, legs):
+        """Poll the open legs until they are filled or time is up."""
+        deadline = time.monotonic() + self.fill_timeout
+        while True:
+            if any(leg.status == FAILED for leg in legs):
+                return
+            open_legs = [leg for leg in legs if leg.status == OPEN]
+            if not open_legs or time.monotonic() >= deadline:
+                return
+            time.sleep(min(self.poll_interval,
+                           max(deadline - time.monotonic(), 0)))
+            if self.tracker is None:
+                list(self.pool.map(self._refresh, open_legs))
+                continue
+            try:
+                self.tracker.refresh_all({leg.exchange for leg in open_legs})
+            except Exception as e:
+                # Keep polling, the legs are unwound if time runs out
+                print("Legs could not be refreshed: %s" % e)
+                continue
+            for leg in open_legs:
+                order = self.tracker.get(leg.exchange, leg.order["id"])
+                if order is not None:
+                    leg.update(order)
+
+    def _refresh(self, leg):
+        try:
+            leg.update(self._call(leg, "fetch_order", leg.order["id"],
+                                  leg.symbol))
+        except Exception as e:
+            print("Leg %s could not be fetched: %s" % (leg, e))
+
+    def _unwind(self, legs):
+        """Cancel the open legs and reverse what the others filled."""
+        def unwind(leg):
+            if leg.status == OPEN:
+                try:
+                    order = self._call(leg, "cancel_order", leg.order["id"],
+                                       leg.symbol)
+                    leg.update(order)
+                    if self.tracker is not None:
+                        self.tracker.apply(leg.exchange, order)
+                except Exception as e:
+                    print("Leg %s could not be canceled: %s" % (leg, e))
+                leg.status = CANCELED
+            if self.hedge and leg.filled:
+                side = "sell" if leg.side == "buy" else "buy"
+                try:
+                    leg.hedge = self._call(
+                        leg, "create_market_%s_order" % side, leg.symbol,
+                        leg.filled)
+                    if self.tracker is not None:
+                        self.tracker.track(leg.exchange, leg.hedge)
+                except Exception as e:
+                    print("Leg %s could not be hedged: %s" % (leg, e))
+            return leg
+        list(self.pool.map(unwind, legs))
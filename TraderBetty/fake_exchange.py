@@ -0,0 +1,374 @@
+"""Offline stand-in for ccxt exchanges"""
+import copy
+import json
+import time
+import random
+
+
+DEFAULT_SYMBOLS = ["ETH/BTC", "LTC/BTC", "XRP/BTC", "BTC/USDT", "ETH/USDT",
+                   "BTC/EUR", "ETH/EUR", "BTC/USD", "ETH/USD", "USDT/USD"]
+
+TIMEFRAMES = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+REFERENCE_PRICES = {"USD": 1.0, "USDT": 1.0, "EUR": 1.15, "BTC": 8000.0,
+                    "ETH": 500.0, "LTC": 120.0, "XRP": 0.5}
+
+
+class FakeOrderRejected(Exception):
+    """The FakeExchange refused an order."""
+
+
+class FakeExchange(object):
+    """Mimics the parts of a ccxt exchange the managers use.
+
+    Every request sleeps ``latency`` seconds to simulate the network round
+    trip, so the behaviour of the managers can be measured without live
+    exchanges. Payloads are replayed from a ``recording`` made with
+    ``record_exchange`` where it has them, everything else is generated
+    from the reference prices.
+    """
+    def __init__(self, exchange_id, symbols=None, latency=0.05,
+                 rate_limit=1000, seed=None, recording=None, trades=200):
+        self.recording = recording or {}
+        if symbols is None and self.recording.get("markets"):
+            symbols = list(self.recording["markets"])
+        self.id = exchange_id
+        self.name = exchange_id.capitalize()
+        self.latency = latency
+        self.rateLimit = rate_limit
+        self.has = {
+            "fetchTicker": True,
+            "fetchTickers": True,
+            "fetchOrderBook": True,
+            "fetchOHLCV": True,
+            "fetchMyTrades": True,
+            "fetchBalance": True,
+            "createOrder": True,
+            "fetchOrder": True,
+            "cancelOrder": True,
+            "fetchOpenOrders": True,
+            "fetchClosedOrders": True,
+        }
+        self.symbols = list(symbols) if symbols else list(DEFAULT_SYMBOLS)
+        self.markets = {}
+        self.currencies = {}
+        self.requests = 0
+        self.orders = {}
+        # Orders on these symbols are rejected, to simulate failing legs
+        self.reject_symbols = set()
+        self._random = random.Random(seed if seed is not None else
+                                     exchange_id)
+        # Prices derive from reference USD prices, every exchange deviates a
+        # little so they are consistent but not identical
+        self._prices = {}
+        for symbol in self.symbols:
+            base, quote = symbol.split("/")
+            deviation = self._random.uniform(0.995, 1.005)
+            self._prices[symbol] = (self._reference(base) /
+                                    self._reference(quote) * deviation)
+        self._trades = self._make_trades(trades)
+
+    @classmethod
+    def from_recording(cls, path, latency=0.05, rate_limit=1000):
+        with open(path) as file:
+            recording = json.load(file)
+        return cls(recording["id"], latency=latency, rate_limit=rate_limit,
+                   recording=recording)
+
+    def _replay(self, kind, *keys):
+        """Return a copy of a recorded payload or None."""
+        payload = self.recording.get(kind)
+        for key in keys:
+            if payload is None:
+                return None
+            payload = payload.get(key)
+        return copy.deepcopy(payload)
+
+    def _make_trades(self, n):
+        if "trades" in self.recording:
+            return self.recording["trades"]
+        trades = []
+        start = self._timestamp() - 30 * 86400 * 1000
+        for i in range(n):
+            symbol = self._random.choice(self.symbols)
+            timestamp = start + i * 30 * 86400 * 1000 // max(n, 1)
+            price = self._prices[symbol] * self._random.uniform(0.95, 1.05)
+            amount = self._random.uniform(0.01, 2)
+            base, quote = symbol.split("/")
+            trades.append({
+                "info": {}, "id": "%s-%d" % (self.id, i),
+                "timestamp": timestamp,
+                "datetime": time.strftime("%Y-%m-%dT%H:%M:%S.000Z",
+                                          time.gmtime(timestamp // 1000)),
+                "symbol": symbol, "order": None, "type": "limit",
+                "side": self._random.choice(["buy", "sell"]),
+                "takerOrMaker": "taker", "price": price, "amount": amount,
+                "cost": price * amount,
+                "fee": {"cost": price * amount * 0.002, "currency": quote}})
+        return trades
+
+    @staticmethod
+    def _reference(coin):
+        if coin in REFERENCE_PRICES:
+            return REFERENCE_PRICES[coin]
+        return random.Random(coin).uniform(0.01, 100)
+
+    def _request(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _timestamp(self):
+        return int(time.time() * 1000)
+
+    def load_markets(self, reload=False):
+        if self.markets and not reload:
+            return self.markets
+        self._request()
+        if self.recording.get("markets"):
+            return self.set_markets(self._replay("markets"),
+                                    self._replay("currencies"))
+        for symbol in self.symbols:
+            base, quote = symbol.split("/")
+            self.markets[symbol] = {
+                "id": symbol.replace("/", ""), "symbol": symbol,
+                "base": base, "quote": quote, "active": True,
+                "taker": 0.002, "maker": 0.001,
+                "precision": {"amount": 8, "price": 8},
+                "limits": {"amount": {"min": 0.001, "max": None},
+                           "price": {"min": None, "max": None},
+                           "cost": {"min": None, "max": None}}}
+        return self.markets
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = dict(markets)
+        self.currencies = dict(currencies or {})
+        return self.markets
+
+    def market(self, symbol):
+        if not self.markets:
+            self.load_markets()
+        return self.markets[symbol]
+
+    def _ticker(self, symbol):
+        last = self._prices[symbol]
+        return {"symbol": symbol, "timestamp": self._timestamp(),
+                "last": last, "bid": last * 0.999, "ask": last * 1.001}
+
+    def fetch_ticker(self, symbol):
+        self._request()
+        return self._replay("tickers", symbol) or self._ticker(symbol)
+
+    def fetch_tickers(self, symbols=None):
+        self._request()
+        return {s: self._replay("tickers", s) or self._ticker(s) for
+                s in (symbols or self.symbols)}
+
+    def fetch_order_book(self, symbol, limit=None):
+        self._request()
+        recorded = self._replay("order_books", symbol)
+        if recorded is not None:
+            return recorded
+        last = self._prices[symbol]
+        depth = limit or 20
+        ts = self._timestamp()
+        return {
+            "bids": [[last * (1 - 0.001 * (i + 1)), 1.0 + i]
+                     for i in range(depth)],
+            "asks": [[last * (1 + 0.001 * (i + 1)), 1.0 + i]
+                     for i in range(depth)],
+            "timestamp": ts,
+            "datetime": None,
+            "nonce": ts,
+        }
+
+    def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None):
+        self._request()
+        recorded = self._replay("ohlcv", symbol, timeframe)
+        if recorded is not None:
+            candles = [c for c in recorded if since is None or c[0] >= since]
+            return candles[:limit] if limit else candles
+        step = int(timeframe[:-1]) * TIMEFRAMES[timeframe[-1]] * 1000
+        limit = limit or 500
+        # Only candles that have started, the last one is still open
+        last = self._timestamp() // step * step
+        first = last - (limit - 1) * step if since is None else (
+            -(-since // step) * step)
+        price = self._prices[symbol]
+        candles = []
+        for ts in range(first, min(last, first + (limit - 1) * step) + 1,
+                        step):
+            wave = 1 + 0.01 * ((ts // step) % 7 - 3)
+            candles.append([ts, price * wave, price * wave * 1.01,
+                            price * wave * 0.99, price * wave, 10.0])
+        return candles
+
+    def fetch_my_trades(self, symbol=None, since=None, limit=None,
+                        params=None):
+        self._request()
+        trades = [t for t in self._trades if
+                  (symbol is None or t["symbol"] == symbol) and
+                  (since is None or t["timestamp"] >= since)]
+        return copy.deepcopy(trades[:limit] if limit else trades)
+
+    def fetch_balance(self, params=None):
+        self._request()
+        recorded = self._replay("balance")
+        if recorded is not None:
+            return recorded
+        total = {}
+        for trade in self._trades:
+            base, quote = trade["symbol"].split("/")
+            sign = 1 if trade["side"] == "buy" else -1
+            total[base] = total.get(base, 0) + sign * trade["amount"]
+            total[quote] = total.get(quote, 0) - sign * trade["cost"]
+        # Start from enough funds for every trade
+        total = {coin: abs(amount) for coin, amount in total.items()}
+        return {"total": total, "free": dict(total),
+                "used": {coin: 0.0 for coin in total}}
+
+    # -------------------------------------------------------------------------
+    # Orders
+    # -------------------------------------------------------------------------
+    def create_order(self, symbol, type, side, amount, price=None,
+                     params=None):
+        """
+        Place an order, it is filled right away if it crosses the ticker.
+
+        Limit orders that don't cross stay open until canceled.
+        """
+        self._request()
+        if symbol in self.reject_symbols or symbol not in self._prices:
+            raise FakeOrderRejected("%s rejected the %s order on %s" % (
+                self.id, side, symbol))
+        ticker = self._ticker(symbol)
+        fill_price = ticker["ask"] if side == "buy" else ticker["bid"]
+        crosses = type == "market" or (
+            price >= fill_price if side == "buy" else price <= fill_price)
+        order_id = "%s-order-%d" % (self.id, len(self.orders))
+        order = {
+            "info": {}, "id": order_id, "timestamp": ticker["timestamp"],
+            "lastTradeTimestamp": None, "symbol": symbol, "type": type,
+            "side": side, "price": price, "average": None,
+            "amount": amount, "filled": 0.0,
+            "remaining": amount, "cost": 0.0, "status": "open",
+            "fee": {"cost": 0.0, "currency": symbol.split("/")[1]}}
+        self.orders[order_id] = order
+        if crosses:
+            self._fill(order, amount, fill_price)
+        return copy.deepcopy(order)
+
+    def _fill(self, order, amount, price):
+        """Fill part of an order and record the trade."""
+        amount = min(amount, order["remaining"])
+        timestamp = self._timestamp()
+        cost = amount * price
+        order["filled"] += amount
+        order["remaining"] -= amount
+        order["cost"] += cost
+        order["average"] = order["cost"] / order["filled"]
+        order["fee"]["cost"] += cost * 0.002
+        order["lastTradeTimestamp"] = timestamp
+        if order["remaining"] <= 0:
+            order["status"] = "closed"
+        self._trades.append({
+            "info": {}, "id": "%s-fill-%d" % (self.id, len(self._trades)),
+            "timestamp": timestamp,
+            "datetime": time.strftime("%Y-%m-%dT%H:%M:%S.000Z",
+                                      time.gmtime(timestamp // 1000)),
+            "symbol": order["symbol"], "order": order["id"],
+            "type": order["type"], "side": order["side"],
+            "takerOrMaker": "taker", "price": price, "amount": amount,
+            "cost": cost, "fee": {"cost": cost * 0.002,
+                                  "currency": order["fee"]["currency"]}})
+
+    def fill_order(self, id, amount=None):
+        """Fill an open order, all of it by default, as the market would."""
+        order = self.orders[id]
+        self._fill(order, order["remaining"] if amount is None else amount,
+                   order["price"] or self._prices[order["symbol"]])
+        return copy.deepcopy(order)
+
+    def create_limit_buy_order(self, symbol, amount, price, params=None):
+        return self.create_order(symbol, "limit", "buy", amount, price)
+
+    def create_limit_sell_order(self, symbol, amount, price, params=None):
+        return self.create_order(symbol, "limit", "sell", amount, price)
+
+    def create_market_buy_order(self, symbol, amount, params=None):
+        return self.create_order(symbol, "market", "buy", amount)
+
+    def create_market_sell_order(self, symbol, amount, params=None):
+        return self.create_order(symbol, "market", "sell", amount)
+
+    def fetch_order(self, id, symbol=None, params=None):
+        self._request()
+        return copy.deepcopy(self.orders[id])
+
+    def _orders(self, statuses, symbol=None, since=None, limit=None):
+        self._request()
+        orders = [o for o in self.orders.values() if
+                  o["status"] in statuses and
+                  (symbol is None or o["symbol"] == symbol) and
+                  (since is None or o["timestamp"] >= since)]
+        return copy.deepcopy(orders[:limit] if limit else orders)
+
+    def fetch_open_orders(self, symbol=None, since=None, limit=None,
+                          params=None):
+        return self._orders(["open"], symbol, since, limit)
+
+    def fetch_closed_orders(self, symbol=None, since=None, limit=None,
+                            params=None):
+        # Like many exchanges, canceled orders are listed with the closed
+        return self._orders(["closed", "canceled"], symbol, since, limit)
+
+    def cancel_order(self, id, symbol=None, params=None):
+        self._request()
+        order = self.orders[id]
+        if order["status"] != "open":
+            raise FakeOrderRejected("Order %s is %s" % (id, order["status"]))
+        order["status"] = "canceled"
+        return copy.deepcopy(order)
+
+
+def record_exchange(ex, path, symbols=None, timeframes=("1d",)):
+    """
+    Record the payloads of a live ccxt exchange for FakeExchange.
+
+    :param symbols: the symbols to record, defaults to all markets
+    """
+    markets = ex.load_markets()
+    symbols = symbols or list(markets)
+    recording = {
+        "id": ex.id,
+        "markets": {symbol: markets[symbol] for symbol in symbols},
+        "currencies": getattr(ex, "currencies", None),
+        "tickers": {symbol: ex.fetch_ticker(symbol) for symbol in symbols},
+        "order_books": {symbol: ex.fetch_order_book(symbol) for
+                        symbol in symbols},
+        "ohlcv": {symbol: {timeframe: ex.fetch_ohlcv(symbol, timeframe) for
+                           timeframe in timeframes} for symbol in symbols},
+    }
+    if getattr(ex, "apiKey", None):
+        recording["balance"] = ex.fetch_balance()
+        recording["trades"] = ex.fetch_my_trades()
+    with open(path, "w") as file:
+        json.dump(recording, file, default=str)
+    return recording
+
+
+class FakeFxFeed(object):
+    """Stand-in for the FX rate feed, derived from the reference prices."""
+    def __init__(self, latency=0.05, seed=None):
+        self.latency = latency
+        self.requests = 0
+        self._random = random.Random(seed)
+
+    def fetch(self, base, currencies):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        # Rates drift a little between requests
+        return {currency: REFERENCE_PRICES[base] /
+                REFERENCE_PRICES[currency] * self._random.uniform(0.999,
+                                                                   1.001)
+                for currency in currencies if currency in REFERENCE_PRICES}
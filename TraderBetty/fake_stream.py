@@ -0,0 +1,179 @@
+"""Offline stand-in for exchange WebSocket feeds"""
+import json
+import time
+import random
+import asyncio
+import threading
+
+from TraderBetty.fake_exchange import DEFAULT_SYMBOLS, FakeExchange
+from TraderBetty.managers.streaming import LocalOrderBook
+
+
+def load_recording(path):
+    """Read normalized messages recorded by the StreamManager."""
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def make_recording(symbols=None, updates=1000, depth=20, seed=0):
+    """
+    Generate a feed of book snapshots, updates and tickers.
+
+    Every symbol starts with a snapshot around the prices of the
+    FakeExchange, followed by updates of a few levels each in random
+    order of the symbols.
+    """
+    symbols = list(symbols or DEFAULT_SYMBOLS)
+    rng = random.Random(seed)
+    prices = FakeExchange("stream", symbols=symbols, latency=0)._prices
+    timestamp = int(time.time() * 1000)
+    sequences = {}
+    messages = []
+    for symbol in symbols:
+        mid = prices[symbol]
+        sequences[symbol] = rng.randint(1, 10 ** 6)
+        messages.append({
+            "type": "snapshot", "symbol": symbol,
+            "sequence": sequences[symbol], "timestamp": timestamp,
+            "bids": [[mid * (1 - 0.001 * (i + 1)), rng.uniform(0.1, 5)]
+                     for i in range(depth)],
+            "asks": [[mid * (1 + 0.001 * (i + 1)), rng.uniform(0.1, 5)]
+                     for i in range(depth)]})
+    for _ in range(updates):
+        symbol = rng.choice(symbols)
+        mid = prices[symbol]
+        timestamp += rng.randint(1, 50)
+        sequences[symbol] += 1
+        side = rng.choice(["bids", "asks"])
+        sign = -1 if side == "bids" else 1
+        levels = [[mid * (1 + sign * 0.001 * rng.randint(1, depth)),
+                   rng.choice([0, rng.uniform(0.1, 5)])]
+                  for _ in range(rng.randint(1, 3))]
+        messages.append({
+            "type": "update", "symbol": symbol,
+            "sequence": sequences[symbol], "timestamp": timestamp,
+            "bids": levels if side == "bids" else [],
+            "asks": levels if side == "asks" else []})
+        if rng.random() < 0.1:
+            messages.append({
+                "type": "ticker", "symbol": symbol, "timestamp": timestamp,
+                "bid": mid * 0.999, "ask": mid * 1.001, "last": mid})
+    return messages
+
+
+class ReplayServer(object):
+    """Local WebSocket server that replays a recorded feed.
+
+    Every client gets the recorded messages of the symbols and channels it
+    subscribed to, in recorded order. Subscribing to a symbol again sends
+    a snapshot of its book at the current position, like an exchange does.
+    The messages at the indices in ``drop`` are not sent, to simulate
+    updates lost on the way.
+    """
+    def __init__(self, messages, host="127.0.0.1", port=0, interval=0.0,
+                 drop=None):
+        self.messages = messages
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.drop = set(drop or [])
+        self.url = None
+        self._loop = None
+        self._thread = None
+        self._server = None
+
+    def start(self):
+        import websockets
+
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def serve():
+            self._server = await websockets.serve(self._serve, self.host,
+                                                  self.port)
+            port = next(iter(self._server.sockets)).getsockname()[1]
+            self.url = "ws://%s:%d" % (self.host, port)
+            started.set()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(serve())
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="replay",
+                                        daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.url
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            await self._server.wait_closed()
+            self._loop.stop()
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _serve(self, ws, path=None):
+        requests = asyncio.Queue()
+
+        async def read():
+            try:
+                async for raw in ws:
+                    await requests.put(json.loads(raw))
+            finally:
+                # The connection is gone, closed cleanly or not
+                requests.put_nowait(None)
+
+        reader = asyncio.ensure_future(read())
+        symbols, channels, books = set(), set(), {}
+
+        async def handle(request):
+            symbols.update(request["symbols"])
+            channels.update(request["channels"])
+            for symbol in request["symbols"]:
+                book = books.get(symbol)
+                if book is not None and book.synced:
+                    view = book.to_ccxt()
+                    await ws.send(json.dumps({
+                        "type": "snapshot", "symbol": symbol,
+                        "sequence": book.sequence,
+                        "timestamp": book.timestamp,
+                        "bids": view["bids"], "asks": view["asks"]}))
+
+        try:
+            request = await requests.get()
+            if request is None:
+                return
+            await handle(request)
+            for i, message in enumerate(self.messages):
+                while not requests.empty():
+                    request = requests.get_nowait()
+                    if request is None:
+                        return
+                    await handle(request)
+                symbol, kind = message["symbol"], message["type"]
+                if kind != "ticker":
+                    book = books.setdefault(symbol, LocalOrderBook(symbol))
+                    args = (message["bids"], message["asks"],
+                            message["sequence"], message["timestamp"])
+                    if kind == "snapshot":
+                        book.apply_snapshot(*args)
+                    else:
+                        book.apply_update(*args)
+                channel = "ticker" if kind == "ticker" else "book"
+                if (i in self.drop or symbol not in symbols or
+                        channel not in channels):
+                    continue
+                await ws.send(json.dumps(message))
+                await asyncio.sleep(self.interval)
+            # Keep answering until the client leaves
+            while True:
+                request = await requests.get()
+                if request is None:
+                    return
+                await handle(request)
+        finally:
+            reader.cancel()
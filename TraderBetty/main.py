@@ -8,6 +8,8 @@ import sys
 import time
 
 from TraderBetty.managers import config, handlers, data, portfolio
+from TraderBetty.managers.metrics import MetricsServer
+from TraderBetty.managers.scheduler import JobScheduler, COALESCE
 
 
 here = os.path.abspath("TraderBetty/TraderBetty")
@@ -22,14 +24,55 @@ full_conf = config.FullConfigLoader
 CH = handlers.ConnectionHandler(CONF, connection_conf, KEYS)
 
 
-def main(sleeptime=10):
+def schedule_jobs(PM, scheduler, intervals):
+    """Add the data collection jobs to the scheduler."""
+    scheduler.add("tickers", PM.get_last_prices, intervals["tickers"])
+    # Costs nothing while no orders are open
+    scheduler.add("orders", PM.orders.refresh_all, intervals["orders"])
+    scheduler.add("order_books", PM.get_order_books,
+                  intervals["order_books"])
+    # Only the latest state counts, catch up once after an overrun
+    scheduler.add("balances", PM.get_all_ex_balances, intervals["balances"],
+                  overrun=COALESCE)
+    scheduler.add("valuation", PM.get_ttl_values, intervals["valuation"],
+                  delay=intervals["tickers"], overrun=COALESCE)
+    scheduler.add("trades", PM.sync_all_trades, intervals["trades"])
+    scheduler.add("ohlcv", PM.sync_all_ohlcv, intervals["ohlcv"])
+    if PM.wallets:
+        interval = config.load_section(CONF, "iota", {"interval": 15.0})
+        scheduler.add("wallets", lambda: [PM.get_wallet_balance(wallet)
+                                          for wallet in PM.wallets],
+                      interval["interval"] * 60)
+
+
+def print_report(scheduler):
+    for name, job in sorted(scheduler.report().items()):
+        print("{:<12s} runs {:5d}  skipped {:4d}  errors {:4d}  "
+              "lag {:6.2f}s  max lag {:6.2f}s".format(
+                  name, job["runs"], job["skipped"] + job["coalesced"],
+                  job["errors"], job["last_lag"] or 0, job["max_lag"]))
+
+
+def main(sleeptime=600):
     PM = portfolio.PortfolioManager(CH, CONF, full_conf)
+    scheduler, intervals = JobScheduler.from_config(CONF)
+    schedule_jobs(PM, scheduler, intervals)
+    metrics = MetricsServer.from_config(CONF)
+    if metrics is not None:
+        print("Serving metrics on %s" % metrics.start())
+    scheduler.start()
     try:
         while True:
-            pass
             time.sleep(sleeptime)
+            print_report(scheduler)
     except KeyboardInterrupt:
         pass
+    finally:
+        scheduler.stop()
+        if metrics is not None:
+            metrics.stop()
+        # Write everything the write-behind layer still holds
+        PM.close()
 
 
 if __name__ == "__main__":
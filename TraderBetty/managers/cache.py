@@ -0,0 +1,78 @@
+"""Provides the market data cache."""
+import time
+import threading
+from collections import OrderedDict
+
+from TraderBetty.managers.config import load_section
+
+
+DEFAULTS = {
+    "ticker_max_age": 10.0,
+    "order_book_max_age": 2.0,
+    "max_size": 10000,
+}
+
+
+class MarketDataCache(object):
+    """Staleness bounded LRU cache for tickers and order books.
+
+    Entries are keyed by (kind, exchange, symbol) and served as long as they
+    are younger than the max age of their kind. When the cache is full the
+    least recently used entry is evicted.
+    """
+    def __init__(self, max_age=None, max_size=10000):
+        self.max_age = {"ticker": DEFAULTS["ticker_max_age"],
+                        "tickers": DEFAULTS["ticker_max_age"],
+                        "order_book": DEFAULTS["order_book_max_age"]}
+        self.max_age.update(max_age or {})
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_path):
+        options = load_section(config_path, "cache", DEFAULTS)
+        max_age = {"ticker": options["ticker_max_age"],
+                   "tickers": options["ticker_max_age"],
+                   "order_book": options["order_book_max_age"]}
+        return cls(max_age=max_age, max_size=options["max_size"])
+
+    def get(self, kind, exchange, symbol, max_age=None):
+        """Return the cached value or None if it is missing or stale."""
+        key = (kind, exchange, symbol)
+        max_age = self.max_age.get(kind, 0) if max_age is None else max_age
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > max_age:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, kind, exchange, symbol, value):
+        key = (kind, exchange, symbol)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0,
+            }
@@ -4,6 +4,32 @@ import os
 from configparser import ConfigParser
 
 
+def load_section(config_file, section, defaults):
+    """Read the options of a config section.
+
+    Every option in ``defaults`` is looked up in ``section`` and cast to the
+    type of its default value. Missing sections and options fall back to the
+    defaults.
+    """
+    config = ConfigParser()
+    config.read(config_file)
+    options = dict(defaults)
+    if not config.has_section(section):
+        return options
+    for option, default in defaults.items():
+        if not config.has_option(section, option):
+            continue
+        if isinstance(default, bool):
+            options[option] = config.getboolean(section, option)
+        elif isinstance(default, int):
+            options[option] = config.getint(section, option)
+        elif isinstance(default, float):
+            options[option] = config.getfloat(section, option)
+        else:
+            options[option] = config.get(section, option)
+    return options
+
+
 class ConfigLoaderAbstract(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def __init__(self, config_file, exchanges, wallets, coins):
@@ -1,74 +1,105 @@
 """Provides all data management methods."""
 import os
+import json
+import functools
+import numpy as np
 import pandas as pd
 
+from TraderBetty.managers import ingest
 from TraderBetty.managers.handlers import DataHandler
+from TraderBetty.managers.lazy import LazyFrames
+from TraderBetty.managers.metrics import track_write
+
+
+# Cursor key of exchanges that return the trades of all symbols at once
+ALL_SYMBOLS = "*"
+OHLCV_COLUMNS = ["datetime", "timestamp", "open", "high", "low", "close",
+                 "volume"]
+# Length of a ccxt timeframe unit in seconds
+TIMEFRAME_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800,
+                   "M": 2592000}
+
+
+def timeframe_to_ms(freq):
+    return int(freq[:-1]) * TIMEFRAME_UNITS[freq[-1]] * 1000
+
+
+def read_last_row(path, chunk_size=4096):
+    """Return the last row of a csv file as dict without reading it all."""
+    with open(path, "rb") as file:
+        header = file.readline().decode().strip().split(";")
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(max(size - chunk_size, 0))
+        lines = file.read().decode().strip().splitlines()
+    if not lines or lines[-1].split(";") == header:
+        return None
+    return dict(zip(header, lines[-1].split(";")))
 
 
 class DataManager(DataHandler):
     # TODO: Move all DataFrame conversions to data
     def update_balance(self, column, balance):
-        balance = pd.Series(balance, name=column)
-        self.balances[column] = balance
-        self.balances.fillna(0, inplace=True)
-        self.balances["total"] = self.balances[
-            [c for c in list(self.balances.columns) if
-             c in list(self.exchanges) + list(self.wallets)]
-        ].sum(axis=1)
-        self.store_csv(
-            self.balances, self.BALANCE_PATH)
+        self.update_balances({column: balance})
 
-    def update_trades(self, exchange, extrades):
-        # Update exchange specific trades
-        extr_path = "%s/trades_%s.csv" % (self.DATA_PATH,
-                                          exchange)
-        extradesdf = self.extrades[exchange].copy()
-        if not extradesdf.index.names == ["exchange", "id"]:
-            extradesdf.set_index(["exchange", "id"], inplace=True)
-        extradesdf = extradesdf.combine_first(
-            extrades.set_index(["exchange", "id"])
-        )
-        self.extrades[exchange] = extradesdf.copy()
-        self.store_csv(extradesdf, extr_path)
+    def update_balances(self, columns):
+        with self._write_lock:
+            for column, balance in columns.items():
+                balance = pd.Series(balance, name=column)
+                self.balances[column] = balance
+            self.balances.fillna(0, inplace=True)
+            self.balances["total"] = self.balances[
+                [c for c in list(self.balances.columns) if
+                 c in list(self.exchanges) + list(self.wallets)]
+            ].sum(axis=1)
+        self.mark_dirty(self.balances, self.BALANCE_PATH)
 
-        # Update all trades
-        tradesdf = pd.concat([self.extrades[ex] for ex in self.exchanges])
-        self.trades = tradesdf.copy()
-        self.store_csv(tradesdf, self.TRADES_PATH)
+    def update_trades(self, exchange, extrades):
+        """Append the trades the ledger hasn't seen, return their number."""
+        return self.ledger.append(exchange, extrades)
 
     def update_ex_price(self, exchange, symbol, price):
         expr_path = "%s/prices_%s.csv" % (self.DATA_PATH,
                                           exchange)
         pricedf = self.exprices[exchange]
         base, quote = symbol.split("/")
-        pricedf.loc[base, quote] = price
-        self.store_csv(pricedf, expr_path)
+        with self._write_lock:
+            pricedf.loc[base, quote] = price
+        self.mark_dirty(pricedf, expr_path)
 
     def update_order_book(self, exchange, symbol, order_book):
-        ts = order_book.get("timestamp")
-        path = "{:s}/orderbook_{:s}_{:s}_{:d}.csv".format(
-            self.ORDERBOOK_PATH, exchange, symbol.replace("/", "_"), ts)
-        if not os.path.isfile(path):
-            self.order_books[exchange][symbol] = pd.DataFrame(
-                columns=[("asks", "price"), ("asks", "volume"),
-                         ("bids", "price"), ("bids", "volume")])
-            self.store_csv(self.order_books[exchange][symbol], path)
-        asksdf = pd.DataFrame(order_book.get("asks"),
-                              columns=[("asks", "price"), ("asks", "volume")])
-        bidsdf = pd.DataFrame(order_book.get("bids"),
-                              columns=[("bids", "price"), ("bids", "volume")])
-        exobdf = pd.concat([asksdf, bidsdf], axis=1)
-        self.order_books[exchange][symbol] = exobdf.copy()
-        self.store_csv(exobdf, path)
+        # Snapshots are appended to the binary store in batches
+        if not self.book_store.append(exchange, symbol, order_book):
+            return
+        ts = int(order_book["timestamp"])
+        books = self.order_books[exchange].setdefault(
+            symbol, LazyFrames(self._load_order_book))
+        # Only the latest snapshot is listed, the store has the rest. Its
+        # frame is built from the stored records once it is looked up.
+        last = self._latest_books.get((exchange, symbol))
+        if last is not None and last in books:
+            del books[last]
+        self._latest_books[(exchange, symbol)] = ts
+        books.add_loader(ts, functools.partial(
+            self._stored_order_book, exchange, symbol, ts))
+
+    def latest_order_book(self, exchange, symbol):
+        """Return the latest stored book as arrays of bids and asks."""
+        return self.book_store.latest(exchange, symbol)
+
+    def _stored_order_book(self, exchange, symbol, ts):
+        records = self.book_store.latest_records(exchange, symbol)
+        if records is None or records["timestamp"][0] != ts:
+            records = self.book_store.read(exchange, symbol, start=ts,
+                                           end=ts)
+        return ingest.order_book_frame(records)
 
     def update_ohlcv(self, exchange, symbol, freq, ohlcv):
         path = "{:s}/ohlcv_{:s}_{:s}_{:s}.csv".format(
             self.OHLCV_PATH, exchange, symbol.replace("/", "_"), freq)
-        if not os.path.isfile(path):
+        if symbol + freq not in self.ohlcvs[exchange]:
             self.ohlcvs[exchange][symbol + freq] = pd.DataFrame(
-                columns=["datetime", "timestamp", "open", "high", "low",
-                         "close", "volume"])
-            self.store_csv(self.ohlcvs[exchange][symbol + freq], path)
+                columns=OHLCV_COLUMNS)
         ohlcvdf = self.ohlcvs[exchange][symbol + freq].copy()
         if not ohlcvdf.index.name == "datetime":
             ohlcvdf.index = pd.DatetimeIndex(ohlcvdf["datetime"])
@@ -76,4 +107,133 @@ class DataManager(DataHandler):
             ohlcv.set_index("datetime")
         )
         self.ohlcvs[exchange][symbol + freq] = ohlcvdf.copy()
-        self.store_csv(ohlcvdf, path)
+        self.mark_dirty(ohlcvdf, path)
+        # The next sync appends only what comes after the rewritten rows
+        if not ohlcvdf.empty:
+            last = int(ohlcvdf["timestamp"].max())
+            with self._ohlcv_lock:
+                marks = self.ohlcv_marks.setdefault(exchange, {}).setdefault(
+                    symbol, {})
+                marks[freq] = max(marks.get(freq) or last, last)
+
+    # -------------------------------------------------------------------------
+    # Incremental trade storage
+    # -------------------------------------------------------------------------
+    def trade_cursor(self, exchange, symbol=ALL_SYMBOLS):
+        """
+        Return the last synced trade of a symbol or None.
+
+        :return: dict with the timestamp and id of the trade
+        """
+        cursor = self.trade_cursors.get(exchange, {}).get(symbol)
+        if cursor is not None:
+            return cursor
+        # Resume from a ledger written before there were cursors
+        if not os.path.isfile(self.ledger.paths[exchange]):
+            return None
+        trades = self.extrades[exchange]
+        if symbol != ALL_SYMBOLS and "symbol" in trades:
+            trades = trades[trades["symbol"] == symbol]
+        if trades.empty or "timestamp" not in trades:
+            return None
+        last = trades["timestamp"].astype(float).idxmax()
+        return {"timestamp": int(trades.loc[last, "timestamp"]),
+                "id": str(last[1])}
+
+    def set_trade_cursor(self, exchange, symbol, timestamp, trade_id):
+        with self._cursor_lock:
+            self.trade_cursors.setdefault(exchange, {})[symbol] = {
+                "timestamp": int(timestamp), "id": str(trade_id)}
+
+    def traded_symbols(self, exchange):
+        """Return the symbols with trades in the ledger of the exchange."""
+        symbols = {s for s in self.trade_cursors.get(exchange, {}) if
+                   s != ALL_SYMBOLS}
+        if os.path.isfile(self.ledger.paths[exchange]):
+            trades = self.extrades[exchange]
+            if "symbol" in trades:
+                symbols.update(trades["symbol"].dropna().unique())
+        return symbols
+
+    def store_trade_cursors(self):
+        with self._cursor_lock:
+            cursors = json.dumps(self.trade_cursors)
+        with open(self.TRADE_CURSORS_PATH, "w") as file:
+            file.write(cursors)
+
+    # -------------------------------------------------------------------------
+    # Incremental OHLCV storage
+    # -------------------------------------------------------------------------
+    def ohlcv_high_water_mark(self, exchange, symbol, freq):
+        """Return the timestamp of the last stored candle or None."""
+        mark = self.ohlcv_marks.get(exchange, {}).get(symbol, {}).get(freq)
+        if mark is not None:
+            return mark
+        path = "{:s}/ohlcv_{:s}_{:s}_{:s}.csv".format(
+            self.OHLCV_PATH, exchange, symbol.replace("/", "_"), freq)
+        if not os.path.isfile(path):
+            return None
+        row = read_last_row(path)
+        if not row or not row.get("timestamp"):
+            return None
+        return int(float(row["timestamp"]))
+
+    def ohlcv_gaps(self, exchange, symbol, freq):
+        """
+        Return the missing ranges inside the stored candles.
+
+        :return: list of the first and last timestamp of every gap
+        """
+        key = symbol + freq
+        if key not in self.ohlcvs[exchange]:
+            return []
+        timestamps = np.sort(self.ohlcvs[exchange][key]["timestamp"]
+                             .dropna().to_numpy(dtype="i8"))
+        step = timeframe_to_ms(freq)
+        # Months differ in length, only a missing candle counts as a gap
+        gaps = np.nonzero(np.diff(timestamps) > step * 1.5)[0]
+        return [(int(timestamps[i]) + step, int(timestamps[i + 1]) - step)
+                for i in gaps]
+
+    def append_ohlcv(self, exchange, symbol, freq, ohlcv):
+        """
+        Append the candles newer than the high-water mark to the csv.
+
+        Existing rows are never rewritten.
+
+        :return: the number of appended candles
+        """
+        path = "{:s}/ohlcv_{:s}_{:s}_{:s}.csv".format(
+            self.OHLCV_PATH, exchange, symbol.replace("/", "_"), freq)
+        # A pending rewrite of the file must not overwrite the new rows
+        self.flush(force=True, paths=[path])
+        mark = self.ohlcv_high_water_mark(exchange, symbol, freq)
+        if mark is not None:
+            ohlcv = ohlcv[ohlcv["timestamp"] > mark]
+        if ohlcv.empty:
+            return 0
+        new_file = not os.path.isfile(path) or os.path.getsize(path) == 0
+        if new_file:
+            columns = OHLCV_COLUMNS
+        else:
+            with open(path) as file:
+                columns = file.readline().strip().split(";")
+        with track_write(path, append=True):
+            ohlcv.reindex(columns=columns).to_csv(
+                path, sep=";", mode="a", header=new_file, index=False)
+        with self._ohlcv_lock:
+            self.ohlcv_marks.setdefault(exchange, {}).setdefault(
+                symbol, {})[freq] = int(ohlcv["timestamp"].max())
+        key = symbol + freq
+        if self.ohlcvs[exchange].is_loaded(key):
+            self.ohlcvs[exchange][key] = pd.concat([
+                self.ohlcvs[exchange][key], ohlcv.set_index("datetime")])
+        else:
+            self.ohlcvs[exchange].add_path(key, path)
+        return len(ohlcv)
+
+    def store_ohlcv_marks(self):
+        with self._ohlcv_lock:
+            marks = json.dumps(self.ohlcv_marks)
+        with open(self.OHLCV_MARKS_PATH, "w") as file:
+            file.write(marks)
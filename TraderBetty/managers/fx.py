@@ -0,0 +1,167 @@
+"""Provides cached foreign exchange rates."""
+import time
+import threading
+
+from TraderBetty.managers.config import load_section
+from TraderBetty.managers.lazy import LazyModule
+
+
+# Only imported when rates are fetched from forex_python
+converter = LazyModule("forex_python.converter")
+
+DEFAULTS = {
+    # Currency all rates are fetched against
+    "base": "EUR",
+    # Comma separated list of the currencies to keep rates of
+    "currencies": "USD,EUR",
+    # Seconds between two background refreshes
+    "refresh_interval": 3600.0,
+    # Seconds after which a lookup fetches the rates itself
+    "max_age": 86400.0,
+}
+
+
+class ForexPythonFeed(object):
+    """Fetches the rates of all currencies against a base in one request."""
+    def __init__(self):
+        self._rates = None
+
+    def fetch(self, base, currencies):
+        if self._rates is None:
+            self._rates = converter.CurrencyRates()
+        rates = self._rates.get_rates(base)
+        return {currency: rates[currency] for currency in currencies if
+                currency in rates}
+
+
+class FxRates(object):
+    """Rates of a few currencies kept in memory and refreshed in the back.
+
+    Only the rates against one base currency are fetched, all others are
+    derived from them: the rate of b in q is rate(q) / rate(b). Lookups
+    never wait for the network unless the rates are missing or older than
+    ``max_age``. Implements ``get_rate`` of forex_python's CurrencyRates.
+    """
+    def __init__(self, feed=None, base="EUR", currencies=("USD", "EUR"),
+                 refresh_interval=3600.0, max_age=86400.0):
+        self.feed = feed or ForexPythonFeed()
+        self.base = base
+        self.currencies = [c for c in currencies if c != base]
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        # Currency to (units per base, time fetched)
+        self.rates = {}
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        # Held during a fetch, lookups that miss wait for it instead of
+        # fetching again
+        self._refresh_lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config_path, feed=None):
+        options = load_section(config_path, "fx", DEFAULTS)
+        return cls(feed=feed, base=options["base"],
+                   currencies=options["currencies"].split(","),
+                   refresh_interval=options["refresh_interval"],
+                   max_age=options["max_age"])
+
+    def refresh(self, max_age=None):
+        """
+        Fetch the rates of all currencies, keep the old ones on errors.
+
+        :param max_age: skip the fetch if every rate is younger
+        """
+        with self._refresh_lock:
+            with self._lock:
+                currencies = list(self.currencies)
+                if max_age is not None and all(
+                        not self._stale(self.rates.get(c), max_age)
+                        for c in currencies):
+                    return False
+            try:
+                fetched = self.feed.fetch(self.base, currencies)
+            except Exception as e:
+                print("FX rates could not be refreshed: %s" % e)
+                return False
+            now = time.time()
+            with self._lock:
+                for currency, rate in fetched.items():
+                    self.rates[currency] = (float(rate), now)
+                self.refreshes += 1
+            return True
+
+    @staticmethod
+    def _stale(rate, max_age):
+        return rate is None or (max_age is not None and
+                                time.time() - rate[1] > max_age)
+
+    def _rate(self, currency):
+        if currency == self.base:
+            return 1.0, None
+        with self._lock:
+            rate = self.rates.get(currency)
+        if self._stale(rate, self.max_age):
+            with self._refresh_lock:
+                with self._lock:
+                    # A refresh that ran while waiting may have brought it
+                    rate = self.rates.get(currency, rate)
+                    fetch = self._stale(rate, self.max_age)
+                    if fetch and currency not in self.currencies:
+                        self.currencies.append(currency)
+                if fetch:
+                    self.refresh()
+                    with self._lock:
+                        rate = self.rates.get(currency, rate)
+        if rate is None:
+            raise KeyError("No FX rate for %s" % currency)
+        return rate
+
+    def get_rate(self, base_cur, dest_cur):
+        """Return how many units of dest_cur one unit of base_cur buys."""
+        if base_cur == dest_cur:
+            return 1.0
+        return self._rate(dest_cur)[0] / self._rate(base_cur)[0]
+
+    def age(self, base_cur, dest_cur=None):
+        """Seconds since the older rate of the pair was fetched."""
+        fetched = []
+        with self._lock:
+            for currency in (base_cur, dest_cur):
+                if currency is None or currency == self.base:
+                    continue
+                if currency not in self.rates:
+                    return None
+                fetched.append(self.rates[currency][1])
+        return time.time() - min(fetched) if fetched else 0.0
+
+    def ages(self):
+        """Return the age in seconds of the rate of every currency."""
+        now = time.time()
+        with self._lock:
+            return {c: now - fetched for c, (rate, fetched) in
+                    self.rates.items()}
+
+    # -------------------------------------------------------------------------
+    # Background refresh
+    # -------------------------------------------------------------------------
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="fx-refresh",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            # Rates a lookup just fetched aren't fetched again
+            self.refresh(max_age=self.refresh_interval / 2)
+            self._stopped.wait(self.refresh_interval)
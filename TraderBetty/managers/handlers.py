@@ -1,12 +1,60 @@
 """Sets up the connection to the exchange and wallet APIs."""
 import os
+import re
 import json
+import time
+import atexit
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from json.decoder import JSONDecodeError
 import pandas as pd
 
-import ccxt
-
 from TraderBetty.managers import wallets
+from TraderBetty.managers.config import load_section
+from TraderBetty.managers.lazy import LazyFrames, LazyModule
+from TraderBetty.managers.ledger import TradeLedger
+from TraderBetty.managers.markets import MarketIndex
+from TraderBetty.managers.metrics import track_write
+from TraderBetty.managers.store import OrderBookStore
+
+
+# Only imported once exchanges are connected
+ccxt = LazyModule("ccxt")
+
+ORDERBOOK_FILE = re.compile(
+    r"^orderbook_(?P<exchange>.+)_(?P<base>[^_]+)_(?P<quote>[^_]+)"
+    r"_(?P<timestamp>\d+)\.csv$")
+OHLCV_FILE = re.compile(
+    r"^ohlcv_(?P<exchange>.+)_(?P<base>[^_]+)_(?P<quote>[^_]+)"
+    r"_(?P<freq>[^_]+)\.csv$")
+
+MARKETS_DEFAULTS = {
+    # Seconds the cached markets of an exchange are used without reloading
+    "ttl": 86400.0,
+    # Seconds to wait for downloads at startup, slower exchanges are
+    # unavailable until they finish in the background
+    "load_timeout": 15.0,
+    # Reload the markets served from the cache in the background
+    "background_refresh": True,
+    # Folder of the cached markets, relative to the working directory
+    "path": "data/markets",
+}
+# Bump when the layout of the markets cache changes
+MARKETS_CACHE_VERSION = 1
+
+DATA_DEFAULTS = {
+    # Seconds between writes of the same table
+    "flush_interval": 30.0,
+}
+
+
+def ccxt_version():
+    """Return the version of ccxt or None if it isn't installed."""
+    try:
+        return ccxt.__version__
+    except (ImportError, AttributeError):
+        return None
 
 
 class Handler(object):
@@ -15,17 +63,37 @@ class Handler(object):
 
 
 class ConnectionHandler(Handler):
-    def __init__(self, config_path, config_loader, key_file):
+    def __init__(self, config_path, config_loader, key_file,
+                 exchange_factory=None):
+        """
+        :param exchange_factory: callable creating an exchange from its name
+            and config, defaults to the ccxt exchange class of the name
+        """
         super().__init__(config_path, config_loader)
         # Check if the path is to a valid file
         if not os.path.isfile(key_file):
             raise ValueError
+        self.exchange_factory = exchange_factory or (
+            lambda exchange, config: getattr(ccxt, exchange)(config))
 
         self.exchanges = self.config_loader.exchanges
         self.wallets = self.config_loader.wallets
+        options = load_section(config_path, "markets", MARKETS_DEFAULTS)
+        # Absolute, late loads write the cache from background threads
+        self.MARKETS_PATH = os.path.abspath(options["path"])
+        self.markets_ttl = options["ttl"]
+        self.load_timeout = options["load_timeout"]
+        self.background_refresh = options["background_refresh"]
+        # Exchanges whose markets could not be loaded
+        self.unavailable = set()
+        # Set once the markets of an exchange were loaded or failed to
+        self.markets_loaded = {exchange: threading.Event() for
+                               exchange in self.exchanges}
+        self._refresh_thread = None
 
         # Initiate exchanges
         self.exchanges = {exchange: None for exchange in self.exchanges}
+        self.market_index = MarketIndex()
         self._load_exchanges(key_file)
         self._initiate_all_markets()
 
@@ -40,22 +108,129 @@ class ConnectionHandler(Handler):
         with open(key_file) as file:
             keys = json.load(file)
         for exchange in self.exchanges:
-            exchange_config = {}
+            # Every call is throttled by the RateLimiter of the portfolio
+            # manager, ccxt's own limit would throttle it a second time
+            exchange_config = {"enableRateLimit": False}
             exchange_config.update(keys[exchange])
-            self.exchanges[exchange] = getattr(ccxt, exchange)(exchange_config)
+            self.exchanges[exchange] = self.exchange_factory(
+                exchange, exchange_config)
 
     def _initiate_all_markets(self, reload=False):
         """
+        Load the markets of all exchanges at once and rebuild the index.
 
-        :param reload:
-        :return:
+        Markets younger than the TTL are read from the cache on disk, the
+        others are downloaded. Exchanges that fail, or don't finish within
+        the load timeout, are marked unavailable without holding up the
+        others. Late exchanges are added to the index once they are loaded.
+
+        :param reload: force downloading the markets again
+        :return: dict of exchange to "cache", "download", "stale" or None
         """
-        for exchange in self.exchanges:
-            try:
-                self.exchanges[exchange].load_markets(reload=reload)
-            except JSONDecodeError:
-                print("Exchange %s seems to be unavailable at the moment" %
-                      exchange.name)
+        pool = ThreadPoolExecutor(max_workers=max(len(self.exchanges), 1))
+        futures = {exchange: pool.submit(self._load_markets, exchange,
+                                         reload)
+                   for exchange in self.exchanges}
+        wait(futures.values(), timeout=self.load_timeout)
+        pool.shutdown(wait=False)
+        sources = {}
+        for exchange, future in futures.items():
+            if future.done():
+                sources[exchange] = future.result()
+                self.markets_loaded[exchange].set()
+                continue
+            sources[exchange] = None
+            self.unavailable.add(exchange)
+            # Runs at once if the load finished since the check
+            future.add_done_callback(functools.partial(
+                self._markets_loaded, exchange))
+        self.market_index.rebuild(self.exchanges)
+        cached = [ex for ex, source in sources.items() if
+                  source in ("cache", "stale")]
+        if cached and self.background_refresh:
+            self._refresh_thread = threading.Thread(
+                target=self.refresh_markets, args=(cached,),
+                name="markets-refresh", daemon=True)
+            self._refresh_thread.start()
+        return sources
+
+    def _markets_loaded(self, exchange, future):
+        """Make an exchange whose markets loaded late available."""
+        if future.exception() is None and future.result() is not None:
+            self.unavailable.discard(exchange)
+        self.market_index.rebuild(self.exchanges)
+        self.markets_loaded[exchange].set()
+
+    def refresh_markets(self, exchanges=None):
+        """Download the markets again and rebuild the index."""
+        exchanges = exchanges or list(self.exchanges)
+        with ThreadPoolExecutor(max_workers=max(len(exchanges), 1)) as pool:
+            list(pool.map(lambda exchange: self._load_markets(
+                exchange, reload=True), exchanges))
+        self.market_index.rebuild(self.exchanges)
+
+    def available_exchanges(self):
+        return {exchange: ex for exchange, ex in self.exchanges.items() if
+                exchange not in self.unavailable}
+
+    def _markets_file(self, exchange):
+        return "%s/%s.json" % (self.MARKETS_PATH, exchange)
+
+    def _load_markets(self, exchange, reload=False):
+        ex = self.exchanges[exchange]
+        cached = self._read_markets(exchange)
+        if (cached is not None and not reload and
+                time.time() - cached["timestamp"] < self.markets_ttl):
+            ex.set_markets(cached["markets"], cached.get("currencies"))
+            return "cache"
+        try:
+            ex.load_markets(reload=True)
+        except (ccxt.BaseError, JSONDecodeError, OSError) as e:
+            if cached is not None:
+                print("Markets of %s could not be loaded, using the cached "
+                      "ones: %s" % (exchange, e))
+                if not ex.markets:
+                    ex.set_markets(cached["markets"],
+                                   cached.get("currencies"))
+                return "stale"
+            print("Exchange %s seems to be unavailable at the moment: %s" %
+                  (exchange, e))
+            self.unavailable.add(exchange)
+            return None
+        self.unavailable.discard(exchange)
+        self._write_markets(exchange)
+        return "download"
+
+    def _read_markets(self, exchange):
+        try:
+            with open(self._markets_file(exchange)) as file:
+                cached = json.load(file)
+        except (FileNotFoundError, JSONDecodeError):
+            return None
+        # Markets cached by another layout or ccxt version may not fit
+        if (cached.get("version") != MARKETS_CACHE_VERSION or
+                cached.get("ccxt") != ccxt_version()):
+            return None
+        return cached
+
+    def _write_markets(self, exchange):
+        ex = self.exchanges[exchange]
+        os.makedirs(self.MARKETS_PATH, exist_ok=True)
+        payload = json.dumps({"version": MARKETS_CACHE_VERSION,
+                              "ccxt": ccxt_version(),
+                              "timestamp": time.time(),
+                              "markets": ex.markets,
+                              "currencies": getattr(ex, "currencies", None)},
+                             default=str)
+        path = self._markets_file(exchange)
+        try:
+            with open(path + ".tmp", "w") as file:
+                file.write(payload)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+            raise
 
     def load_wallets(self):
         config = self.config_loader.config_file
@@ -68,11 +243,23 @@ class ConnectionHandler(Handler):
 class DataHandler(Handler):
     def __init__(self, config_path, config_loader):
         super().__init__(config_path, config_loader)
+        options = load_section(config_path, "data", DATA_DEFAULTS)
+        self.flush_interval = options["flush_interval"]
+        # Tables updated in memory but not yet written, see mark_dirty
+        self._dirty = {}
+        self._dirty_since = {}
+        self._write_lock = threading.RLock()
+        # Writes the tables that went quiet, started by the first mark_dirty
+        self._flush_thread = None
+        self._flush_stopped = threading.Event()
         self.DATA_PATH = "data"
         self.BALANCE_PATH = self.DATA_PATH + "/balances.csv"
         self.TRADES_PATH = self.DATA_PATH + "/trades.csv"
+        self.TRADE_CURSORS_PATH = self.DATA_PATH + "/trade_cursors.json"
         self.ORDERBOOK_PATH = self.DATA_PATH + "/order_books"
+        self.ORDERBOOK_STORE_PATH = self.ORDERBOOK_PATH + "/store"
         self.OHLCV_PATH = self.DATA_PATH + "/ohlcv"
+        self.OHLCV_MARKS_PATH = self.OHLCV_PATH + "/high_water_marks.json"
         self.coins = self.config_loader.coins
         self.exchanges = self.config_loader.exchanges
         self.wallets = self.config_loader.wallets
@@ -85,65 +272,88 @@ class DataHandler(Handler):
                 columns=list(self.exchanges) + (
                         ["total", "btc_value", "eur_value"]))
             self.store_csv(balances, self.BALANCE_PATH)
-        if not os.path.isfile(self.TRADES_PATH):
-            trades = pd.DataFrame(columns=[
-                "exchange", "id", "date", "datetime", "timestamp"])
-            self.store_csv(trades, self.TRADES_PATH, index=False)
         for exchange in self.exchanges:
-            extrades_path = self.DATA_PATH + "/trades_%s.csv" % exchange
-            if not os.path.isfile(extrades_path):
-                extrades = pd.DataFrame(columns=[
-                    "exchange", "id", "date", "datetime", "timestamp"])
-                self.store_csv(extrades, extrades_path, index=False)
             exprice_path = self.DATA_PATH + "/prices_%s.csv" % exchange
             if not os.path.isfile(exprice_path):
                 exprices = pd.DataFrame(index=self.coins, columns=self.coins)
                 self.store_csv(exprices, exprice_path)
 
         self.balances = self._load_balances()
-        self.trades = self._load_trades()
-
-        self.extrades = {exchange: self._load_ex_trades(exchange) for
-                         exchange in self.exchanges}
+        # Trades of every exchange, read on first access
+        self.ledger = TradeLedger(self.DATA_PATH + "/trades_%s.csv",
+                                  self.exchanges)
+        self.extrades = self.ledger.frames
+        self._exported_version = self.ledger.version
+        self.trade_cursors = self._load_trade_cursors()
+        self._cursor_lock = threading.Lock()
         self.exprices = {exchange: self._load_ex_prices(exchange) for
                          exchange in self.exchanges}
+        self.book_store = OrderBookStore(self.ORDERBOOK_STORE_PATH)
 
-        all_order_books = [f for f in os.listdir(self.ORDERBOOK_PATH) if (
-                         os.path.isfile(self.ORDERBOOK_PATH + "/" + f))]
+        # Only index the files here, they are read on first access
         self.order_books = {ex: {} for ex in self.exchanges}
-        for ex in self.order_books:
-            ex_files = [f for f in all_order_books if ex in f]
-            symbols = list(set([
-                "/".join([s.split("_")[-3], s.split("_")[-2]])
-                for s in ex_files]))
-            self.order_books[ex] = {s: [] for s in symbols}
-            for symbol in symbols:
-                symb_files = [f for f in ex_files if
-                              symbol.replace("/", "_") in f]
-                symb_books = [pd.read_csv(
-                    self.ORDERBOOK_PATH + "/" + f, sep=";"
-                ) for f in symb_files]
-                timestamps = [ts.split(".")[0] for ts in ex_files if
-                              symbol.replace("/", "_") in ts]
-                self.order_books[ex][symbol] = {
-                    ts: sb for ts, sb in zip(timestamps, symb_books)
-                }
-
-        all_ohlcvs = [f for f in os.listdir(self.OHLCV_PATH) if
-                      os.path.isfile(self.OHLCV_PATH + "/" + f)]
-        self.ohlcvs = {ex: {} for ex in self.exchanges}
-        for ex in self.ohlcvs:
-            ex_files = [f for f in all_ohlcvs if ex in f]
-            symbols = ["/".join([s.split("_")[-3],
-                                 s.split("_")[-2]
-                                 + s.split("_")[-1].split(".")[0]]) for
-                       s in ex_files]
-            ex_ohlcvs = [pd.read_csv(
-                self.OHLCV_PATH + "/" + f,
-                sep=";", parse_dates=True, index_col=["datetime"]
-            ) for f in ex_files]
-            self.ohlcvs[ex] = {
-                s: ohlcv for s, ohlcv in zip(symbols, ex_ohlcvs)}
+        # Timestamp of the latest snapshot per (exchange, symbol) appended
+        self._latest_books = {}
+        self.ohlcvs = {ex: LazyFrames(self._load_ohlcv) for
+                       ex in self.exchanges}
+        self._index_order_books()
+        self._index_ohlcvs()
+        self.ohlcv_marks = self._load_ohlcv_marks()
+        self._ohlcv_lock = threading.Lock()
+        # Only once everything close() needs exists
+        atexit.register(self.close)
+
+    def _index_order_books(self):
+        os.makedirs(self.ORDERBOOK_PATH, exist_ok=True)
+        for entry in os.scandir(self.ORDERBOOK_PATH):
+            match = ORDERBOOK_FILE.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            ex = match.group("exchange")
+            if ex not in self.order_books:
+                continue
+            symbol = "/".join([match.group("base"), match.group("quote")])
+            if symbol not in self.order_books[ex]:
+                self.order_books[ex][symbol] = LazyFrames(
+                    self._load_order_book)
+            self.order_books[ex][symbol].add_path(
+                int(match.group("timestamp")), entry.path)
+
+    def _index_ohlcvs(self):
+        os.makedirs(self.OHLCV_PATH, exist_ok=True)
+        for entry in os.scandir(self.OHLCV_PATH):
+            match = OHLCV_FILE.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            ex = match.group("exchange")
+            if ex not in self.ohlcvs:
+                continue
+            symbol = "/".join([match.group("base"), match.group("quote")])
+            self.ohlcvs[ex].add_path(symbol + match.group("freq"),
+                                     entry.path)
+
+    def _load_trade_cursors(self):
+        try:
+            with open(self.TRADE_CURSORS_PATH) as file:
+                return json.load(file)
+        except (FileNotFoundError, JSONDecodeError):
+            return {}
+
+    def _load_ohlcv_marks(self):
+        try:
+            with open(self.OHLCV_MARKS_PATH) as file:
+                return json.load(file)
+        except (FileNotFoundError, JSONDecodeError):
+            return {}
+
+    @staticmethod
+    def _load_order_book(path):
+        return pd.read_csv(path, sep=";")
+
+    @staticmethod
+    def _load_ohlcv(path):
+        return pd.read_csv(path, sep=";", parse_dates=True,
+                           index_col=["datetime"])
 
     def _load_balances(self):
         try:
@@ -152,26 +362,10 @@ class DataHandler(Handler):
         except FileNotFoundError:
             print("Balance file was not found.")
 
-    def _load_trades(self):
-        try:
-            trades = pd.read_csv(self.TRADES_PATH,
-                                 sep=";",
-                                 parse_dates=["date", "datetime", "timestamp"],
-                                 index_col=["exchange", "id"])
-            return trades
-        except FileNotFoundError:
-            print("Trade file was not found.")
-
-    def _load_ex_trades(self, exchange):
-        try:
-            trades = pd.read_csv("{:s}/trades_{:s}.csv".format(
-                self.DATA_PATH, exchange),
-                                 sep=";",
-                                 parse_dates=["date", "datetime", "timestamp"],
-                                 index_col=["exchange", "id"])
-            return trades
-        except FileNotFoundError:
-            print("Trades for %s were not found." % exchange)
+    @property
+    def trades(self):
+        """Trades of all exchanges, combined on demand."""
+        return self.ledger.combined()
 
     def _load_ex_prices(self, exchange):
         try:
@@ -183,4 +377,74 @@ class DataHandler(Handler):
             print("Prices for %s were not found." % exchange)
 
     def store_csv(self, df, path, index=True):
-        df.to_csv(path, sep=";", index=index)
+        # Write next to the target and rename, readers never see half a file
+        tmp_path = path + ".tmp"
+        with track_write(path):
+            df.to_csv(tmp_path, sep=";", index=index)
+            os.replace(tmp_path, path)
+
+    # -------------------------------------------------------------------------
+    # Write-behind persistence
+    # -------------------------------------------------------------------------
+    def mark_dirty(self, df, path, index=True):
+        """
+        Schedule a table to be written instead of writing it right away.
+
+        Every table is written at most once per ``flush_interval`` seconds,
+        later updates within the interval only replace the pending table.
+        A background thread writes the tables that are due without further
+        updates.
+        """
+        path = os.path.abspath(path)
+        with self._write_lock:
+            self._dirty[path] = (df, index)
+            self._dirty_since.setdefault(path, time.monotonic())
+            if self._flush_thread is None and self.flush_interval > 0:
+                self._flush_stopped.clear()
+                self._flush_thread = threading.Thread(
+                    target=self._run_flush, name="data-flush", daemon=True)
+                self._flush_thread.start()
+        self.flush()
+
+    def _run_flush(self):
+        # Checking twice per interval writes a table at most 1.5 intervals
+        # after its first update
+        while not self._flush_stopped.wait(self.flush_interval / 2):
+            try:
+                self.flush()
+            except Exception as e:
+                print("Data could not be written: %s" % e)
+
+    def flush(self, force=False, paths=None):
+        """Write the dirty tables that are due, or all if forced."""
+        now = time.monotonic()
+        with self._write_lock:
+            paths = list(self._dirty) if paths is None else [
+                os.path.abspath(path) for path in paths]
+            for path in paths:
+                if path not in self._dirty:
+                    continue
+                if not force and (now - self._dirty_since[path] <
+                                  self.flush_interval):
+                    continue
+                df, index = self._dirty.pop(path)
+                del self._dirty_since[path]
+                self.store_csv(df, path, index=index)
+
+    def export_trades(self):
+        """Write the combined trades of all exchanges if they changed."""
+        version = self.ledger.version
+        if version != self._exported_version:
+            self.store_csv(self.ledger.combined(), self.TRADES_PATH)
+            self._exported_version = version
+
+    def close(self):
+        """Write everything still pending, e.g. at shutdown."""
+        self._flush_stopped.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+            self._flush_thread = None
+        self.flush(force=True)
+        self.book_store.flush()
+        self.export_trades()
+        atexit.unregister(self.close)
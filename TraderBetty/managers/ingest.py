@@ -0,0 +1,93 @@
+"""Provides the conversion of ccxt payloads into DataFrames."""
+import time
+
+import numpy as np
+import pandas as pd
+
+from TraderBetty.managers.store import ASK, BID
+
+
+# Fields of a ccxt trade that are kept, the fee is split into its parts
+TRADE_FIELDS = ["id", "timestamp", "symbol", "order", "type", "side",
+                "takerOrMaker", "price", "amount", "cost"]
+TRADE_NUMERIC = ["price", "amount", "cost"]
+OHLCV_FIELDS = ["timestamp", "open", "high", "low", "close", "volume"]
+
+
+def ms_to_datetime(timestamps, local=False):
+    """
+    Convert timestamps in ms to naive datetimes in one go.
+
+    :param local: local time instead of UTC
+    """
+    timestamps = np.asarray(timestamps, dtype="i8")
+    if local and len(timestamps):
+        # UTC offsets only change on the hour, look each hour up once
+        hours, inverse = np.unique(timestamps // 3600000,
+                                   return_inverse=True)
+        offsets = np.array([time.localtime(h * 3600).tm_gmtoff for
+                            h in hours.tolist()], dtype="i8")
+        timestamps = timestamps + offsets[inverse] * 1000
+    return pd.to_datetime(timestamps, unit="ms")
+
+
+def trades_frame(trades, exchange=None):
+    """
+    Turn a list of ccxt trades into a typed DataFrame.
+
+    Every field is collected into a column once, instead of serializing the
+    list and parsing it back.
+    """
+    columns = {field: [t.get(field) for t in trades] for
+               field in TRADE_FIELDS}
+    columns["id"] = [str(i) for i in columns["id"]]
+    for field in TRADE_NUMERIC:
+        columns[field] = np.array(columns[field], dtype=float)
+    fees = [t.get("fee") or {} for t in trades]
+    columns["fee"] = np.array([f.get("cost") for f in fees], dtype=float)
+    columns["fee_currency"] = [f.get("currency") for f in fees]
+    tradesdf = pd.DataFrame(columns)
+    timestamps = pd.to_numeric(tradesdf["timestamp"], errors="coerce")
+    if timestamps.isna().any():
+        # ccxt leaves the timestamp of some trades empty, keep them undated
+        tradesdf["timestamp"] = timestamps.astype("Int64")
+        datetimes = pd.DatetimeIndex(pd.to_datetime(tradesdf["timestamp"],
+                                                    unit="ms"))
+    else:
+        tradesdf["timestamp"] = timestamps.astype("i8")
+        datetimes = ms_to_datetime(tradesdf["timestamp"])
+    tradesdf["datetime"] = datetimes
+    tradesdf["date"] = datetimes.normalize()
+    if exchange is not None:
+        tradesdf["exchange"] = exchange
+    return tradesdf
+
+
+def order_book_frame(records):
+    """
+    Turn the level records of one snapshot into a DataFrame.
+
+    Books are only converted once, by ``store.book_to_records``, the frame
+    is built from those records when it is asked for. The shorter side is
+    padded with NaN.
+    """
+    sides = {"asks": records[records["side"] == ASK],
+             "bids": records[records["side"] == BID]}
+    rows = max(len(levels) for levels in sides.values())
+    columns = {}
+    for side, levels in sides.items():
+        for field in ["price", "volume"]:
+            column = np.full(rows, np.nan)
+            column[:len(levels)] = levels[field]
+            columns[(side, field)] = column
+    return pd.DataFrame(columns)
+
+
+def ohlcv_frame(ohlcv):
+    """Turn a list of ccxt candles into a DataFrame with local datetimes."""
+    candles = np.asarray(ohlcv, dtype=float).reshape(-1, len(OHLCV_FIELDS))
+    ohlcvdf = pd.DataFrame(candles, columns=OHLCV_FIELDS)
+    ohlcvdf["timestamp"] = candles[:, 0].astype("i8")
+    # Candles have been stored in local time so far
+    ohlcvdf["datetime"] = ms_to_datetime(ohlcvdf["timestamp"], local=True)
+    return ohlcvdf
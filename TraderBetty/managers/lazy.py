@@ -0,0 +1,82 @@
+"""Provides lazily loaded data files and modules."""
+import importlib
+import threading
+from collections.abc import MutableMapping
+
+
+class LazyFrames(MutableMapping):
+    """Dict of DataFrames that are read from disk on first access.
+
+    Only the paths are known up front, a file is loaded with ``loader`` the
+    first time its key is looked up and kept afterwards. Frames can also be
+    set directly, e.g. after an update, without any file being read, or be
+    built by a function of their own on first access.
+    """
+    def __init__(self, loader, paths=None):
+        self._loader = loader
+        self._paths = dict(paths or {})
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key not in self._frames:
+                source = self._paths[key]
+                self._frames[key] = (source() if callable(source) else
+                                     self._loader(source))
+            return self._frames[key]
+
+    def __setitem__(self, key, frame):
+        with self._lock:
+            self._frames[key] = frame
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._frames and key not in self._paths:
+                raise KeyError(key)
+            self._frames.pop(key, None)
+            self._paths.pop(key, None)
+
+    def __iter__(self):
+        return iter(set(self._paths) | set(self._frames))
+
+    def __len__(self):
+        return len(set(self._paths) | set(self._frames))
+
+    def __contains__(self, key):
+        return key in self._frames or key in self._paths
+
+    def add_path(self, key, path):
+        with self._lock:
+            self._paths[key] = path
+
+    def add_loader(self, key, load):
+        """Build the frame of ``key`` with ``load()`` on first access."""
+        with self._lock:
+            self._frames.pop(key, None)
+            self._paths[key] = load
+
+    def path(self, key):
+        return self._paths.get(key)
+
+    def is_loaded(self, key):
+        return key in self._frames
+
+
+class LazyModule(object):
+    """Stands in for a module that is only imported on first use.
+
+    Heavy or optional dependencies are bound at module level as usual, but
+    the import cost is only paid by the code paths that touch them.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return "<lazy module %r>" % self._name
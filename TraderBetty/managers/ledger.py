@@ -0,0 +1,115 @@
+"""Provides the append-only trade ledger."""
+import os
+import threading
+
+import pandas as pd
+
+from TraderBetty.managers.lazy import LazyFrames
+from TraderBetty.managers.metrics import track_write
+
+
+TRADE_COLUMNS = ["exchange", "id", "date", "datetime", "timestamp", "symbol",
+                 "order", "type", "side", "takerOrMaker", "price", "amount",
+                 "cost", "fee", "fee_currency"]
+
+
+class TradeLedger(object):
+    """Append-only trade ledger with one csv per exchange.
+
+    Trades are keyed by (exchange, id). The ids of every exchange are read
+    once from the id column of its ledger, which makes the ledger its own
+    persistent dedup index. Appending only writes the trades not seen
+    before, so an update costs O(new trades) however long the history is.
+    The full frames and the combined view of all exchanges are only built
+    when they are asked for.
+    """
+    def __init__(self, path_template, exchanges):
+        self.paths = {exchange: path_template % exchange for
+                      exchange in exchanges}
+        self.frames = LazyFrames(self._load, paths=self.paths)
+        self._ids = {}
+        self._combined = None
+        # Bumped by every append that writes trades
+        self.version = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _load(path):
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return pd.DataFrame(columns=TRADE_COLUMNS).set_index(
+                ["exchange", "id"])
+        return pd.read_csv(path, sep=";", parse_dates=["date", "datetime"],
+                           dtype={"id": str}, index_col=["exchange", "id"])
+
+    @staticmethod
+    def _header(path):
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return None
+        with open(path) as file:
+            return file.readline().strip().split(";")
+
+    def ids(self, exchange):
+        """Return the set of trade ids stored for the exchange."""
+        with self._lock:
+            if exchange not in self._ids:
+                path = self.paths[exchange]
+                header = self._header(path)
+                ids = set()
+                if header and "id" in header:
+                    ids = set(pd.read_csv(path, sep=";", usecols=["id"],
+                                          dtype={"id": str})["id"])
+                self._ids[exchange] = ids
+            return self._ids[exchange]
+
+    def append(self, exchange, trades):
+        """
+        Append the trades that are not in the ledger yet.
+
+        :param trades: DataFrame with at least the exchange and id columns
+        :return: the number of new trades
+        """
+        if trades is None or trades.empty:
+            return 0
+        if trades.index.names == ["exchange", "id"]:
+            trades = trades.reset_index()
+        trades = trades.copy()
+        trades["id"] = trades["id"].astype(str)
+        with self._lock:
+            ids = self.ids(exchange)
+            new = trades[~trades["id"].isin(ids)].drop_duplicates(
+                subset=["id"])
+            if new.empty:
+                return 0
+            path = self.paths[exchange]
+            header = self._header(path)
+            if header is None or any(c not in header for c in new.columns):
+                # New file or new columns, write the whole ledger once
+                frame = pd.concat([self.frames[exchange].reset_index(), new])
+                columns = [c for c in TRADE_COLUMNS if c in frame.columns]
+                columns += [c for c in frame.columns if c not in columns]
+                tmp_path = path + ".tmp"
+                with track_write(path):
+                    frame.to_csv(tmp_path, sep=";", index=False,
+                                 columns=columns)
+                    os.replace(tmp_path, path)
+                self.frames[exchange] = frame.set_index(["exchange", "id"])
+            else:
+                with track_write(path, append=True):
+                    new.reindex(columns=header).to_csv(
+                        path, sep=";", mode="a", header=False, index=False)
+                if self.frames.is_loaded(exchange):
+                    self.frames[exchange] = pd.concat([
+                        self.frames[exchange],
+                        new.set_index(["exchange", "id"])])
+            ids.update(new["id"])
+            self._combined = None
+            self.version += 1
+        return len(new)
+
+    def combined(self):
+        """Return the trades of all exchanges in one frame."""
+        with self._lock:
+            if self._combined is None:
+                self._combined = pd.concat(
+                    [self.frames[exchange] for exchange in self.paths])
+            return self._combined
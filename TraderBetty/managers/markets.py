@@ -0,0 +1,65 @@
+"""Provides the index over the markets of all exchanges."""
+
+
+class MarketIndex(object):
+    """Lookup tables from base, quote and exchange to symbols and markets.
+
+    The index is built from the loaded ccxt markets and only has to be
+    rebuilt when the markets are reloaded. Rebuilding swaps in new tables,
+    so readers holding a reference to the index always see a complete one.
+    """
+    def __init__(self, exchanges=None):
+        self.symbols = {}
+        self.markets = {}
+        self.pairs = {}
+        self.by_base = {}
+        self.by_coin = {}
+        if exchanges:
+            self.rebuild(exchanges)
+
+    def rebuild(self, exchanges):
+        symbols = {}
+        markets = {}
+        pairs = {}
+        by_base = {}
+        by_coin = {}
+        for exchange, ex in exchanges.items():
+            ex_markets = getattr(ex, "markets", None) or {}
+            symbols[exchange] = set(ex_markets)
+            for symbol, market in ex_markets.items():
+                base, quote = market["base"], market["quote"]
+                markets[(exchange, symbol)] = market
+                pairs.setdefault(symbol, set()).add(exchange)
+                by_base.setdefault((exchange, base), {})[quote] = symbol
+                by_coin.setdefault((exchange, base), set()).add(symbol)
+                by_coin.setdefault((exchange, quote), set()).add(symbol)
+        self.symbols = symbols
+        self.markets = markets
+        self.pairs = pairs
+        self.by_base = by_base
+        self.by_coin = by_coin
+
+    def has_symbol(self, exchange, symbol):
+        return (exchange, symbol) in self.markets
+
+    def market(self, exchange, symbol):
+        return self.markets.get((exchange, symbol))
+
+    def exchanges_for(self, symbol):
+        """Return the set of exchanges listing the symbol."""
+        return self.pairs.get(symbol, set())
+
+    def coin_symbols(self, exchange, coin):
+        """Return the symbols on the exchange with coin as base or quote."""
+        return self.by_coin.get((exchange, coin), set())
+
+    def symbols_between(self, exchange, bases, quotes):
+        """Return the symbols on the exchange from any base to any quote."""
+        quotes = set(quotes)
+        symbols = []
+        for base in bases:
+            ex_quotes = self.by_base.get((exchange, base), {})
+            for quote, symbol in ex_quotes.items():
+                if quote in quotes:
+                    symbols.append(symbol)
+        return symbols
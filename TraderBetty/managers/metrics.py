@@ -0,0 +1,265 @@
+"""Provides hot path metrics in the Prometheus text format."""
+import os
+import time
+import bisect
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from TraderBetty.managers.config import load_section
+
+
+DEFAULTS = {
+    # Serve the metrics over HTTP
+    "enabled": False,
+    "host": "127.0.0.1",
+    "port": 9108,
+}
+# Upper bounds in seconds of the latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for
+                             name, value in pairs)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(object):
+    """A metric with one series per combination of label values."""
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError("%s expects the labels %s" % (
+                self.name, ", ".join(self.labels)))
+        return tuple(str(label) for label in labels)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.kind)]
+        with self._lock:
+            series = sorted(self._series.items())
+            for labels, value in series:
+                lines.extend(self._render_series(labels, value))
+        return lines
+
+    def _render_series(self, labels, value):
+        return ["%s%s %s" % (self.name, _format_labels(self.labels, labels),
+                             _format_value(value))]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative buckets with a running sum."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, amount, *labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Counts of every bucket plus +Inf, then the sum
+                series = self._series[key] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, amount)] += 1
+            series[1] += amount
+
+    def count(self, *labels):
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def _render_series(self, labels, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append("%s_bucket%s %d" % (
+                self.name, _format_labels(self.labels, labels,
+                                          [("le", _format_value(bound))]),
+                cumulative))
+        labels = _format_labels(self.labels, labels)
+        lines.append("%s_sum%s %s" % (self.name, labels,
+                                      _format_value(total)))
+        lines.append("%s_count%s %d" % (self.name, labels, cumulative))
+        return lines
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, *args, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labels,
+                              buckets=buckets)
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+API_LATENCY = REGISTRY.histogram(
+    "traderbetty_api_request_seconds",
+    "Duration of the exchange API calls, without rate limit waits.",
+    ["exchange", "method"])
+API_ERRORS = REGISTRY.counter(
+    "traderbetty_api_errors_total",
+    "Exchange API calls that raised, by exception type.",
+    ["exchange", "method", "error"])
+RATE_LIMIT_WAIT = REGISTRY.counter(
+    "traderbetty_rate_limit_wait_seconds_total",
+    "Seconds calls waited for the rate limit of their exchange.",
+    ["exchange", "method"])
+STORE_LATENCY = REGISTRY.histogram(
+    "traderbetty_store_seconds",
+    "Duration of writing a data file.", ["file"])
+STORE_BYTES = REGISTRY.counter(
+    "traderbetty_store_bytes_total",
+    "Bytes written to the data files.", ["file"])
+LEG_LATENCY = REGISTRY.histogram(
+    "traderbetty_leg_ack_seconds",
+    "Seconds from sending an order leg until the exchange acknowledged it.",
+    ["exchange"])
+EXECUTION_LATENCY = REGISTRY.histogram(
+    "traderbetty_execution_ack_seconds",
+    "Seconds from an arbitrage signal until its last leg was acknowledged.")
+EXECUTION_OUTCOMES = REGISTRY.counter(
+    "traderbetty_executions_total",
+    "Multi-leg executions by outcome.", ["outcome"])
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+@contextlib.contextmanager
+def track_write(path, append=False):
+    """
+    Time the write of a data file and count the bytes written.
+
+    :param append: count only what the write added to the file
+    """
+    before = _size(path) if append else 0
+    start = time.perf_counter()
+    yield
+    name = os.path.basename(path)
+    STORE_LATENCY.observe(time.perf_counter() - start, name)
+    STORE_BYTES.inc(name, amount=max(_size(path) - before, 0))
+
+
+class MetricsServer(object):
+    """Serves the metrics of a registry on a local HTTP endpoint."""
+    def __init__(self, registry=REGISTRY, host="127.0.0.1", port=9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config_path, registry=REGISTRY):
+        """Return the server of the [metrics] section, None if disabled."""
+        options = load_section(config_path, "metrics", DEFAULTS)
+        if not options["enabled"]:
+            return None
+        return cls(registry, host=options["host"], port=options["port"])
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d/metrics" % (host, port)
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="metrics", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
@@ -0,0 +1,175 @@
+"""Provides the tracking of open orders and their fills."""
+import threading
+from collections import OrderedDict
+
+from TraderBetty.managers.lazy import LazyModule
+
+
+errors = LazyModule("ccxt.errors")
+
+# Order states after which an order never changes again
+DONE = ("closed", "canceled", "expired", "rejected")
+FILL, CLOSED, CANCELED = "fill", "closed", "canceled"
+
+
+class OrderTracker(object):
+    """Registry of the live orders of all exchanges, refreshed in bulk.
+
+    A refresh costs one ``fetch_open_orders`` per exchange, or one per
+    symbol with live orders where the exchange wants a symbol, however many
+    orders are open. Orders that left the open list are looked up with one
+    ``fetch_closed_orders`` per symbol. New fills are synced into the trade
+    ledger and every change is passed to the subscribers as
+    ``callback(event, exchange, order)``, the event being FILL, CLOSED or
+    CANCELED.
+
+    Exchanges whose orders are streamed are listed in ``streamed``, they
+    push their updates through ``apply`` and are never polled.
+    """
+    def __init__(self, PM, keep_finished=1000):
+        """:param keep_finished: finished orders kept for lookups"""
+        self.PM = PM
+        self.keep_finished = keep_finished
+        # Exchange to order id to the last known state of live orders
+        self.orders = {}
+        self.finished = OrderedDict()
+        self.subscribers = []
+        self.streamed = set()
+        # Exchange to the symbols with fills not yet in the trade ledger
+        self.unsynced = {}
+        # Exchanges that only list the orders of one symbol per request
+        self._per_symbol = set()
+        self._lock = threading.RLock()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def track(self, exchange, order):
+        """Follow an order as returned by create_order."""
+        with self._lock:
+            self.orders.setdefault(exchange, {})[order["id"]] = dict(
+                order, filled=0.0, status="open")
+        self.apply(exchange, order)
+
+    def get(self, exchange, order_id):
+        """Return the last known state of a live or finished order."""
+        with self._lock:
+            order = self.orders.get(exchange, {}).get(order_id)
+            if order is None:
+                order = self.finished.get((exchange, order_id))
+            return order
+
+    def live(self, exchange=None):
+        with self._lock:
+            exchanges = [exchange] if exchange else list(self.orders)
+            return [order for ex in exchanges for order in
+                    self.orders.get(ex, {}).values()]
+
+    def apply(self, exchange, order):
+        """
+        Apply a new state of a tracked order and notify the subscribers.
+
+        :return: the events the update caused
+        """
+        events = []
+        with self._lock:
+            previous = self.orders.get(exchange, {}).get(order["id"])
+            if previous is None:
+                return events
+            if (order.get("filled") or 0) > (previous.get("filled") or 0):
+                events.append(FILL)
+                self.unsynced.setdefault(exchange, set()).add(
+                    order["symbol"])
+            status = order.get("status")
+            if status in DONE:
+                del self.orders[exchange][order["id"]]
+                self.finished[(exchange, order["id"])] = order
+                while len(self.finished) > self.keep_finished:
+                    self.finished.popitem(last=False)
+                events.append(CLOSED if status == "closed" else CANCELED)
+            else:
+                self.orders[exchange][order["id"]] = order
+        for event in events:
+            for callback in self.subscribers:
+                try:
+                    callback(event, exchange, order)
+                except Exception as e:
+                    print("Order subscriber failed on %s: %s" % (event, e))
+        return events
+
+    # -------------------------------------------------------------------------
+    # Refreshing
+    # -------------------------------------------------------------------------
+    def refresh(self, exchange):
+        """
+        Bring the live orders of an exchange up to date.
+
+        :return: the number of orders that changed
+        """
+        live = [] if exchange in self.streamed else self.live(exchange)
+        changed = 0
+        if live:
+            changed = self._refresh_orders(exchange, live)
+        with self._lock:
+            symbols = self.unsynced.pop(exchange, None)
+        if symbols:
+            try:
+                self.PM.sync_symbol_trades(exchange, symbols)
+            except errors.BaseError as e:
+                print("Fills on %s could not be synced: %s" % (exchange, e))
+                with self._lock:
+                    self.unsynced.setdefault(exchange, set()).update(symbols)
+        return changed
+
+    def _refresh_orders(self, exchange, live):
+        updates = self._fetch(exchange, "fetch_open_orders",
+                              {order["symbol"] for order in live})
+        listed = {order["id"] for order in updates}
+        missing = [order for order in live if order["id"] not in listed]
+        if missing:
+            since = min(order.get("timestamp") or 0 for order in missing)
+            updates += self._fetch(exchange, "fetch_closed_orders",
+                                   {order["symbol"] for order in missing},
+                                   since=since or None)
+            found = {order["id"] for order in updates}
+            # Some exchanges don't list canceled orders, ask for each one
+            for order in missing:
+                if order["id"] in found:
+                    continue
+                try:
+                    updates.append(self.PM.limiter.call(
+                        exchange, "fetch_order", order["id"],
+                        order["symbol"]))
+                except errors.OrderNotFound as e:
+                    print("Order %s on %s was not found: %s" % (
+                        order["id"], exchange, e))
+        return sum(bool(self.apply(exchange, order)) for order in updates)
+
+    def refresh_all(self, exchanges=None):
+        """Refresh every exchange with live orders or unsynced fills.
+
+        Streamed exchanges only get their fills synced.
+        """
+        with self._lock:
+            exchanges = [ex for ex in (exchanges or
+                                       self.PM.available_exchanges())
+                         if self.unsynced.get(ex) or (
+                             self.orders.get(ex) and ex not in self.streamed)]
+        if not exchanges:
+            return {}
+        return self.PM._fan_out(self.refresh, exchanges)
+
+    def _fetch(self, exchange, method, symbols, since=None):
+        """Call method for all symbols at once if the exchange allows it."""
+        if exchange not in self._per_symbol:
+            try:
+                return list(self.PM.limiter.call(exchange, method,
+                                                 since=since))
+            except errors.ArgumentsRequired:
+                # The exchange wants a symbol, remember it
+                self._per_symbol.add(exchange)
+        orders = []
+        for symbol in sorted(symbols):
+            orders += self.PM.limiter.call(exchange, method, symbol,
+                                           since=since)
+        return orders
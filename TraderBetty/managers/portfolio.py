@@ -1,30 +1,116 @@
 """Provides the portfolio manager class"""
 import os
-import json
 #from json.decoder import JSONDecodeError
 import time
 import datetime as dt
-import calendar
-import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib as mpl
 
-from ccxt import errors
-from forex_python.converter import CurrencyRates
+from TraderBetty.managers import ingest
+from TraderBetty.managers.cache import MarketDataCache
+from TraderBetty.managers.config import load_section
+from TraderBetty.managers.data import (ALL_SYMBOLS, DataManager,
+                                       timeframe_to_ms)
+from TraderBetty.managers.fx import FxRates
+from TraderBetty.managers.lazy import LazyModule
+from TraderBetty.managers.orders import OrderTracker
+from TraderBetty.managers.ratelimit import RateLimiter
+from TraderBetty.managers.scheduler import DEFAULTS as SCHEDULE_DEFAULTS
+from TraderBetty.managers.valuation import ValuationEngine
 
-from TraderBetty.managers.data import DataManager
+# Only imported by the code paths that use them
+plt = LazyModule("matplotlib.pyplot")
+mpl = LazyModule("matplotlib")
+errors = LazyModule("ccxt.errors")
 
 
 class PortfolioManager(DataManager):
     def __init__(self, CH, config_path, config_loader):
         super().__init__(config_path, config_loader)
-        self.c = CurrencyRates()
         self.exchanges = CH.exchanges
         self.wallets = CH.wallets
+        self.market_index = CH.market_index
+        # Exchanges whose markets aren't loaded yet, shared with the CH
+        self.unavailable = CH.unavailable
 
         self.updates = {ex: {} for ex in self.exchanges}
+        # One worker per exchange for every scheduled job that may run at
+        # the same time, so a slow job never holds up the fan-outs of the
+        # others. Jobs can then call the same exchange at once, its token
+        # bucket in the limiter still keeps it within its rate limit.
+        jobs = load_section(config_path, "schedule",
+                            SCHEDULE_DEFAULTS)["max_workers"]
+        self.pool = ThreadPoolExecutor(
+            max_workers=max(len(self.exchanges), 1) * max(jobs, 1))
+        # All calls to the exchange APIs are scheduled through the limiter
+        self.limiter = RateLimiter(self.exchanges)
+        # Recently fetched tickers and order books are served from memory
+        self.cache = MarketDataCache.from_config(config_path)
+        # Exchanges that only return the trades of one symbol per request
+        self._per_symbol_trades = set()
+        # Streamed books and tickers are preferred to polling, see
+        # start_streams
+        self.streams = None
+        # FX rates served from memory, refreshed in the background once used
+        self.fx = FxRates.from_config(config_path)
+        # Live orders, refreshed in bulk per exchange
+        self.orders = OrderTracker(self)
+
+    def start_streams(self, feeds=None, symbols=None, **kwargs):
+        """
+        Stream order books and tickers instead of polling them.
+
+        :param feeds: dict of exchange to streaming.Feed, defaults to the
+            feeds of the exchanges that have one in streaming.FEEDS
+        :param symbols: dict of exchange to symbols, defaults to all markets
+            between the configured coins
+        """
+        from TraderBetty.managers.streaming import FEEDS, StreamManager
+
+        if feeds is None:
+            feeds = {exchange: FEEDS[exchange]() for exchange in
+                     self.exchanges if exchange in FEEDS}
+        self.streams = StreamManager(feeds, **kwargs)
+        for exchange in feeds:
+            self.streams.subscribe(exchange, (symbols or {}).get(
+                exchange) or self.market_index.symbols_between(
+                exchange, self.coins, self.coins))
+        self.streams.start()
+        return self.streams
+
+    def close(self):
+        if self.streams is not None:
+            self.streams.stop()
+        self.fx.stop()
+        super().close()
+
+    @property
+    def c(self):
+        """The FX rates, their refresh starts on first use."""
+        self.fx.start()
+        return self.fx
+
+    def available_exchanges(self):
+        """Return the exchanges with loaded markets, the fan-out default."""
+        return [exchange for exchange in self.exchanges if
+                exchange not in self.unavailable]
+
+    def _fan_out(self, func, exchanges, *args, **kwargs):
+        """Run ``func(exchange, *args, **kwargs)`` for all exchanges at once.
+
+        A snapshot across exchanges then takes as long as the slowest
+        exchange instead of the sum of all round trips. Results are returned
+        as a dict keyed by exchange, in the order of ``exchanges``.
+
+        Fan-outs of jobs running at the same time aren't serialized per
+        exchange, their calls only wait for the token bucket of the
+        exchange in ``limiter``.
+        """
+        futures = [
+            (exchange, self.pool.submit(func, exchange, *args, **kwargs))
+            for exchange in exchanges]
+        return {exchange: future.result() for exchange, future in futures}
 
     # -------------------------------------------------------------------------
     # Interactions with the wallets
@@ -47,7 +133,7 @@ class PortfolioManager(DataManager):
     # -------------------------------------------------------------------------
     def get_ex_balance(self, exchange, hide_zero=True, update=True):
         ex = self.exchanges[exchange]
-        balance = ex.fetch_balance()["total"]
+        balance = self.limiter.call(exchange, "fetch_balance")["total"]
         if hide_zero:
             balance = {
                 key: value for key, value in balance.items() if value > 0
@@ -57,90 +143,213 @@ class PortfolioManager(DataManager):
             self.updates[ex.id]["balance"] = dt.datetime.today()
         return balance
 
+    def get_all_ex_balances(self, exchanges=None):
+        return self._fan_out(self.get_ex_balance,
+                             exchanges or self.available_exchanges())
+
     def get_trades(self, exchange, since=None):
-        ex = self.exchanges[exchange]
-        try:
-            trades = ex.fetch_my_trades(since=since)
-        except errors.ExchangeError:
-            delay = ex.rateLimit if ex.id != "bitfinex" else ex.rateLimit + 2000
-            delay = int(delay / 1000)
-            trades = []
-            symbols = []
-            # Careful here, it only gets trades where balance is > 0
-            coins = [c for c in self.balances.index.tolist() if
-                     self.balances.loc[c, ex.id] > 0]
-            for coin in coins:
-                coin_symbols = [s for s in ex.symbols if coin in s]
-                symbols += coin_symbols
-            for symbol in list(set(symbols)):
-                symbol_trades = ex.fetch_my_trades(symbol, since=since)
-                trades += symbol_trades
-                time.sleep(delay)
-        tradesdf = pd.read_json(json.dumps(trades))
-        # Add additional columns
-        tradesdf["exchange"] = ex.name
-        tradesdf["date"] = tradesdf["datetime"].apply(lambda d: d.date())
-        self.updates[ex.id]["trades"] = dt.datetime.today()
-        self.update_trades(exchange, tradesdf)
+        """
+        Sync the trades of one exchange and return the trades fetched.
+
+        Trades before the cursor of a symbol are not fetched again.
+        """
+        trades = []
+        self.sync_all_trades([exchange], since=since, fetched=trades)
         return trades
 
     def get_all_trades(self):
-        # This whole method is probably unnecessary
-        # There are duplicates in Binance and Bitfinex why?
-        for exchange in self.exchanges:
-            extr_path = "%s/trades_%s.csv" % (self.DATA_PATH, exchange)
-            if os.path.isfile(extr_path):
-                extrades = self.extrades[exchange]
-            else:
-                extrades = self.get_trades(exchange)
-            self.update_trades(exchange, extrades)
+        self.sync_all_trades()
         return self.trades
 
+    def trade_symbols(self, exchange):
+        """
+        Return the symbols to sync the trades of one by one.
+
+        Covers the markets between the configured coins, the coins held and
+        the coins traded before, even if they were sold out since.
+        """
+        coins = set(self.coins)
+        if self.balances is not None and exchange in self.balances:
+            held = self.balances[exchange].fillna(0) > 0
+            coins.update(self.balances.index[held])
+        traded = self.traded_symbols(exchange)
+        for symbol in traded:
+            coins.update(symbol.split("/"))
+        symbols = set(self.market_index.symbols_between(exchange, coins,
+                                                         coins))
+        symbols.update(s for s in traded if
+                       self.market_index.has_symbol(exchange, s))
+        return sorted(symbols)
+
+    def sync_trades(self, exchange, symbol=None, since=None, limit=500,
+                    store_cursors=True, fetched=None):
+        """
+        Fetch only the trades after the cursor and add them to the ledger.
+
+        Pages forward from the last synced trade, every page is written
+        before the next is requested, so an interrupted sync resumes where
+        it stopped.
+
+        :param symbol: None to fetch the trades of all symbols at once
+        :param since: timestamp in ms to start at if nothing is synced yet
+        :param limit: trades requested per page
+        :param fetched: list to add the fetched trades to
+        :return: the number of new trades
+        """
+        ex = self.exchanges[exchange]
+        key = symbol or ALL_SYMBOLS
+        cursor = self.trade_cursor(exchange, key)
+        if cursor is not None:
+            since = cursor["timestamp"]
+        new = 0
+        seen = set()
+        page_limit = limit
+        while True:
+            page = self.limiter.call(exchange, "fetch_my_trades", symbol,
+                                     since=since, limit=page_limit)
+            if not page:
+                break
+            fresh = [trade for trade in page if trade["id"] not in seen]
+            seen.update(trade["id"] for trade in page)
+            if fresh:
+                new += self.update_trades(exchange,
+                                          ingest.trades_frame(fresh, ex.name))
+                if fetched is not None:
+                    fetched.extend(fresh)
+            dated = [trade for trade in page
+                     if trade.get("timestamp") is not None]
+            if dated:
+                last = dated[-1]
+                self.set_trade_cursor(exchange, key, last["timestamp"],
+                                      last["id"])
+            if len(page) < page_limit or not dated:
+                break
+            # The next page starts at the last timestamp again, so trades
+            # sharing it aren't skipped, the ones seen are dropped. A full
+            # page without new trades is asked again with a larger limit
+            # until it reaches past that timestamp.
+            page_limit = limit if fresh else page_limit * 2
+            since = last["timestamp"]
+        if store_cursors:
+            self.store_trade_cursors()
+        self.updates[exchange]["trades"] = dt.datetime.today()
+        return new
+
+    def sync_symbol_trades(self, exchange, symbols):
+        """Sync the trades of a few symbols, at once if the exchange can."""
+        if exchange not in self._per_symbol_trades:
+            return self.sync_trades(exchange)
+        new = sum(self.sync_trades(exchange, symbol, store_cursors=False)
+                  for symbol in sorted(symbols))
+        self.store_trade_cursors()
+        return new
+
+    def sync_all_trades(self, exchanges=None, since=None, workers=4,
+                        fetched=None):
+        """
+        Bring the trade ledgers of many exchanges up to date.
+
+        Exchanges are synced side by side. Where the trades can't be
+        fetched for all symbols at once, the symbols are fetched by
+        ``workers`` threads, all under the rate limit of the exchange.
+
+        :param fetched: list to add the fetched trades to
+        :return: dict of exchange to the number of new trades
+        """
+        exchanges = exchanges or self.available_exchanges()
+
+        def sync_symbol(exchange, symbol):
+            try:
+                return self.sync_trades(exchange, symbol, since=since,
+                                        store_cursors=False, fetched=fetched)
+            except errors.BaseError as e:
+                print("Trades of %s on %s failed: %s" % (symbol, exchange, e))
+                return 0
+
+        def sync_exchange(exchange):
+            if exchange not in self._per_symbol_trades:
+                try:
+                    return self.sync_trades(exchange, since=since,
+                                            store_cursors=False,
+                                            fetched=fetched)
+                except (errors.ArgumentsRequired, errors.NotSupported):
+                    # The exchange wants a symbol, remember it
+                    self._per_symbol_trades.add(exchange)
+                except errors.BaseError as e:
+                    print("Trades of %s failed: %s" % (exchange, e))
+                    return 0
+            symbols = self.trade_symbols(exchange)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                return sum(pool.map(lambda s: sync_symbol(exchange, s),
+                                    symbols))
+
+        new = self._fan_out(sync_exchange, exchanges)
+        self.store_trade_cursors()
+        return new
+
     # -------------------------------------------------------------------------
     # Price data collection methods
     # -------------------------------------------------------------------------
-    def get_last_price(self, exchange, symbol, verbose=True):
+    def get_last_price(self, exchange, symbol, verbose=True, max_age=None):
         ex = self.exchanges[exchange]
         if not ex.has["fetchTicker"]:
             print("%s doesn't support fetch_ticker()" % ex.name)
             return None
-        if symbol not in ex.symbols:
+        if not self.market_index.has_symbol(exchange, symbol):
             if verbose:
                 print("%s is not available on %s." % (symbol, ex.name))
             return None
-        lp = ex.fetch_ticker(symbol)["last"]
-        self.update_ex_price(exchange, symbol, lp)
-        return lp
+        # A stalled stream falls through to the cache and then to REST
+        if max_age is None:
+            max_age = self.cache.max_age["ticker"]
+        ticker = None
+        if self.streams is not None:
+            ticker = self.streams.ticker(exchange, symbol, max_age=max_age)
+        if ticker is None:
+            ticker = self.cache.get("ticker", exchange, symbol,
+                                    max_age=max_age)
+        if ticker is None:
+            ticker = self.limiter.call(exchange, "fetch_ticker", symbol)
+            self.cache.put("ticker", exchange, symbol, ticker)
+            self.update_ex_price(exchange, symbol, ticker["last"])
+        return ticker["last"]
 
     def get_last_prices(self, exchanges=None):
         if not exchanges:
-            exchanges = [ex for ex in self.exchanges]
-        for exchange in exchanges:
-            ex = self.exchanges[exchange]
-            delay = (ex.rateLimit / 1000)
-            tickers = ex.fetch_tickers() if ex.has["fetchTickers"] else None
-            lpdf = self.exprices[exchange]
-            bases = lpdf.index.tolist()
-            quotes = list(lpdf.columns)
-            symbols = [
-                base + "/" + quote for base, quote in
-                itertools.product(bases, quotes) if base != quote]
-            symbols = filter(lambda s: s in ex.symbols, symbols)
-            for symbol in symbols:
-                if tickers:
-                    lp = tickers.get(symbol, None)
-                    lp = lp["last"] if lp else None
-                    self.update_ex_price(exchange, symbol, lp)
-                else:
-                    self.get_last_price(exchange, symbol, verbose=False)
-                    time.sleep(delay)
-
-    def get_all_ex_lp(self, symbol, exchanges=None):
+            exchanges = self.available_exchanges()
+        # Every exchange spends its own budget, so they can run side by side
+        self._fan_out(self._get_ex_last_prices, exchanges)
+
+    def _get_ex_last_prices(self, exchange):
+        ex = self.exchanges[exchange]
+        tickers = self.limiter.call(exchange, "fetch_tickers") if (
+            ex.has["fetchTickers"]) else None
+        for symbol, ticker in (tickers or {}).items():
+            self.cache.put("ticker", exchange, symbol, ticker)
+        lpdf = self.exprices[exchange]
+        symbols = self.market_index.symbols_between(
+            exchange, lpdf.index.tolist(), list(lpdf.columns))
+        for symbol in symbols:
+            if tickers:
+                lp = tickers.get(symbol, None)
+                lp = lp["last"] if lp else None
+                self.update_ex_price(exchange, symbol, lp)
+            else:
+                self.get_last_price(exchange, symbol, verbose=False)
+        self.updates[exchange]["prices"] = dt.datetime.today()
+
+    def get_all_ex_lp(self, symbol, exchanges=None, parallel=True):
         prices = {}
         if not exchanges:
-            exchanges = [ex for ex in self.exchanges]
-        for exchange in exchanges:
-            lp = self.get_last_price(exchange, symbol, verbose=False)
+            exchanges = self.available_exchanges()
+        if parallel:
+            lps = self._fan_out(self.get_last_price, exchanges, symbol,
+                                verbose=False)
+        else:
+            lps = {exchange: self.get_last_price(exchange, symbol,
+                                                 verbose=False)
+                   for exchange in exchanges}
+        for exchange, lp in lps.items():
             if lp:
                 prices[exchange] = lp
         prices = sorted(prices.items(), key=lambda x: x[1], reverse=True)
@@ -155,22 +364,50 @@ class PortfolioManager(DataManager):
         bestprice = prices[0][1]
         return bestex, bestprice
 
-    def get_order_book(self, exchange, symbol):
+    def get_order_book(self, exchange, symbol, max_age=None):
         ex = self.exchanges[exchange]
         if not ex.has["fetchOrderBook"]:
             print("{:s} doesn't support fetch_order_book().".format(exchange))
             return None
-        if symbol not in ex.symbols:
+        if not self.market_index.has_symbol(exchange, symbol):
             print("{:s} not available on {:s}.".format(symbol, exchange))
             return None
-        ob = ex.fetch_order_book(symbol)
+        if max_age is None:
+            max_age = self.cache.max_age["order_book"]
+        if self.streams is not None:
+            ob = self.streams.order_book(exchange, symbol, max_age=max_age)
+            if ob is not None:
+                return ob
+        ob = self.cache.get("order_book", exchange, symbol, max_age=max_age)
+        if ob is not None:
+            return ob
+        ob = self.limiter.call(exchange, "fetch_order_book", symbol)
         if not ob["datetime"]:
             ob["datetime"] = dt.datetime.now()
         if not ob["timestamp"]:
-            ob["timestamp"] = calendar.timegm(dt.datetime.now().timetuple())
+            ob["timestamp"] = int(time.time() * 1000)
+        self.cache.put("order_book", exchange, symbol, ob)
         self.update_order_book(exchange, symbol, ob)
         return ob
 
+    def get_order_books(self, symbols=None, exchanges=None):
+        """
+        Refresh the order books of many symbols, exchanges side by side.
+
+        :param symbols: dict of exchange to symbols, defaults to all markets
+            between the configured coins
+        :return: dict of exchange to dict of symbol to order book
+        """
+        symbols = symbols or {}
+
+        def fetch(exchange):
+            return {symbol: self.get_order_book(exchange, symbol) for
+                    symbol in symbols.get(exchange) or
+                    self.market_index.symbols_between(
+                        exchange, self.coins, self.coins)}
+
+        return self._fan_out(fetch, exchanges or self.available_exchanges())
+
     def get_best_order(self, exchange, symbol, verbose=False):
         orderbook = self.get_order_book(exchange, symbol)
         bid = orderbook['bids'][0][0] if len(orderbook['bids']) > 0 else None
@@ -181,16 +418,32 @@ class PortfolioManager(DataManager):
                   {'bid': bid, 'ask': ask, 'spread': "{:.2f}%".format(spread)})
         return {"bid": bid, "ask": ask}
 
-    def get_all_ex_bid_ask(self, symbol, exchanges=None):
+    def get_all_ex_bid_ask(self, symbol, exchanges=None, parallel=True):
         if not exchanges:
-            exchanges = self.exchanges.keys()
+            exchanges = self.available_exchanges()
+        listed = self.market_index.exchanges_for(symbol)
+        exchanges = [exchange for exchange in exchanges if exchange in listed]
+        if parallel:
+            return self._fan_out(self.get_best_order, exchanges, symbol)
         orders = {}
         for exchange in exchanges:
-            ex = self.exchanges[exchange]
-            if symbol in ex.symbols:
-                orders[exchange] = self.get_best_order(ex.id, symbol)
+            orders[exchange] = self.get_best_order(exchange, symbol)
         return orders
 
+    def get_bid_ask_snapshot(self, exchange, max_age=None):
+        """Return the tickers of all symbols on the exchange at once."""
+        ex = self.exchanges[exchange]
+        if not ex.has["fetchTickers"]:
+            print("{:s} doesn't support fetch_tickers().".format(exchange))
+            return None
+        tickers = self.cache.get("tickers", exchange, None, max_age=max_age)
+        if tickers is None:
+            tickers = self.limiter.call(exchange, "fetch_tickers")
+            self.cache.put("tickers", exchange, None, tickers)
+            for symbol, ticker in tickers.items():
+                self.cache.put("ticker", exchange, symbol, ticker)
+        return tickers
+
     def get_best_ask(self, symbol, exchanges=None):
         orders = self.get_all_ex_bid_ask(symbol, exchanges=exchanges)
         orders = sorted(orders.items(), key=lambda x: x[1]["ask"])
@@ -211,26 +464,127 @@ class PortfolioManager(DataManager):
         if not ex.has["fetchOHLCV"]:
             print("{:s} doesn't support fetch_ohlcv().".format(ex))
             return None
-        ohlcv = ex.fetch_ohlcv(symbol, freq, since=since)
-        ohlcvdf = pd.DataFrame(
-            ohlcv,
-            columns=["timestamp", "open", "high", "low", "close", "volume"])
-        ohlcvdf["datetime"] = ohlcvdf["timestamp"].apply(
-            lambda d: dt.datetime.fromtimestamp(int(d / 1000)))
-        self.update_ohlcv(exchange, symbol, freq, ohlcvdf)
+        ohlcv = self.limiter.call(exchange, "fetch_ohlcv", symbol, freq,
+                                  since=since)
+        # Like sync_ohlcv, the candle still in progress isn't stored
+        now = int(time.time() * 1000)
+        step = timeframe_to_ms(freq)
+        closed = [c for c in ohlcv if c[0] + step <= now]
+        if closed:
+            self.update_ohlcv(exchange, symbol, freq,
+                              ingest.ohlcv_frame(closed))
         return ohlcv
 
+    def backfill_ohlcv(self, exchange, symbol, freq="1d", limit=500):
+        """
+        Fetch the candles missing inside the stored series.
+
+        Markets without trades in a gap have no candles for it, their gaps
+        are asked for again on every backfill.
+
+        :return: the number of candles filled in
+        """
+        step = timeframe_to_ms(freq)
+        filled = 0
+        for start, end in self.ohlcv_gaps(exchange, symbol, freq):
+            cursor = start
+            candles = []
+            while cursor <= end:
+                page = self.limiter.call(exchange, "fetch_ohlcv", symbol,
+                                         freq, since=cursor, limit=limit)
+                page = [c for c in page if cursor <= c[0] <= end]
+                if not page:
+                    break
+                candles += page
+                cursor = page[-1][0] + step
+            if candles:
+                self.update_ohlcv(exchange, symbol, freq,
+                                  ingest.ohlcv_frame(candles))
+                filled += len(candles)
+        return filled
+
+    def sync_ohlcv(self, exchange, symbol, freq="1d", since=None, limit=500,
+                   store_marks=True, backfill=False):
+        """
+        Fetch only the candles after the last stored one and append them.
+
+        Pages forward from the high-water mark until all closed candles are
+        fetched, so gaps since the last sync are backfilled. The candle
+        still in progress is left for the next sync.
+
+        :param since: timestamp in ms to start at if nothing is stored yet
+        :param limit: candles requested per page
+        :param backfill: also fill the gaps inside the stored candles, see
+            backfill_ohlcv
+        :return: the number of appended candles
+        """
+        ex = self.exchanges[exchange]
+        if not ex.has["fetchOHLCV"]:
+            print("{:s} doesn't support fetch_ohlcv().".format(exchange))
+            return 0
+        if backfill:
+            self.backfill_ohlcv(exchange, symbol, freq, limit=limit)
+        step = timeframe_to_ms(freq)
+        mark = self.ohlcv_high_water_mark(exchange, symbol, freq)
+        cursor = mark + step if mark is not None else since
+        now = int(time.time() * 1000)
+        candles = []
+        while cursor is None or cursor + step <= now:
+            page = self.limiter.call(exchange, "fetch_ohlcv", symbol, freq,
+                                     since=cursor, limit=limit)
+            page = [c for c in page if c[0] + step <= now and (
+                cursor is None or c[0] >= cursor)]
+            if not page:
+                break
+            candles += page
+            cursor = page[-1][0] + step
+        appended = 0
+        if candles:
+            appended = self.append_ohlcv(exchange, symbol, freq,
+                                         ingest.ohlcv_frame(candles))
+        if store_marks:
+            self.store_ohlcv_marks()
+        self.updates[exchange]["ohlcv"] = dt.datetime.today()
+        return appended
+
+    def sync_all_ohlcv(self, symbols=None, freq="1d", exchanges=None,
+                       backfill=False):
+        """
+        Keep the candles of many symbols current in one cycle.
+
+        The exchanges are synced side by side, each under its own rate
+        limit.
+
+        :param symbols: dict of exchange to symbols, defaults to all markets
+            between the configured coins
+        :param backfill: also fill the gaps inside the stored candles
+        :return: dict of exchange to dict of symbol to appended candles
+        """
+        if not exchanges:
+            exchanges = list(symbols) if symbols else (
+                self.available_exchanges())
+        if not symbols:
+            symbols = {exchange: self.market_index.symbols_between(
+                exchange, self.coins, self.coins) for exchange in exchanges}
+
+        def sync_exchange(exchange):
+            return {symbol: self.sync_ohlcv(exchange, symbol, freq=freq,
+                                            store_marks=False,
+                                            backfill=backfill)
+                    for symbol in symbols.get(exchange, [])}
+
+        appended = self._fan_out(sync_exchange, exchanges)
+        self.store_ohlcv_marks()
+        return appended
+
     # -------------------------------------------------------------------------
     # Price calculation methods
     # -------------------------------------------------------------------------
     def is_convertible_to(self, base):
         quotes = ["EUR", "USD", "USDT", "BTC", "ETH"]
-        all_symbols = []
-        for ex in self.exchanges:
-            all_symbols += self.exchanges[ex].symbols
-        all_symbols = set(all_symbols)
         conv_dict = {
-            quote: base + "/" + quote in all_symbols for quote in quotes}
+            quote: bool(self.market_index.exchanges_for(base + "/" + quote))
+            for quote in quotes}
         return conv_dict
 
     def convert_coin(self, base, quote="BTC", amount=1):
@@ -255,18 +609,34 @@ class PortfolioManager(DataManager):
                                       amount=secval)
         return value
 
+    def get_ttl_values(self, quotes=("BTC", "EUR"), refresh=True):
+        """
+        Value all balances in every quote in one pass.
+
+        :param quotes: the coins to value the balances in
+        :param refresh: fetch the last prices of all exchanges first, and
+            only value with the prices of the exchanges that were reached
+        :return: DataFrame with one column per quote
+        """
+        exprices = self.exprices
+        if refresh:
+            start = dt.datetime.today()
+            self.get_last_prices()
+            exprices = {exchange: prices for exchange, prices in
+                        exprices.items() if self.updates[exchange].get(
+                            "prices", dt.datetime.min) >= start}
+        engine = ValuationEngine(exprices)
+        values = engine.value(self.balances["total"], quotes=quotes)
+        for coin in values.index[values.isnull().any(axis=1)]:
+            print("{:s} cannot be converted to {:s}.".format(
+                coin, ", ".join(quotes)))
+        values = values.fillna(0)
+        self.update_balances({"%s_value" % quote.lower(): values[quote]
+                              for quote in quotes})
+        return values
+
     def get_ttl_btcvalue(self):
-        ttls = self.balances["total"]
-        btcttls = []
-        for coin in ttls.index.tolist():
-            bal = ttls[coin]
-            btcbal = 0
-            if bal > 0:
-                btcbal = self.convert_coin(coin, amount=bal)
-            btcttls.append(btcbal)
-        btcttls = pd.Series(btcttls, index=ttls.index)
-        self.update_balance("btc_value", btcttls)
-        return btcttls
+        return self.get_ttl_values(quotes=("BTC",))["BTC"]
 
     def get_fiatvalue(self, coin, fiat="USD"):
         ttls = self.balances["total"]
@@ -286,17 +656,7 @@ class PortfolioManager(DataManager):
         return fiatbal
 
     def get_ttl_eurvalue(self):
-        ttls = self.balances["total"]
-        eurttls = []
-        for coin in ttls.index.tolist():
-            bal = ttls[coin]
-            eurbal = 0
-            if bal > 0:
-                eurbal = self.get_fiatvalue(coin, fiat="EUR")
-            eurttls.append(eurbal)
-        eurttls = pd.Series(eurttls, index=ttls.index)
-        self.update_balance("eur_value", eurttls)
-        return eurttls
+        return self.get_ttl_values(quotes=("EUR",))["EUR"]
 
     def get_prtf_value(self, quote="EUR", update=False):
         if update:
@@ -0,0 +1,120 @@
+"""Provides the rate limit scheduler for the exchange APIs."""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from TraderBetty.managers.metrics import (API_ERRORS, API_LATENCY,
+                                          RATE_LIMIT_WAIT)
+
+
+# Cost of an endpoint in multiples of the exchange's rateLimit
+DEFAULT_WEIGHTS = {
+    "fetch_tickers": 2,
+}
+# Exchange specific overrides of the default weights
+EXCHANGE_WEIGHTS = {
+    # Bitfinex throttles trade history much harder than its rateLimit says
+    "bitfinex": {"fetch_my_trades": 3},
+}
+
+
+class TokenBucket(object):
+    """Thread safe token bucket.
+
+    Tokens are refilled continuously at ``rate`` per second up to
+    ``capacity``. Callers reserve their tokens up front and then wait for
+    their turn, so concurrent requests are served first come, first served.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, weight=1):
+        """Reserve ``weight`` tokens and return the seconds to wait."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= weight
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self, weight=1):
+        """Block until ``weight`` tokens are available, return the wait."""
+        wait = self.reserve(weight)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RateLimiter(object):
+    """Central scheduler every ccxt call goes through.
+
+    Each exchange gets its own token bucket derived from its ``rateLimit``
+    (milliseconds between requests), so waiting on one exchange never
+    blocks the others. Requests can either be made blocking with ``call``
+    or queued with ``submit``, which dispatches them per exchange as soon as
+    the budget allows and returns a future.
+
+    Don't combine this with ccxt's own ``enableRateLimit``, the exchange
+    would be throttled twice.
+    """
+    def __init__(self, exchanges, weights=None, burst=1):
+        self.exchanges = exchanges
+        self.burst = burst
+        self.weights = {ex: dict(DEFAULT_WEIGHTS) for ex in exchanges}
+        for exchange, overrides in EXCHANGE_WEIGHTS.items():
+            if exchange in self.weights:
+                self.weights[exchange].update(overrides)
+        for exchange, overrides in (weights or {}).items():
+            self.weights.setdefault(exchange, dict(DEFAULT_WEIGHTS))
+            self.weights[exchange].update(overrides)
+        self.buckets = {}
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, exchange):
+        with self._lock:
+            if exchange not in self.buckets:
+                rate_limit = self.exchanges[exchange].rateLimit or 1
+                self.buckets[exchange] = TokenBucket(
+                    1000 / rate_limit, capacity=self.burst)
+            return self.buckets[exchange]
+
+    def weight(self, exchange, method):
+        return self.weights.get(exchange, DEFAULT_WEIGHTS).get(method, 1)
+
+    def call(self, exchange, method, *args, **kwargs):
+        """Call ``method`` on the exchange once its budget allows."""
+        ex = self.exchanges[exchange]
+        wait = self.bucket(exchange).acquire(self.weight(exchange, method))
+        if wait > 0:
+            RATE_LIMIT_WAIT.inc(exchange, method, amount=wait)
+        start = time.perf_counter()
+        try:
+            return getattr(ex, method)(*args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(exchange, method, type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - start, exchange,
+                                method)
+
+    def submit(self, exchange, method, *args, **kwargs):
+        """Queue a call and return a future with its result."""
+        with self._lock:
+            if exchange not in self._queues:
+                self._queues[exchange] = ThreadPoolExecutor(max_workers=1)
+            queue = self._queues[exchange]
+        return queue.submit(self.call, exchange, method, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        for queue in self._queues.values():
+            queue.shutdown(wait=wait)
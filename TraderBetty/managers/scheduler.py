@@ -0,0 +1,199 @@
+"""Provides the scheduler of the data collection jobs."""
+import time
+import heapq
+import logging
+import threading
+
+from TraderBetty.managers.config import load_section
+
+
+# Seconds between two runs of every job
+DEFAULTS = {
+    "max_workers": 4,
+    "tickers": 10.0,
+    "orders": 10.0,
+    "order_books": 60.0,
+    "balances": 300.0,
+    "valuation": 300.0,
+    "trades": 900.0,
+    "ohlcv": 3600.0,
+}
+SKIP, COALESCE = "skip", "coalesce"
+
+log = logging.getLogger(__name__)
+
+
+class Job(object):
+    def __init__(self, name, func, interval, overrun=SKIP):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.overrun = overrun
+        self.next_run = None
+        self.running = False
+        # A run was due while the job was running, see COALESCE
+        self.pending = False
+        self.runs = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.last_lag = None
+        self.max_lag = 0.0
+        self.last_duration = None
+
+    def report(self):
+        return {"interval": self.interval, "runs": self.runs,
+                "skipped": self.skipped, "coalesced": self.coalesced,
+                "errors": self.errors, "last_lag": self.last_lag,
+                "max_lag": self.max_lag,
+                "last_duration": self.last_duration}
+
+
+class JobScheduler(object):
+    """Runs jobs at their own intervals on a bounded number of threads.
+
+    A job is never run twice at once. When it is due while the previous run
+    is still going, the run is either skipped or, for jobs that coalesce,
+    made once right after the previous run ends, however many runs were
+    missed. One worker is kept for the jobs with the shortest interval, so
+    slow jobs never hold up the fast ones, the others start in the order
+    they were due. The lag is the time between when a run was due and when
+    it started.
+    """
+    def __init__(self, max_workers=4):
+        self.jobs = {}
+        self.max_workers = max_workers
+        self._queue = []
+        self._ready = []
+        self._busy = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = []
+
+    @classmethod
+    def from_config(cls, config_path):
+        """Return the scheduler and the intervals of the [schedule]."""
+        options = load_section(config_path, "schedule", DEFAULTS)
+        return cls(max_workers=options["max_workers"]), options
+
+    def add(self, name, func, interval, delay=0, overrun=SKIP):
+        """
+        Schedule ``func()`` to run every ``interval`` seconds.
+
+        :param delay: seconds until the first run
+        :param overrun: SKIP or COALESCE the runs due while it is running
+        """
+        job = Job(name, func, interval, overrun=overrun)
+        with self._cond:
+            self.jobs[name] = job
+            job.next_run = time.monotonic() + delay
+            heapq.heappush(self._queue, (job.next_run, name))
+            self._cond.notify_all()
+        return job
+
+    def report(self):
+        """Return the run statistics of all jobs."""
+        with self._cond:
+            return {name: job.report() for name, job in self.jobs.items()}
+
+    # -------------------------------------------------------------------------
+    # Running
+    # -------------------------------------------------------------------------
+    def start(self):
+        self._threads = [threading.Thread(target=self.run, name="scheduler",
+                                          daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._work, name="job-worker-%d" % i,
+                             daemon=True) for i in range(self.max_workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, wait=True):
+        """Stop scheduling, running jobs are finished if ``wait``."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def run(self):
+        """Dispatch the due jobs until stopped, blocks the calling thread."""
+        with self._cond:
+            while not self._stopped:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                due, name = self._queue[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._queue)
+                job = self.jobs.get(name)
+                if job is None or job.next_run != due:
+                    continue
+                self._dispatch(job, due)
+                # Missed runs are not made up for, keep to the interval
+                job.next_run = due + job.interval
+                if job.next_run <= now:
+                    missed = int((now - job.next_run) // job.interval) + 1
+                    job.skipped += missed
+                    job.next_run += missed * job.interval
+                heapq.heappush(self._queue, (job.next_run, name))
+
+    def _dispatch(self, job, due):
+        if job.running:
+            if job.overrun == COALESCE:
+                job.coalesced += 1
+                job.pending = True
+            else:
+                job.skipped += 1
+            return
+        job.running = True
+        self._ready.append((job.interval, due, job.name))
+        self._cond.notify_all()
+
+    def _next_ready(self):
+        """Pop the due job that may start now or return None."""
+        if self._busy >= self.max_workers:
+            return None
+        fastest = min(job.interval for job in self.jobs.values())
+        for entry in sorted(self._ready,
+                            key=lambda e: (e[0] > fastest, e[1])):
+            if (entry[0] <= fastest or self.max_workers == 1 or
+                    self._busy < self.max_workers - 1):
+                self._ready.remove(entry)
+                return entry
+        return None
+
+    def _work(self):
+        with self._cond:
+            while not self._stopped:
+                entry = self._next_ready()
+                if entry is None:
+                    self._cond.wait()
+                    continue
+                self._busy += 1
+                job, due = self.jobs[entry[2]], entry[1]
+                self._cond.release()
+                try:
+                    start = time.monotonic()
+                    try:
+                        job.func()
+                    except Exception:
+                        job.errors += 1
+                        log.exception("Job %s failed", job.name)
+                    end = time.monotonic()
+                finally:
+                    self._cond.acquire()
+                self._busy -= 1
+                job.runs += 1
+                job.last_lag = start - due
+                job.max_lag = max(job.max_lag, job.last_lag)
+                job.last_duration = end - start
+                job.running = False
+                if job.pending:
+                    job.pending = False
+                    self._dispatch(job, end)
+                self._cond.notify_all()
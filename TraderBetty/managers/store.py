@@ -0,0 +1,239 @@
+"""Provides the append-only order book store."""
+import os
+import time
+import weakref
+import itertools
+import threading
+
+import numpy as np
+
+
+# One record per order book level
+RECORD = np.dtype([("timestamp", "<i8"), ("side", "i1"), ("level", "<i2"),
+                   ("price", "<f8"), ("volume", "<f8")])
+BID, ASK = 0, 1
+
+
+def book_to_records(order_book, timestamp=None, depth=None):
+    """Convert a ccxt order book into an array of level records."""
+    if timestamp is None:
+        timestamp = order_book.get("timestamp")
+    parts = []
+    for side, key in [(BID, "bids"), (ASK, "asks")]:
+        levels = order_book.get(key)
+        if levels is None or not len(levels):
+            levels = np.empty((0, 2))
+        elif isinstance(levels, list) and len(levels[0]) == 2:
+            # Much faster than converting the nested lists as a whole
+            levels = levels[:depth]
+            levels = np.fromiter(itertools.chain.from_iterable(levels),
+                                 dtype=float, count=2 * len(levels))
+            levels = levels.reshape(-1, 2)
+        # Some exchanges send more than price and volume per level
+        levels = np.asarray(levels, dtype=float)[:depth, :2]
+        records = np.empty(len(levels), dtype=RECORD)
+        records["timestamp"] = timestamp
+        records["side"] = side
+        records["level"] = np.arange(len(levels))
+        records["price"] = levels[:, 0]
+        records["volume"] = levels[:, 1]
+        parts.append(records)
+    return np.concatenate(parts)
+
+
+def records_to_book(records):
+    """Convert the records of one snapshot back into bids and asks."""
+    bids = records[records["side"] == BID]
+    asks = records[records["side"] == ASK]
+    return {
+        "bids": np.column_stack([bids["price"], bids["volume"]]),
+        "asks": np.column_stack([asks["price"], asks["volume"]]),
+        "timestamp": int(records["timestamp"][0]) if len(records) else None,
+    }
+
+
+def _write_buffers(path, buffers, keys):
+    """Append the buffered records of keys to their files."""
+    written = 0
+    for key in keys:
+        records = np.concatenate(buffers.pop(key))
+        with open(OrderBookStore.file(path, *key), "ab") as file:
+            records.tofile(file)
+        written += len(records)
+    return written
+
+
+def _flush_at_exit(path, buffers, lock):
+    # Runs when the store is collected or at exit, whichever comes first
+    with lock:
+        _write_buffers(path, buffers, list(buffers))
+
+
+class OrderBookStore(object):
+    """Append-only store of order book snapshots.
+
+    Every (exchange, symbol) gets one file of fixed width level records in
+    time order. Snapshots that are not newer than the last one stored for
+    their key are dropped, so the timestamps of a file are always sorted
+    and unique. Snapshots are buffered in memory and written in batches,
+    either when ``batch_size`` records are buffered or when the oldest
+    buffered snapshot is older than ``flush_interval`` seconds. Reading a
+    time range memory-maps the file and bisects the timestamps, so only the
+    requested range is ever touched.
+
+    A record torn by a crash while writing is cut off the end of a file
+    the first time the file is used.
+    """
+    def __init__(self, path, batch_size=10000, flush_interval=60,
+                 depth=None):
+        # Absolute, the buffer may be flushed at exit from anywhere
+        self.path = os.path.abspath(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.depth = depth
+        os.makedirs(self.path, exist_ok=True)
+        self._buffers = {}
+        self._buffered = 0
+        self._buffered_since = None
+        # Last timestamp appended per key, read from the file once
+        self._last = {}
+        # Keys whose file is known to hold whole records only
+        self._checked = set()
+        self._lock = threading.Lock()
+        # Doesn't keep the store alive like atexit.register(self.flush)
+        weakref.finalize(self, _flush_at_exit, self.path, self._buffers,
+                         self._lock)
+
+    @staticmethod
+    def file(path, exchange, symbol):
+        return "{:s}/{:s}_{:s}.bin".format(
+            path, exchange, symbol.replace("/", "_"))
+
+    def _file(self, exchange, symbol):
+        return self.file(self.path, exchange, symbol)
+
+    def _check_file(self, key):
+        """Cut a torn record off the end of the file of key, once."""
+        if key in self._checked:
+            return
+        path = self._file(*key)
+        if os.path.isfile(path):
+            size = os.path.getsize(path)
+            torn = size % RECORD.itemsize
+            if torn:
+                print("%s ends in a torn record, cutting off %d bytes." % (
+                    path, torn))
+                os.truncate(path, size - torn)
+        self._checked.add(key)
+
+    def keys(self):
+        """Return all (exchange, symbol) pairs with stored snapshots."""
+        keys = set(self._buffers)
+        for f in os.listdir(self.path):
+            if f.endswith(".bin"):
+                exchange, base, quote = f[:-len(".bin")].rsplit("_", 2)
+                keys.add((exchange, "/".join([base, quote])))
+        return sorted(keys)
+
+    def _last_timestamp(self, key):
+        if key not in self._last:
+            self._check_file(key)
+            path = self._file(*key)
+            last = None
+            if os.path.isfile(path) and os.path.getsize(path):
+                with open(path, "rb") as file:
+                    file.seek(-RECORD.itemsize, os.SEEK_END)
+                    last = int(np.fromfile(file, dtype=RECORD,
+                                           count=1)["timestamp"][0])
+            self._last[key] = last
+        return self._last[key]
+
+    def append(self, exchange, symbol, order_book):
+        """
+        Buffer a snapshot, return whether it was newer than the stored ones.
+
+        Reads bisect the timestamps, so older or repeated snapshots are
+        dropped instead of breaking the order of the file.
+        """
+        records = book_to_records(order_book, depth=self.depth)
+        if not len(records):
+            return False
+        timestamp = int(records["timestamp"][0])
+        key = (exchange, symbol)
+        with self._lock:
+            last = self._last_timestamp(key)
+            if last is not None and timestamp <= last:
+                print("Order book of %s on %s at %d is not newer than %d. "
+                      "Skipping." % (symbol, exchange, timestamp, last))
+                return False
+            self._last[key] = timestamp
+            self._buffers.setdefault(key, []).append(records)
+            self._buffered += len(records)
+            if self._buffered_since is None:
+                self._buffered_since = time.monotonic()
+            due = (self._buffered >= self.batch_size or
+                   time.monotonic() - self._buffered_since >=
+                   self.flush_interval)
+        if due:
+            self.flush()
+        return True
+
+    def flush(self, keys=None):
+        """Write the buffered snapshots to disk."""
+        with self._lock:
+            keys = list(self._buffers) if keys is None else [
+                key for key in keys if key in self._buffers]
+            self._buffered -= _write_buffers(self.path, self._buffers, keys)
+            if not self._buffers:
+                self._buffered = 0
+                self._buffered_since = None
+
+    def read(self, exchange, symbol, start=None, end=None):
+        """
+        Return the records of a time range without loading the whole file.
+
+        :param start: first timestamp in ms to include
+        :param end: last timestamp in ms to include
+        :return: memory-mapped record array, empty if nothing is stored
+        """
+        self.flush(keys=[(exchange, symbol)])
+        with self._lock:
+            self._check_file((exchange, symbol))
+        path = self._file(exchange, symbol)
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return np.empty(0, dtype=RECORD)
+        records = np.memmap(path, dtype=RECORD, mode="r")
+        timestamps = records["timestamp"]
+        lo = 0 if start is None else np.searchsorted(timestamps, start,
+                                                     side="left")
+        hi = len(records) if end is None else np.searchsorted(
+            timestamps, end, side="right")
+        return records[lo:hi]
+
+    def snapshots(self, exchange, symbol, start=None, end=None):
+        """Iterate over the order books of a time range."""
+        records = self.read(exchange, symbol, start=start, end=end)
+        if not len(records):
+            return
+        bounds = np.flatnonzero(np.diff(records["timestamp"])) + 1
+        bounds = np.concatenate([[0], bounds, [len(records)]])
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            yield records_to_book(records[lo:hi])
+
+    def latest_records(self, exchange, symbol):
+        """Return the records of the most recent stored snapshot or None."""
+        with self._lock:
+            buffered = self._buffers.get((exchange, symbol))
+            if buffered:
+                return buffered[-1]
+        records = self.read(exchange, symbol)
+        if not len(records):
+            return None
+        last = records["timestamp"][-1]
+        lo = np.searchsorted(records["timestamp"], last, side="left")
+        return records[lo:]
+
+    def latest(self, exchange, symbol):
+        """Return the most recent stored order book or None."""
+        records = self.latest_records(exchange, symbol)
+        return None if records is None else records_to_book(records)
@@ -0,0 +1,402 @@
+"""Provides streaming market data with locally maintained order books.
+
+The feeds are read over WebSockets, which needs the optional ``websockets``
+package. Messages are normalized by a ``Feed`` before they are applied:
+
+- ``{"type": "snapshot", "symbol", "sequence", "timestamp", "bids", "asks"}``
+  replaces the book of a symbol.
+- ``{"type": "update", ...}`` with the same fields changes the levels given,
+  a volume of 0 removes a level. Updates must follow each other without a
+  gap in the sequence numbers.
+- ``{"type": "ticker", "symbol", "timestamp", "bid", "ask", "last"}``.
+
+Of the configured exchanges only Bitstamp has a feed, ``BitstampFeed``,
+its book channel sends whole books. Binance, Bitfinex and Kraken stream
+changes that have to be laid on a REST snapshot, they keep being polled
+until they get a feed of their own.
+"""
+import json
+import time
+import asyncio
+import datetime as dt
+import threading
+
+
+class SequenceGap(Exception):
+    """An update was missed, the book has to be resynced."""
+
+
+class LocalOrderBook(object):
+    """Order book of one symbol kept current from a snapshot and updates.
+
+    Updates that arrive before the first snapshot are buffered and applied
+    on top of it. A gap in the sequence numbers resets the book and raises
+    ``SequenceGap``, the book stays unsynced until the next snapshot.
+    """
+    def __init__(self, symbol, max_pending=10000):
+        self.symbol = symbol
+        self.max_pending = max_pending
+        self.bids = {}
+        self.asks = {}
+        self.sequence = None
+        self.timestamp = None
+        # Monotonic time of the last change
+        self.updated = None
+        self._pending = []
+        self._view = None
+
+    @property
+    def synced(self):
+        return self.sequence is not None
+
+    def reset(self):
+        self.bids, self.asks = {}, {}
+        self.sequence = None
+        self._pending = []
+        self._view = None
+
+    @staticmethod
+    def _apply_levels(side, levels):
+        for level in levels:
+            price, volume = float(level[0]), float(level[1])
+            if volume == 0:
+                side.pop(price, None)
+            else:
+                side[price] = volume
+
+    def apply_snapshot(self, bids, asks, sequence, timestamp=None):
+        self.bids, self.asks = {}, {}
+        self._apply_levels(self.bids, bids)
+        self._apply_levels(self.asks, asks)
+        self.sequence = sequence
+        self._touch(timestamp)
+        pending, self._pending = self._pending, []
+        for update in pending:
+            self.apply_update(*update)
+
+    def apply_update(self, bids, asks, sequence, timestamp=None):
+        """
+        Apply the changed levels of one update.
+
+        :return: False if the update is older than the book
+        """
+        if not self.synced:
+            if len(self._pending) < self.max_pending:
+                self._pending.append((bids, asks, sequence, timestamp))
+            return True
+        if sequence <= self.sequence:
+            return False
+        if sequence != self.sequence + 1:
+            expected = self.sequence + 1
+            self.reset()
+            raise SequenceGap("%s expected %d, got %d" % (
+                self.symbol, expected, sequence))
+        self._apply_levels(self.bids, bids)
+        self._apply_levels(self.asks, asks)
+        self.sequence = sequence
+        self._touch(timestamp)
+        return True
+
+    def _touch(self, timestamp):
+        self.timestamp = timestamp or int(time.time() * 1000)
+        self.updated = time.monotonic()
+        self._view = None
+
+    def best_bid(self):
+        return max(self.bids) if self.bids else None
+
+    def best_ask(self):
+        return min(self.asks) if self.asks else None
+
+    def to_ccxt(self):
+        """Return the book in the structure of ccxt's fetch_order_book."""
+        if self._view is None:
+            self._view = {
+                "bids": [[p, self.bids[p]] for p in
+                         sorted(self.bids, reverse=True)],
+                "asks": [[p, self.asks[p]] for p in sorted(self.asks)],
+                "timestamp": self.timestamp,
+                "datetime": dt.datetime.fromtimestamp(
+                    self.timestamp / 1000, dt.timezone.utc).strftime(
+                    "%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+                "nonce": self.sequence,
+            }
+        return self._view
+
+
+class Feed(object):
+    """Connection details and message format of one exchange feed.
+
+    Speaks the normalized messages as they are, exchange specific feeds
+    override ``subscribe_message``, which may also return a list of
+    messages, and ``parse``.
+    """
+    def __init__(self, url):
+        self.url = url
+
+    def subscribe_message(self, symbols, channels):
+        return json.dumps({"op": "subscribe", "symbols": sorted(symbols),
+                           "channels": list(channels)})
+
+    def parse(self, raw):
+        """Return the normalized messages in a raw message."""
+        message = json.loads(raw)
+        return message if isinstance(message, list) else [message]
+
+
+class BitstampFeed(Feed):
+    """The public channels of the Bitstamp WebSocket API v2.
+
+    Every message of the ``order_book`` channel is the top of the book, it
+    is passed on as a snapshot numbered by its microsecond timestamp.
+    Tickers combine the best bid and ask of the book with the price of the
+    last trade of ``live_trades``.
+    """
+    CHANNELS = {"book": "order_book_", "ticker": "live_trades_"}
+
+    def __init__(self, url="wss://ws.bitstamp.net"):
+        super().__init__(url)
+        # Market id of a channel to its symbol
+        self._symbols = {}
+        # Best bid, ask and last trade price per symbol
+        self._tickers = {}
+
+    def subscribe_message(self, symbols, channels):
+        messages = []
+        for symbol in sorted(symbols):
+            market = symbol.replace("/", "").lower()
+            self._symbols[market] = symbol
+            for channel in channels:
+                if channel in self.CHANNELS:
+                    messages.append(json.dumps({
+                        "event": "bts:subscribe",
+                        "data": {"channel": self.CHANNELS[channel] +
+                                 market}}))
+        return messages
+
+    def parse(self, raw):
+        message = json.loads(raw)
+        event, channel = message.get("event"), message.get("channel", "")
+        data = message.get("data") or {}
+        symbol = self._symbols.get(channel.rsplit("_", 1)[-1])
+        if symbol is None or event not in ("data", "trade"):
+            return []
+        timestamp = int(data["microtimestamp"]) // 1000
+        ticker = self._tickers.setdefault(
+            symbol, {"bid": None, "ask": None, "last": None})
+        messages = []
+        if event == "data":
+            messages.append({
+                "type": "snapshot", "symbol": symbol,
+                "sequence": int(data["microtimestamp"]),
+                "timestamp": timestamp,
+                "bids": data.get("bids", []), "asks": data.get("asks", [])})
+            bids, asks = data.get("bids"), data.get("asks")
+            ticker["bid"] = float(bids[0][0]) if bids else None
+            ticker["ask"] = float(asks[0][0]) if asks else None
+        else:
+            ticker["last"] = float(data["price"])
+        if ticker["last"] is not None:
+            messages.append(dict(ticker, type="ticker", symbol=symbol,
+                                 timestamp=timestamp))
+        return messages
+
+
+# Feeds of the exchanges that have one, by ccxt id
+FEEDS = {"bitstamp": BitstampFeed}
+
+
+class StreamManager(object):
+    """Keeps order books and tickers of many exchanges current.
+
+    Every exchange feed is read by its own task on an event loop in a
+    background thread. Books are resynced by subscribing to their symbol
+    again, which makes the feed send a fresh snapshot, and connections are
+    reopened with an increasing delay when they drop. Readers in other
+    threads get copies through ``order_book`` and ``ticker``.
+    """
+    def __init__(self, feeds, channels=("book", "ticker"),
+                 reconnect_delay=1.0, max_reconnect_delay=30.0,
+                 record_path=None):
+        """
+        :param feeds: dict of exchange to Feed
+        :param record_path: file to append all normalized messages to, it
+            can be replayed by fake_stream.ReplayServer
+        """
+        self.feeds = feeds
+        self.channels = tuple(channels)
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.record_path = record_path
+        self.subscriptions = {exchange: set() for exchange in feeds}
+        self.books = {}
+        self.tickers = {}
+        self.stats = {"messages": 0, "gaps": 0, "resyncs": 0,
+                      "reconnects": 0}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._tasks = []
+        self._connections = {}
+        self._record = None
+
+    # -------------------------------------------------------------------------
+    # Control
+    # -------------------------------------------------------------------------
+    def subscribe(self, exchange, symbols):
+        symbols = set(symbols) - self.subscriptions[exchange]
+        self.subscriptions[exchange].update(symbols)
+        ws = self._connections.get(exchange)
+        if symbols and ws is not None:
+            self._call_soon(self._send(exchange, ws, symbols))
+
+    def start(self):
+        try:
+            import websockets
+        except ImportError:
+            raise ImportError("Streaming needs the websockets package, "
+                              "install it with pip install websockets")
+        if self._thread is not None:
+            return
+        if self.record_path:
+            self._record = open(self.record_path, "a")
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._tasks = [self._loop.create_task(
+                self._run(websockets, exchange)) for exchange in self.feeds]
+            self._loop.call_soon(started.set)
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="streams",
+                                        daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        async def cancel():
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._loop.stop()
+
+        self._call_soon(cancel())
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+        self._connections = {}
+        if self._record is not None:
+            self._record.close()
+            self._record = None
+
+    def _call_soon(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    # -------------------------------------------------------------------------
+    # Reading
+    # -------------------------------------------------------------------------
+    def order_book(self, exchange, symbol, max_age=None):
+        """
+        Return the streamed book like fetch_order_book or None.
+
+        :param max_age: seconds since the last change after which the book
+            counts as stale
+        """
+        with self._lock:
+            book = self.books.get((exchange, symbol))
+            if book is None or not book.synced:
+                return None
+            if max_age is not None and (time.monotonic() - book.updated >
+                                        max_age):
+                return None
+            view = book.to_ccxt()
+            return dict(view, bids=list(view["bids"]),
+                        asks=list(view["asks"]))
+
+    def ticker(self, exchange, symbol, max_age=None):
+        """Return the streamed ticker like fetch_ticker or None."""
+        with self._lock:
+            ticker, updated = self.tickers.get((exchange, symbol),
+                                               (None, None))
+        if ticker is None or (max_age is not None and
+                              time.monotonic() - updated > max_age):
+            return None
+        return dict(ticker)
+
+    # -------------------------------------------------------------------------
+    # Feed handling
+    # -------------------------------------------------------------------------
+    async def _send(self, exchange, ws, symbols):
+        messages = self.feeds[exchange].subscribe_message(symbols,
+                                                          self.channels)
+        if isinstance(messages, str):
+            messages = [messages]
+        for message in messages:
+            await ws.send(message)
+
+    async def _run(self, websockets, exchange):
+        feed = self.feeds[exchange]
+        delay = self.reconnect_delay
+        while True:
+            try:
+                async with websockets.connect(feed.url) as ws:
+                    self._connections[exchange] = ws
+                    delay = self.reconnect_delay
+                    if self.subscriptions[exchange]:
+                        await self._send(exchange, ws,
+                                         self.subscriptions[exchange])
+                    async for raw in ws:
+                        await self._handle(exchange, ws, raw)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Stream of %s dropped: %s" % (exchange, e))
+            self._connections.pop(exchange, None)
+            # Books missed every update while disconnected
+            with self._lock:
+                for (ex, symbol), book in self.books.items():
+                    if ex == exchange:
+                        book.reset()
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _handle(self, exchange, ws, raw):
+        resync = set()
+        with self._lock:
+            for message in self.feeds[exchange].parse(raw):
+                self.stats["messages"] += 1
+                if self._record is not None:
+                    self._record.write(json.dumps(message) + "\n")
+                try:
+                    self._apply(exchange, message)
+                except SequenceGap:
+                    self.stats["gaps"] += 1
+                    resync.add(message["symbol"])
+        if resync:
+            self.stats["resyncs"] += len(resync)
+            await self._send(exchange, ws, resync)
+
+    def _apply(self, exchange, message):
+        kind, symbol = message.get("type"), message.get("symbol")
+        if kind == "ticker":
+            ticker = {key: message.get(key) for key in
+                      ["symbol", "timestamp", "bid", "ask", "last"]}
+            self.tickers[(exchange, symbol)] = (ticker, time.monotonic())
+            return
+        if kind not in ("snapshot", "update"):
+            return
+        book = self.books.get((exchange, symbol))
+        if book is None:
+            book = self.books[(exchange, symbol)] = LocalOrderBook(symbol)
+        args = (message.get("bids", []), message.get("asks", []),
+                message["sequence"], message.get("timestamp"))
+        if kind == "snapshot":
+            book.apply_snapshot(*args)
+        else:
+            book.apply_update(*args)
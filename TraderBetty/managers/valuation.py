@@ -0,0 +1,89 @@
+"""Provides the graph based portfolio valuation."""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+class ValuationEngine(object):
+    """Values whole balance tables over a conversion graph.
+
+    Every coin is a node and every last price in the ``exprices`` matrices
+    is an edge in both directions, base to quote at the price and quote to
+    base at its inverse. Each pair is priced at the median over the
+    exchanges, so a stale price left over from one exchange can't inflate
+    the values. The best rate from any coin to a quote is the longest path
+    in log space, found by a max-plus relaxation over all coins at once.
+    Limiting it to ``max_hops`` conversions keeps arbitrage cycles from
+    blowing it up.
+    """
+    def __init__(self, exprices, max_hops=3):
+        self.max_hops = max_hops
+        coins = []
+        for prices in exprices.values():
+            if prices is None:
+                continue
+            for coin in list(prices.index) + list(prices.columns):
+                if coin not in coins:
+                    coins.append(coin)
+        self.coins = coins
+        self._positions = {coin: i for i, coin in enumerate(coins)}
+        self.log_rates = self._build_graph(exprices)
+        self._rates = {}
+
+    def _build_graph(self, exprices):
+        matrices = []
+        for prices in exprices.values():
+            if prices is None:
+                continue
+            prices = prices.reindex(index=self.coins, columns=self.coins)
+            prices = prices.apply(pd.to_numeric, errors="coerce")
+            prices = prices.to_numpy(dtype=float, copy=True)
+            prices[~(prices > 0)] = np.nan
+            matrices.append(prices)
+        n = len(self.coins)
+        if matrices:
+            with warnings.catch_warnings():
+                # Pairs no exchange prices stay NaN
+                warnings.simplefilter("ignore", RuntimeWarning)
+                median = np.nanmedian(np.stack(matrices), axis=0)
+        else:
+            median = np.full((n, n), np.nan)
+        # Edge i -> j converts one unit of i into j, quote to base at the
+        # inverse price
+        log_rates = np.fmax(np.log(median), -np.log(median).T)
+        log_rates[np.isnan(log_rates)] = -np.inf
+        np.fill_diagonal(log_rates, 0)
+        return log_rates
+
+    def rates_to(self, quote):
+        """Return the best conversion rate of every coin into quote."""
+        if quote not in self._rates:
+            values = np.full(len(self.coins), -np.inf)
+            if quote in self._positions:
+                target = self._positions[quote]
+                values[target] = 0
+                for _ in range(self.max_hops):
+                    values = np.maximum(
+                        values, (self.log_rates + values).max(axis=1))
+                    # A path ends as soon as it reaches the quote
+                    values[target] = 0
+            rates = np.exp(values)
+            rates[rates == 0] = np.nan
+            self._rates[quote] = pd.Series(rates, index=self.coins)
+        return self._rates[quote]
+
+    def value(self, amounts, quotes=("BTC", "EUR")):
+        """Value a series of coin amounts in every quote in one pass.
+
+        :param amounts: series of amounts indexed by coin
+        :param quotes: the coins to value the amounts in
+        :return: DataFrame with one column per quote, NaN where a coin with
+            a balance cannot be converted
+        """
+        amounts = pd.to_numeric(amounts, errors="coerce").fillna(0)
+        rates = pd.DataFrame({quote: self.rates_to(quote) for quote in quotes})
+        rates = rates.reindex(amounts.index)
+        values = rates.mul(amounts, axis=0)
+        values.loc[amounts == 0] = 0
+        return values
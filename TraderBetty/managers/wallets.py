@@ -1,53 +1,225 @@
-"""Iota wallet classes"""
-#!/usr/bin/env python3
-
+"""Iota wallet classes and the chunked balance checks of on-chain wallets"""
+import abc
 import os
-from configparser import ConfigParser
-from iota import Iota, Address, BadApiResponse, Hash
+import re
+import json
+import queue
+import time
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
+from TraderBetty.managers.config import load_section
+
+
+DEFAULTS = {
+    # The synced node to check the balances
+    "uri": "",
+    # Comma separated list of addresses to check
+    "addresses": "",
+    # Minutes between two checks, the balances are cached as long
+    "interval": 15.0,
+    # Addresses per request, nodes refuse long lists
+    "chunk_size": 500,
+    # Requests sent at the same time
+    "workers": 8,
+    "timeout": 10.0,
+}
+# Cached balances expire this fraction of their TTL early, so a check
+# scheduled every TTL seconds always gets fresh ones
+TTL_SLACK = 0.1
+ADDRESS_RE = re.compile(r"^[A-Z9]{81}$")
+
+
+def chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def split_addresses(addresses):
+    return [address.strip() for address in addresses.split(",")
+            if address.strip()]
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP connections to one node.
+
+    Each concurrent request takes a connection of its own and hands it back
+    afterwards, so the connections are only opened once per worker.
+    """
+    def __init__(self, uri, size=8, timeout=10.0):
+        parts = urlsplit(uri)
+        self.scheme = parts.scheme or "http"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        cls = (http.client.HTTPSConnection if self.scheme == "https" else
+               http.client.HTTPConnection)
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path="", body=None, headers=None):
+        """
+        Send a request over an idle connection.
+
+        :return: the status and the body of the response
+        """
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn, reused = self._connect(), False
+        try:
+            try:
+                status, data = self._send(conn, method, path, body, headers)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if not reused:
+                    raise
+                # The node closed the idle connection, open a new one
+                conn = self._connect()
+                status, data = self._send(conn, method, path, body, headers)
+        except Exception:
+            conn.close()
+            raise
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+        return status, data
+
+    def _send(self, conn, method, path, body, headers):
+        conn.request(method, self.base_path + path, body=body,
+                     headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.read()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
 
-class IotaWallet(object):
-    def __init__(self, config_path):
-        self.config = ConfigParser()
 
+class BalanceChecker(metaclass=abc.ABCMeta):
+    """Checks the balances of many addresses in concurrent chunks.
+
+    The addresses are split into chunks of at most ``chunk_size``, the
+    limit of the API, which are requested at the same time. Balances are
+    cached per address for ``ttl`` seconds, so only the addresses whose
+    balance expired are requested again. Subclasses implement ``_fetch``
+    for one chunk.
+    """
+    coin = None
+
+    def __init__(self, addresses, ttl, chunk_size, workers=8):
+        # Listing an address twice must not count its balance twice
+        self.addresses = list(dict.fromkeys(addresses))
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # Address to its balance and the time it was requested
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _fetch(self, addresses):
+        """Return the balances of one chunk of addresses by address."""
+
+    def expired(self, now=None):
+        now = time.monotonic() if now is None else now
+        max_age = self.ttl * (1 - TTL_SLACK)
+        with self._lock:
+            return [address for address in self.addresses
+                    if address not in self._cache or
+                    now - self._cache[address][1] >= max_age]
+
+    def _fetch_chunk(self, addresses):
+        try:
+            return self._fetch(addresses)
+        except Exception as e:
+            print("Balances of %d %s addresses could not be checked: %s" % (
+                len(addresses), self.coin, e))
+            return {}
+
+    def check_balance(self, refresh=False):
+        """
+        Return the balances of all addresses as ``{coin: {address: ...}}``.
+
+        Chunks that fail keep their last balances. If any address has no
+        balance at all an empty dict is returned, never a partial sum.
+
+        :param refresh: ignore the cached balances
+        """
+        if not self.addresses:
+            print("No valid %s addresses found." % self.coin)
+            return {}
+        start = time.monotonic()
+        expired = list(self.addresses) if refresh else self.expired(start)
+        results = self.pool.map(self._fetch_chunk,
+                                chunks(expired, self.chunk_size))
+        with self._lock:
+            for balances in results:
+                for address, balance in balances.items():
+                    self._cache[address] = (balance, start)
+            missing = [address for address in self.addresses
+                       if address not in self._cache]
+            if missing:
+                print("%d %s addresses have no balance yet." % (
+                    len(missing), self.coin))
+                return {}
+            return {self.coin: {address: self._cache[address][0]
+                                for address in self.addresses}}
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class IotaWallet(BalanceChecker):
+    """Balances of the addresses of the [iota] section.
+
+    The node is asked with the ``getBalances`` command of the IRI API over
+    pooled connections.
+    """
+    coin = "IOTA"
+
+    def __init__(self, config_path):
         if not os.path.isfile(config_path):
             raise ValueError
 
-        self.config.read(config_path)
-        self.config_addresses = self.config.get('iota_wallet', 'addresses').split(',')
-
-    def check_balance(self):
-        iota_dict = {}
+        options = load_section(config_path, "iota", DEFAULTS)
         addresses = []
-
-        for input_address in self.config_addresses:
-            if len(input_address) != Hash.LEN:
-                print('Address %s is not %d characters. Skipping.' % (
-                    input_address, Hash.LEN))
+        for address in split_addresses(options["addresses"]):
+            if not ADDRESS_RE.match(address):
+                print('Address %s is not 81 trytes. Skipping.' % address)
                 print('Make sure it does not include the checksum.')
                 continue
+            addresses.append(address)
+        super().__init__(addresses, options["interval"] * 60,
+                         options["chunk_size"], workers=options["workers"])
+        self.uri = options["uri"]
+        self.connections = ConnectionPool(self.uri, size=options["workers"],
+                                          timeout=options["timeout"])
 
-            addy = Address(input_address)
-            addresses.append(addy)
+    def _fetch(self, addresses):
+        body = json.dumps({"command": "getBalances", "addresses": addresses,
+                           "threshold": 100})
+        status, data = self.connections.request(
+            "POST", "/", body=body,
+            headers={"Content-Type": "application/json",
+                     "X-IOTA-API-Version": "1"})
+        response = json.loads(data.decode("utf-8", "ignore"))
+        if status != 200 or "balances" not in response:
+            raise ValueError("{uri} is not responding properly: {error}"
+                             .format(uri=self.uri,
+                                     error=response.get("error", status)))
+        return {address: int(balance) for address, balance in
+                zip(addresses, response["balances"])}
 
-        if len(addresses) == 0:
-            print('No valid addresses found, exiting.')
-        else:
-            config_uri = self.config.get('iota_wallet', 'uri')
-            api = Iota(config_uri)
-            response = None
-
-            try:
-                print('Connecting to tangle via {uri}.'.format(uri=config_uri))
-                response = api.get_balances(addresses)
-            except ConnectionError as e:
-                print('{uri} is not responding.'.format(uri=config_uri))
-                print(e)
-            except BadApiResponse as e:
-                print('{uri} is not responding properly.'.format(uri=config_uri))
-                print(e)
-
-            if response:
-                iota_dict = {"IOTA": {address: response['balances'][i] for i, address in enumerate(addresses)}}
-
-        return iota_dict
+    def close(self):
+        super().close()
+        self.connections.close()
@@ -10,7 +10,8 @@ setup(name="TraderBetty", version=VERSION, author="iuvbio",
       url="https://github.com/iuvbio/traderbetty.git",
       test_suite="", tests_require=[],
       packages=find_packages(exclude=["data", "docs", "tests*"]),
-      install_requires=["ccxt", "pandas"],
+      install_requires=["ccxt", "numpy", "pandas"],
+      extras_require={"streaming": ["websockets"]},
       description="Cryptocurrency portfolio manager and arbitrage trader",
       license="MIT",  classifiers=["Development Status :: 4 - Beta",
                                    "Intended Audience :: Developers"],
@@ -1,6 +1,8 @@
 """Provides the the arbitrage strategy components"""
 import abc
 
+from TraderBetty.strategies import depth
+
 
 class ArbitrageStrategyAbstract(metaclass=abc.ABCMeta):
     @abc.abstractmethod
@@ -17,26 +19,47 @@ class OnExchangeArbitrageStrategy(ArbitrageStrategyAbstract):
         print("I trade sometimes")
 
     def calc_profit(self, arb_dict, amount=1):
-        # Buy amount of base for quote1
-        cost = amount * arb_dict.get("prbq1")
-        cost += cost * arb_dict.get("buyfee")
-        # Get equivalent amount of quote2 if bought for cost
-        costq2equiv = cost * arb_dict.get("q1q2")
-        costq2equiv -= costq2equiv * arb_dict.get("convfee")
-        # Sell amount of base for quote2
-        income = amount * arb_dict.get("prbq2")
-        income -= income * arb_dict.get("sellfee")
-        # Get equivalent amount of quote1 if income sold
-        incq1equiv = income * arb_dict.get("q2q1")
-        incq1equiv -= incq1equiv * arb_dict.get("convfee")
-        spread_q1 = income - costq2equiv
-        spread_q2 = incq1equiv - cost
-        profit_dict = {
-            "cost": cost,
-            "costq2": costq2equiv,
-            "income": income,
-            "inq1": incq1equiv,
-            "spread_q1": spread_q1,
-            "spread_q2": spread_q2
-        }
-        return profit_dict
+        return calc_profit_arrays(
+            q2q1=arb_dict.get("q2q1"), q1q2=arb_dict.get("q1q2"),
+            prbq1=arb_dict.get("prbq1"), prbq2=arb_dict.get("prbq2"),
+            buyfee=arb_dict.get("buyfee"), sellfee=arb_dict.get("sellfee"),
+            convfee=arb_dict.get("convfee"), amount=amount)
+
+    def calc_depth_profit(self, depth_dict, amount=1):
+        """Like calc_profit but filling amount against the full books."""
+        profit = depth.depth_profit(depth_dict, [amount])
+        return {key: value[0] for key, value in profit.items()}
+
+    def calc_max_size(self, depth_dict):
+        return depth.max_profitable_size(depth_dict)
+
+
+def calc_profit_arrays(q2q1, q1q2, prbq1, prbq2, buyfee, sellfee, convfee,
+                       amount=1):
+    """Profit of buying base for quote1 and selling it for quote2.
+
+    Works on scalars as well as on NumPy arrays of opportunities.
+    """
+    # Buy amount of base for quote1
+    cost = amount * prbq1
+    cost = cost + cost * buyfee
+    # Get equivalent amount of quote2 if bought for cost
+    costq2equiv = cost * q1q2
+    costq2equiv = costq2equiv - costq2equiv * convfee
+    # Sell amount of base for quote2
+    income = amount * prbq2
+    income = income - income * sellfee
+    # Get equivalent amount of quote1 if income sold
+    incq1equiv = income * q2q1
+    incq1equiv = incq1equiv - incq1equiv * convfee
+    spread_q1 = income - costq2equiv
+    spread_q2 = incq1equiv - cost
+    profit_dict = {
+        "cost": cost,
+        "costq2": costq2equiv,
+        "income": income,
+        "inq1": incq1equiv,
+        "spread_q1": spread_q1,
+        "spread_q2": spread_q2
+    }
+    return profit_dict
@@ -0,0 +1,139 @@
+"""Provides the depth aware profit calculation for arbitrage"""
+import numpy as np
+
+
+def _cumulative(levels):
+    levels = np.asarray(levels, dtype=float).reshape(-1, 2)
+    cumvol = np.concatenate([[0], np.cumsum(levels[:, 1])])
+    cumnotional = np.concatenate([[0], np.cumsum(levels[:, 0] *
+                                                 levels[:, 1])])
+    return cumvol, cumnotional
+
+
+def walk_book(levels, amounts):
+    """
+    Notional of filling amounts of base against order book levels.
+
+    Filling is linear within a level, so interpolating the cumulative
+    volume and notional is exact.
+
+    :param levels: [[price, volume], ...] as returned by ccxt, best first
+    :param amounts: amounts of base to fill
+    :return: array of notionals in quote, NaN beyond the depth of the book
+    """
+    cumvol, cumnotional = _cumulative(levels)
+    return np.interp(amounts, cumvol, cumnotional, right=np.nan)
+
+
+def spend_on_book(levels, notionals):
+    """Amount of base a notional in quote fills against the levels."""
+    cumvol, cumnotional = _cumulative(levels)
+    return np.interp(notionals, cumnotional, cumvol, right=np.nan)
+
+
+def vwap(levels, amounts):
+    """Volume weighted fill price of amounts against the levels."""
+    amounts = np.asarray(amounts, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return walk_book(levels, amounts) / amounts
+
+
+def depth_profit(depth_dict, amounts):
+    """
+    Profit of the arbitrage for every amount, walking all order books.
+
+    :param depth_dict: the books and fees of one opportunity, see
+        ``ArbitrageTrader.get_depth_data``
+    :param amounts: amounts of base bought and sold
+    :return: dict of arrays with the keys of ``calc_profit_arrays`` plus the
+        fill prices ``prbq1`` and ``prbq2``
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    convfee = depth_dict.get("convfee")
+    # Buy amount of base for quote1 walking the asks
+    cost = walk_book(depth_dict.get("asks"), amounts)
+    cost = cost + cost * depth_dict.get("buyfee")
+    # Sell amount of base for quote2 walking the bids
+    income = walk_book(depth_dict.get("bids"), amounts)
+    income = income - income * depth_dict.get("sellfee")
+    conv_book = depth_dict.get("conv_book")
+    if conv_book is None:
+        costq2equiv = cost * depth_dict.get("q1q2")
+        incq1equiv = income * depth_dict.get("q2q1")
+    elif depth_dict.get("conv_inverted"):
+        # The conversion market is quote1/quote2
+        costq2equiv = walk_book(conv_book["bids"], cost)
+        incq1equiv = spend_on_book(conv_book["asks"], income)
+    else:
+        # The conversion market is quote2/quote1
+        costq2equiv = spend_on_book(conv_book["asks"], cost)
+        incq1equiv = walk_book(conv_book["bids"], income)
+    costq2equiv = costq2equiv - costq2equiv * convfee
+    incq1equiv = incq1equiv - incq1equiv * convfee
+    return {
+        "prbq1": vwap(depth_dict.get("asks"), amounts),
+        "prbq2": vwap(depth_dict.get("bids"), amounts),
+        "cost": cost,
+        "costq2": costq2equiv,
+        "income": income,
+        "inq1": incq1equiv,
+        "spread_q1": income - costq2equiv,
+        "spread_q2": incq1equiv - cost,
+    }
+
+
+def _breakpoints(depth_dict):
+    """Amounts of base at which the profit can change its slope."""
+    asks_vol, asks_notional = _cumulative(depth_dict.get("asks"))
+    bids_vol, bids_notional = _cumulative(depth_dict.get("bids"))
+    sizes = [asks_vol, bids_vol]
+    conv_book = depth_dict.get("conv_book")
+    if conv_book is not None:
+        # Amounts at which cost or income cross a level of the conversion
+        if depth_dict.get("conv_inverted"):
+            cost_levels = _cumulative(conv_book["bids"])[0]
+            income_levels = _cumulative(conv_book["asks"])[1]
+        else:
+            cost_levels = _cumulative(conv_book["asks"])[1]
+            income_levels = _cumulative(conv_book["bids"])[0]
+        sizes.append(np.interp(
+            cost_levels / (1 + depth_dict.get("buyfee")),
+            asks_notional, asks_vol, right=np.nan))
+        sizes.append(np.interp(
+            income_levels / (1 - depth_dict.get("sellfee")),
+            bids_notional, bids_vol, right=np.nan))
+    sizes = np.concatenate(sizes)
+    depth = min(asks_vol[-1], bids_vol[-1])
+    sizes = sizes[(sizes > 0) & (sizes <= depth)]
+    return np.unique(sizes)
+
+
+def max_profitable_size(depth_dict, spread="spread_q2"):
+    """
+    Best and largest profitable size of an opportunity.
+
+    The profit is piecewise linear in the size with kinks where a level of
+    any book is used up, and concave because every further level is worse.
+    It is evaluated at all kinks at once; the best size is among them and
+    the largest profitable size lies between the last positive kink and
+    the next one.
+
+    :return: dict with ``best_size``, ``best_profit`` and ``max_size``
+    """
+    sizes = _breakpoints(depth_dict)
+    if not len(sizes):
+        return {"best_size": 0, "best_profit": 0, "max_size": 0}
+    profits = depth_profit(depth_dict, sizes)[spread]
+    profits = np.nan_to_num(profits, nan=-np.inf)
+    best = int(np.argmax(profits))
+    if profits[best] <= 0:
+        return {"best_size": 0, "best_profit": 0, "max_size": 0}
+    positive = np.flatnonzero(profits > 0)
+    last = positive[-1]
+    max_size = sizes[last]
+    if last + 1 < len(sizes) and np.isfinite(profits[last + 1]):
+        # Linear between the kinks, find where the profit crosses zero
+        share = profits[last] / (profits[last] - profits[last + 1])
+        max_size = sizes[last] + share * (sizes[last + 1] - sizes[last])
+    return {"best_size": sizes[best], "best_profit": profits[best],
+            "max_size": max_size}
@@ -0,0 +1,142 @@
+"""Provides the vectorized triangular arbitrage scanner"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from TraderBetty.strategies.arbitrage import calc_profit_arrays
+
+
+FIAT = ["USD", "EUR"]
+# Conversion between the quotes of a triple
+DIRECT, INVERTED, FX = 0, 1, 2
+
+
+class TriangularArbitrageScanner(object):
+    """Evaluates every (base, quote1, quote2) triple of an exchange at once.
+
+    The candidate triples are enumerated once from the market index. Every
+    tick only the bid and ask arrays are updated and all triples are
+    evaluated in a single NumPy pass with the same formula as
+    ``OnExchangeArbitrageStrategy.calc_profit``.
+
+    Quote1 is converted to quote2 over the quote2/quote1 market, the
+    quote1/quote2 market, or, for fiat pairs without a market, FX rates.
+    """
+    def __init__(self, market_index, exchange, convfee=0.0025):
+        self.exchange = exchange
+        self.markets = market_index.markets
+        self.symbols = sorted(market_index.symbols.get(exchange, ()))
+        self._positions = {s: i for i, s in enumerate(self.symbols)}
+        self.bid = np.full(len(self.symbols), np.nan)
+        self.ask = np.full(len(self.symbols), np.nan)
+        fees = np.zeros(len(self.symbols))
+        for i, symbol in enumerate(self.symbols):
+            fees[i] = market_index.market(exchange, symbol).get("taker") or 0
+        self._build_triples(fees, convfee)
+
+    def _build_triples(self, fees, convfee):
+        quotes = {}
+        for symbol in self.symbols:
+            base, quote = symbol.split("/")
+            quotes.setdefault(base, []).append(quote)
+        triples = []
+        for base, base_quotes in quotes.items():
+            for quote1, quote2 in itertools.permutations(base_quotes, 2):
+                conv = self._positions.get("/".join([quote2, quote1]))
+                kind = DIRECT
+                if conv is None:
+                    conv = self._positions.get("/".join([quote1, quote2]))
+                    kind = INVERTED
+                if conv is None:
+                    if quote1 not in FIAT or quote2 not in FIAT:
+                        continue
+                    conv, kind = -1, FX
+                triples.append((
+                    base, quote1, quote2,
+                    self._positions["/".join([base, quote1])],
+                    self._positions["/".join([base, quote2])],
+                    conv, kind))
+        columns = ["base", "quote1", "quote2", "buy", "sell", "conv", "kind"]
+        self.triples = pd.DataFrame(triples, columns=columns)
+        self._buy = self.triples["buy"].to_numpy(dtype=int)
+        self._sell = self.triples["sell"].to_numpy(dtype=int)
+        self._conv = self.triples["conv"].to_numpy(dtype=int)
+        self._kind = self.triples["kind"].to_numpy(dtype=int)
+        self._buyfee = fees[self._buy]
+        self._sellfee = fees[self._sell]
+        self._convfee = np.where(self._kind == FX, convfee,
+                                 fees[np.maximum(self._conv, 0)])
+        self._fx_pairs = {}
+        for i in np.flatnonzero(self._kind == FX):
+            pair = (triples[i][1], triples[i][2])
+            self._fx_pairs.setdefault(pair, []).append(i)
+
+    def update(self, tickers):
+        """
+        Load a bid/ask snapshot given as dict of symbol to ticker.
+
+        Symbols missing from the snapshot have no quote until they are in
+        one again, their last quote may be long gone.
+        """
+        self.bid.fill(np.nan)
+        self.ask.fill(np.nan)
+        for symbol, ticker in tickers.items():
+            i = self._positions.get(symbol)
+            if i is None:
+                continue
+            self.bid[i] = ticker.get("bid") or np.nan
+            self.ask[i] = ticker.get("ask") or np.nan
+
+    def evaluate(self, amount=1, fx=None):
+        """
+        Evaluate all triples on the current snapshot.
+
+        :param amount: amount of base bought and sold
+        :param fx: provider with ``get_rate(base, quote)`` for fiat pairs
+        :return: DataFrame of all triples ranked by return, best first
+        """
+        profit = self.evaluate_arrays(amount=amount, fx=fx)
+        table = self.triples[["base", "quote1", "quote2"]].copy()
+        for column, values in profit.items():
+            table[column] = values
+        table = table.dropna(subset=["return"])
+        return table.sort_values("return", ascending=False)
+
+    def evaluate_arrays(self, amount=1, fx=None):
+        """Like ``evaluate`` but return the raw arrays in triple order."""
+        return self.evaluate_history(self.bid, self.ask, amount=amount, fx=fx)
+
+    def evaluate_history(self, bid, ask, amount=1, fx=None):
+        """
+        Evaluate all triples at many points in time in one pass.
+
+        :param bid: best bids of shape (symbols, times) in the order of
+            ``symbols``, or of shape (symbols,) for a single snapshot
+        :param ask: best asks of the same shape
+        :return: dict of arrays of shape (triples, times)
+        """
+        # Per triple constants broadcast over the time axis
+        shape = (-1,) + (1,) * (np.ndim(bid) - 1)
+        kind = self._kind.reshape(shape)
+        conv = np.maximum(self._conv, 0)
+        conv_bid = bid[conv]
+        conv_ask = ask[conv]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            q2q1 = np.where(kind == DIRECT, conv_bid, 1 / conv_ask)
+            q1q2 = np.where(kind == DIRECT, 1 / conv_ask, conv_bid)
+        for (quote1, quote2), rows in self._fx_pairs.items():
+            q2q1[rows] = fx.get_rate(quote2, quote1) if fx else np.nan
+            q1q2[rows] = fx.get_rate(quote1, quote2) if fx else np.nan
+        profit = calc_profit_arrays(
+            q2q1=q2q1, q1q2=q1q2, prbq1=ask[self._buy],
+            prbq2=bid[self._sell], buyfee=self._buyfee.reshape(shape),
+            sellfee=self._sellfee.reshape(shape),
+            convfee=self._convfee.reshape(shape), amount=amount)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            profit["return"] = profit["spread_q2"] / profit["cost"]
+        return profit
+
+    def scan(self, tickers, amount=1, fx=None):
+        self.update(tickers)
+        return self.evaluate(amount=amount, fx=fx)
@@ -1,11 +1,24 @@
 """The trader class"""
+import time
+
+from TraderBetty.execution import Leg, MultiLegExecutor
+from TraderBetty.strategies.triangular import TriangularArbitrageScanner
 
 
 class Trader():
-    def __init__(self, portfolio_manager, strategy):
+    def __init__(self, portfolio_manager, strategy, executor=None):
         self.PM = portfolio_manager
         self.exchanges = self.PM.exchanges
         self._trading_strategy = strategy
+        self._executor = executor
+
+    @property
+    def executor(self):
+        """Sends multi-leg orders, created on first use."""
+        if self._executor is None:
+            self._executor = MultiLegExecutor(self.PM,
+                                              tracker=self.PM.orders)
+        return self._executor
 
     def trade(self):
         self._trading_strategy.trade()
@@ -15,18 +28,22 @@ class Trader():
         return profit
 
     def limit_buy_order(self, exchange, symbol, amount, price):
-        ex = self.exchanges[exchange]
-        if symbol in ex.symbols:
-            order = ex.create_limit_buy_order(symbol, amount, price)
+        if self.PM.market_index.has_symbol(exchange, symbol):
+            order = self.PM.limiter.call(
+                exchange, "create_limit_buy_order", symbol, amount, price)
+            if self.PM.orders is not None:
+                self.PM.orders.track(exchange, order)
             order_id = order["id"]
             return order_id
         else:
             print("Symbol not available on {:s}".format(exchange))
 
     def limit_sell_order(self, exchange, symbol, amount, price):
-        ex = self.exchanges[exchange]
-        if symbol in ex.symbols:
-            order = ex.create_limit_sell_order(symbol, amount, price)
+        if self.PM.market_index.has_symbol(exchange, symbol):
+            order = self.PM.limiter.call(
+                exchange, "create_limit_sell_order", symbol, amount, price)
+            if self.PM.orders is not None:
+                self.PM.orders.track(exchange, order)
             order_id = order["id"]
             return order_id
         else:
@@ -34,35 +51,47 @@ class Trader():
 
 
 class ArbitrageTrader(Trader):
-    def __init__(self, portfolio_manager, strategy):
-        super().__init__(portfolio_manager, strategy)
+    def __init__(self, portfolio_manager, strategy, executor=None):
+        super().__init__(portfolio_manager, strategy, executor=executor)
+        self.scanners = {}
+
+    def scan(self, exchange, amount=1):
+        """Rank all triangular opportunities on the exchange at once."""
+        index = self.PM.market_index
+        scanner = self.scanners.get(exchange)
+        # Enumerate the triples again only after the markets were reloaded
+        if scanner is None or scanner.markets is not index.markets:
+            scanner = TriangularArbitrageScanner(index, exchange)
+            self.scanners[exchange] = scanner
+        tickers = self.PM.get_bid_ask_snapshot(exchange)
+        if tickers is None:
+            return None
+        return scanner.scan(tickers, amount=amount, fx=self.PM.c)
 
     def get_data(self, exchange, base, quote1, quote2):
         # Get the conversion rate for quote1 to quote2
         convfee = 0.0025
-        if quote1 == "USD" and quote2 == "EUR":
-            q2q1 = self.PM.c.get_rate("EUR", "USD")
-            q1q2 = self.PM.c.get_rate("USD", "EUR")
-        elif quote1 == "EUR" and quote2 == "USD":
-            q2q1 = self.PM.c.get_rate("USD", "EUR")
-            q1q2 = self.PM.c.get_rate("EUR", "USD")
+        if quote1 in ["USD", "EUR"] and quote2 in ["USD", "EUR"]:
+            q2q1 = self.PM.c.get_rate(quote2, quote1)
+            q1q2 = self.PM.c.get_rate(quote1, quote2)
         else:
             symbol = "/".join([quote2, quote1])
             order = self.PM.get_best_order(exchange, symbol)
             q2q1 = order.get("bid")
             q1q2 = 1 / order.get("ask")
-            convfee = self.PM.exchanges[exchange].market(symbol).get("taker")
+            market = self.PM.market_index.market(exchange, symbol)
+            convfee = market.get("taker")
         # Get base price in quote1 at which we buy
         symbol = "/".join([base, quote1])
         prbq1 = self.PM.get_best_order(exchange, symbol).get("ask")
         # Get the trading fee for buying
-        market = self.PM.exchanges[exchange].market(symbol)
+        market = self.PM.market_index.market(exchange, symbol)
         buyfee = market.get("taker")
         # Get base price in quote2 at which we sell
         symbol = "/".join([base, quote2])
         prbq2 = self.PM.get_best_order(exchange, symbol).get("bid")
         # Get trading fee for selling
-        market = self.PM.exchanges[exchange].market(symbol)
+        market = self.PM.market_index.market(exchange, symbol)
         sellfee = market.get("taker")
         arb_dict = {
             "q2q1": q2q1,
@@ -74,3 +103,65 @@ class ArbitrageTrader(Trader):
             "convfee": convfee
         }
         return arb_dict
+
+    def get_depth_data(self, exchange, base, quote1, quote2):
+        """Like get_data but with the full order books of all legs."""
+        index = self.PM.market_index
+        depth_dict = {"conv_book": None, "conv_inverted": False,
+                      "convfee": 0.0025}
+        if quote1 in ["USD", "EUR"] and quote2 in ["USD", "EUR"]:
+            depth_dict["q2q1"] = self.PM.c.get_rate(quote2, quote1)
+            depth_dict["q1q2"] = self.PM.c.get_rate(quote1, quote2)
+        else:
+            symbol = "/".join([quote2, quote1])
+            if not index.has_symbol(exchange, symbol):
+                symbol = "/".join([quote1, quote2])
+                depth_dict["conv_inverted"] = True
+            depth_dict["conv_book"] = self.PM.get_order_book(exchange, symbol)
+            depth_dict["convfee"] = index.market(exchange, symbol).get(
+                "taker")
+        # Asks of base in quote1 which we buy
+        symbol = "/".join([base, quote1])
+        depth_dict["asks"] = self.PM.get_order_book(exchange, symbol)["asks"]
+        depth_dict["buyfee"] = index.market(exchange, symbol).get("taker")
+        # Bids of base in quote2 which we sell
+        symbol = "/".join([base, quote2])
+        depth_dict["bids"] = self.PM.get_order_book(exchange, symbol)["bids"]
+        depth_dict["sellfee"] = index.market(exchange, symbol).get("taker")
+        return depth_dict
+
+    def arbitrage_legs(self, exchange, base, quote1, quote2, arb_dict,
+                       amount=1):
+        """
+        The orders of an arbitrage priced from ``get_data``.
+
+        Base is bought for quote1 and sold for quote2, the quote2 income is
+        converted back to quote1 over the quote2/quote1 market. Fiat pairs
+        are converted outside the exchange and get no conversion leg.
+        """
+        legs = [
+            Leg(exchange, "/".join([base, quote1]), "buy", amount,
+                arb_dict["prbq1"]),
+            Leg(exchange, "/".join([base, quote2]), "sell", amount,
+                arb_dict["prbq2"])]
+        if not (quote1 in ["USD", "EUR"] and quote2 in ["USD", "EUR"]):
+            income = amount * arb_dict["prbq2"] * (1 - arb_dict["sellfee"])
+            legs.append(Leg(exchange, "/".join([quote2, quote1]), "sell",
+                            income, arb_dict["q2q1"]))
+        return legs
+
+    def execute_arbitrage(self, exchange, base, quote1, quote2, amount=1,
+                          min_profit=0):
+        """
+        Send all legs of the arbitrage at once if it is profitable.
+
+        :return: the Execution, None if the spread is too small
+        """
+        arb_dict = self.get_data(exchange, base, quote1, quote2)
+        profit = self.calc_profit(arb_dict, amount)
+        if not profit["spread_q2"] > min_profit:
+            return None
+        signal_time = time.monotonic()
+        legs = self.arbitrage_legs(exchange, base, quote1, quote2, arb_dict,
+                                   amount=amount)
+        return self.executor.execute(legs, signal_time=signal_time)
@@ -0,0 +1,34 @@
+import pytest
+
+from TraderBetty import benchmarks
+from TraderBetty.strategies.arbitrage import OnExchangeArbitrageStrategy
+from TraderBetty.trader import ArbitrageTrader
+
+
+@pytest.fixture
+def PM():
+    """PortfolioManager over two fake exchanges in a sandbox."""
+    with benchmarks.portfolio_manager(2, latency=0) as PM:
+        yield PM
+
+
+@pytest.fixture
+def trader(PM):
+    """Trader on the fake exchanges whose executor gives up quickly."""
+    trader = ArbitrageTrader(PM, OnExchangeArbitrageStrategy())
+    trader.executor.fill_timeout = 0.2
+    trader.executor.poll_interval = 0.05
+    yield trader
+    trader.executor.shutdown()
+
+
+def arbitrage_legs(trader, conversion=1.0):
+    """
+    Crossing buy and sell legs on fake0, the conversion priced by the
+    factor, above 1 it rests on the book.
+    """
+    arb = trader.get_data("fake0", "ETH", "USDT", "BTC")
+    return trader.arbitrage_legs(
+        "fake0", "ETH", "USDT", "BTC",
+        dict(arb, prbq1=arb["prbq1"] * 1.01, prbq2=arb["prbq2"] * 0.99,
+             q2q1=arb["q2q1"] * conversion))
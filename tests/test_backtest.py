@@ -0,0 +1,66 @@
+import numpy as np
+
+from TraderBetty.backtest import Backtest, Replay, SimulatedPortfolioManager
+from TraderBetty.fake_exchange import FakeExchange
+from TraderBetty.managers.markets import MarketIndex
+from TraderBetty.managers.store import OrderBookStore
+
+
+def market_index(taker=0.0):
+    ex = FakeExchange("fake", symbols=["LTC/BTC", "LTC/ETH", "ETH/BTC"],
+                      latency=0)
+    ex.load_markets()
+    for market in ex.markets.values():
+        market["taker"] = taker
+    return MarketIndex({ex.id: ex})
+
+
+def book(timestamp, bid, ask, volume=1.0):
+    return {"timestamp": timestamp, "bids": [[bid, volume]],
+            "asks": [[ask, volume]]}
+
+
+def test_books_are_carried_into_the_next_window(tmp_path):
+    store = OrderBookStore(str(tmp_path))
+    store.append("fake", "ETH/BTC", book(0, 0.05, 0.051))
+    store.append("fake", "LTC/BTC", book(50, 0.01, 0.011))
+    store.append("fake", "ETH/BTC", book(150, 0.06, 0.061))
+    replay = Replay(store, window=100)
+    assert list(replay.windows()) == [(0, 99), (100, 150)]
+    timeline, books = replay.top_of_book(100, 150)
+    assert list(timeline) == [150]
+    assert books[("fake", "LTC/BTC")][0][0] == 0.01
+    assert books[("fake", "ETH/BTC")][0][0] == 0.06
+    # Too old to be used
+    _, books = replay.top_of_book(100, 150, max_age=50)
+    assert np.isnan(books[("fake", "LTC/BTC")][0][0])
+
+
+def test_scan_finds_triangles_across_windows(tmp_path):
+    store = OrderBookStore(str(tmp_path))
+    store.append("fake", "LTC/ETH", book(10, 1.0, 1.0))
+    store.append("fake", "LTC/BTC", book(110, 0.01, 0.01))
+    store.append("fake", "ETH/BTC", book(120, 0.05, 0.05))
+    backtest = Backtest(Replay(store, window=100), market_index())
+    table = backtest.scan("fake", min_return=1.0)
+    assert list(table["timestamp"]) == [120]
+    assert table.iloc[0]["return"] > 1
+
+
+def test_orders_fill_against_the_recorded_book():
+    PM = SimulatedPortfolioManager(market_index(taker=0.01), ["fake"],
+                                   balances={"fake": {"BTC": 1.0}})
+    PM.update(1000, {("fake", "ETH/BTC"): {
+        "timestamp": 1000, "bids": np.array([[0.049, 1.0]]),
+        "asks": np.array([[0.05, 1.0], [0.06, 1.0]])}})
+    ex = PM.exchanges["fake"]
+    order = ex.create_limit_buy_order("ETH/BTC", 1.5, 0.055)
+    # The level above the limit is left, like immediate-or-cancel
+    assert order["filled"] == 1.0 and order["status"] == "canceled"
+    assert order["cost"] == 0.05 and order["fee"]["cost"] == 0.0005
+    assert np.isclose(PM.balances["fake"]["BTC"], 1 - 0.0505)
+    assert PM.balances["fake"]["ETH"] == 1.0
+    order = ex.create_market_sell_order("ETH/BTC", 0.5)
+    assert order["status"] == "closed" and order["price"] == 0.049
+    assert [t["side"] for t in ex.fetch_my_trades("ETH/BTC")] == [
+        "buy", "sell"]
@@ -0,0 +1,39 @@
+import time
+
+import pandas as pd
+
+from TraderBetty.benchmarks import (FakeConnectionHandler, make_exchanges,
+                                    sandbox)
+from TraderBetty.managers import config, portfolio
+
+
+def test_quiet_tables_are_written_in_the_background():
+    exchanges = make_exchanges(1, latency=0)
+    with sandbox(exchanges, extra="[data]\nflush_interval=0.2\n") as \
+            config_path:
+        PM = portfolio.PortfolioManager(FakeConnectionHandler(exchanges),
+                                        config_path, config.FullConfigLoader)
+        try:
+            PM.update_ex_price("fake0", "ETH/BTC", 0.05)
+            path = "data/prices_fake0.csv"
+            prices = pd.read_csv(path, sep=";", index_col=0)
+            assert pd.isna(prices.loc["ETH", "BTC"])
+            time.sleep(0.5)
+            prices = pd.read_csv(path, sep=";", index_col=0)
+            assert prices.loc["ETH", "BTC"] == 0.05
+        finally:
+            PM.close()
+        assert PM._flush_thread is None
+
+
+def test_order_book_updates_are_kept_in_memory(PM):
+    for ts, price in [(1000, 10.0), (2000, 20.0)]:
+        PM.update_order_book("fake0", "ETH/BTC", {
+            "timestamp": ts, "bids": [[price - 1, 1.0]],
+            "asks": [[price + 1, 1.0]]})
+    books = PM.order_books["fake0"]["ETH/BTC"]
+    assert list(books) == [2000]
+    # The frame is only built from the store once it is looked up
+    assert not books.is_loaded(2000)
+    assert books[2000][("bids", "price")].iloc[0] == 19.0
+    assert PM.latest_order_book("fake0", "ETH/BTC")["asks"][0, 0] == 21.0
@@ -0,0 +1,57 @@
+import numpy as np
+
+from TraderBetty.strategies import depth
+from TraderBetty.strategies.arbitrage import OnExchangeArbitrageStrategy
+
+
+LEVELS = [[10.0, 1.0], [11.0, 2.0]]
+
+
+def opportunity(**kwargs):
+    """ETH bought for BTC and sold for USDT, no fees."""
+    depth_dict = {"asks": [[0.05, 1.0], [0.06, 1.0]],
+                  "bids": [[600.0, 1.0], [550.0, 1.0]],
+                  "buyfee": 0.0, "sellfee": 0.0, "convfee": 0.0,
+                  "q1q2": 10000.0, "q2q1": 0.0001}
+    depth_dict.update(kwargs)
+    return depth_dict
+
+
+def test_partial_levels_are_filled_linearly():
+    notionals = depth.walk_book(LEVELS, [0.5, 1.0, 2.0, 3.0])
+    assert np.allclose(notionals, [5.0, 10.0, 21.0, 32.0])
+    assert np.allclose(depth.spend_on_book(LEVELS, [5.0, 21.0]),
+                       [0.5, 2.0])
+    assert np.isclose(depth.vwap(LEVELS, [2.0])[0], 10.5)
+
+
+def test_amounts_beyond_the_book_are_nan():
+    assert np.isnan(depth.walk_book(LEVELS, [3.5])[0])
+    assert np.isnan(depth.spend_on_book(LEVELS, [40.0])[0])
+    profit = OnExchangeArbitrageStrategy().calc_depth_profit(
+        opportunity(), amount=3)
+    assert np.isnan(profit["spread_q2"])
+
+
+def test_direct_and_inverted_conversion_books_agree():
+    flat = depth.depth_profit(opportunity(), [0.5, 1.5])
+    # USDT/BTC, USDT priced in BTC
+    direct = depth.depth_profit(opportunity(conv_book={
+        "asks": [[0.0001, 1e9]], "bids": [[0.0001, 1e9]]}), [0.5, 1.5])
+    # BTC/USDT, BTC priced in USDT
+    inverted = depth.depth_profit(opportunity(conv_book={
+        "asks": [[10000.0, 1e9]], "bids": [[10000.0, 1e9]]},
+        conv_inverted=True), [0.5, 1.5])
+    for key in ["costq2", "inq1", "spread_q1", "spread_q2"]:
+        assert np.allclose(direct[key], flat[key])
+        assert np.allclose(inverted[key], flat[key])
+    # 1.5 ETH cost 0.05 + 0.03 BTC and pay 600 + 275 USDT
+    assert np.isclose(flat["spread_q2"][1], 875 * 0.0001 - 0.08)
+
+
+def test_thin_conversion_book_limits_the_profit():
+    profit = depth.depth_profit(opportunity(conv_book={
+        "asks": [[0.0001, 1e9]], "bids": [[0.0001, 100.0]]}), [0.1, 1.0])
+    # 60 USDT convert, 600 USDT don't
+    assert np.isfinite(profit["spread_q2"][0])
+    assert np.isnan(profit["spread_q2"][1])
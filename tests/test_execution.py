@@ -0,0 +1,57 @@
+import pytest
+
+from TraderBetty.execution import (CANCELED, FAILED, FILLED, Leg,
+                                   OrderValidationError)
+
+from conftest import arbitrage_legs
+
+
+def test_all_legs_fill(trader):
+    execution = trader.executor.execute(arbitrage_legs(trader, 0.99))
+    assert execution.success
+    assert execution.signal_to_last_ack is not None
+
+
+def test_rejected_leg_cancels_and_hedges_the_others(trader):
+    fake = trader.PM.exchanges["fake0"]
+    fake.reject_symbols.add("ETH/BTC")
+    # The conversion rests on the book and has to be canceled
+    buy, sell, conversion = arbitrage_legs(trader, 1.5)
+    execution = trader.executor.execute([buy, sell, conversion])
+    assert not execution.success
+    assert sell.status == FAILED and sell.order is None
+    assert buy.status == FILLED and buy.hedge["side"] == "sell"
+    assert buy.hedge["amount"] == buy.filled
+    assert conversion.status == CANCELED and conversion.hedge is None
+    assert fake.orders[conversion.order["id"]]["status"] == "canceled"
+
+
+def test_legs_below_the_limits_are_not_sent(trader):
+    fake = trader.PM.exchanges["fake0"]
+    requests = fake.requests
+    with pytest.raises(OrderValidationError):
+        trader.executor.execute([Leg("fake0", "ETH/BTC", "buy", 0.0001, 1)])
+    assert fake.requests == requests
+
+
+def test_bare_cancel_response_keeps_the_partial_fill(trader, monkeypatch):
+    fake = trader.PM.exchanges["fake0"]
+    create, cancel = fake.create_order, fake.cancel_order
+
+    def create_partly_filled(*args, **kwargs):
+        order = create(*args, **kwargs)
+        if order["status"] == "open":
+            order = fake.fill_order(order["id"], order["amount"] / 2)
+        return order
+
+    def cancel_bare(id, symbol=None, params=None):
+        cancel(id, symbol)
+        return {"id": id, "status": "canceled"}
+    monkeypatch.setattr(fake, "create_order", create_partly_filled)
+    monkeypatch.setattr(fake, "cancel_order", cancel_bare)
+    buy, sell, conversion = arbitrage_legs(trader, 1.5)
+    execution = trader.executor.execute([buy, sell, conversion])
+    assert not execution.success
+    assert conversion.status == CANCELED
+    assert conversion.filled == conversion.amount / 2
+    assert conversion.hedge["amount"] == conversion.filled
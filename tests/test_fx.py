@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from TraderBetty.fake_exchange import REFERENCE_PRICES, FakeFxFeed
+from TraderBetty.managers.fx import FxRates
+
+
+@pytest.fixture
+def fx():
+    fx = FxRates(feed=FakeFxFeed(latency=0), base="EUR",
+                 currencies=["USD", "USDT"])
+    yield fx
+    fx.stop()
+
+
+def test_inverse_and_cross_rates(fx):
+    usd = fx.get_rate("EUR", "USD")
+    assert usd == pytest.approx(REFERENCE_PRICES["EUR"], rel=0.01)
+    assert fx.get_rate("USD", "EUR") == pytest.approx(1 / usd)
+    # Neither is the base, both come from their rates against EUR
+    cross = fx.get_rate("USD", "USDT")
+    assert cross == pytest.approx(fx.get_rate("EUR", "USDT") / usd)
+    assert cross * fx.get_rate("USDT", "USD") == pytest.approx(1)
+    assert fx.feed.requests == 1
+
+
+def test_unknown_currencies_are_added_and_fetched_once(fx):
+    fx.get_rate("EUR", "USD")
+    assert fx.get_rate("BTC", "EUR") == pytest.approx(
+        REFERENCE_PRICES["BTC"] / REFERENCE_PRICES["EUR"], rel=0.01)
+    assert "BTC" in fx.currencies and fx.feed.requests == 2
+    with pytest.raises(KeyError):
+        fx.get_rate("EUR", "XYZ")
+
+
+def test_first_use_fetches_once(fx):
+    fx.feed.latency = 0.1
+    fx.start()
+    threads = [threading.Thread(target=fx.get_rate, args=("EUR", "USD"))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fx.feed.requests == 1
@@ -0,0 +1,52 @@
+import json
+import os
+
+from TraderBetty.benchmarks import sandbox
+from TraderBetty.fake_exchange import FakeExchange
+from TraderBetty.managers import config, portfolio
+from TraderBetty.managers.handlers import ConnectionHandler
+
+
+def test_slow_exchanges_are_skipped_until_loaded():
+    names = ["fake0", "fake1"]
+    latency = {"fake0": 0, "fake1": 0.5}
+    extra = "[markets]\nload_timeout=0.1\nbackground_refresh=false\n"
+    with sandbox(names, extra=extra) as config_path:
+        with open("keys.json", "w") as file:
+            json.dump({name: {} for name in names}, file)
+        CH = ConnectionHandler(
+            config_path, config.ConnectionConfigLoader, "keys.json",
+            exchange_factory=lambda exchange, exchange_config: FakeExchange(
+                exchange, latency=latency[exchange]))
+        PM = portfolio.PortfolioManager(CH, config_path,
+                                        config.FullConfigLoader)
+        try:
+            assert CH.unavailable == {"fake1"}
+            assert PM.available_exchanges() == ["fake0"]
+            requests = CH.exchanges["fake1"].requests
+            assert list(PM.get_all_ex_balances()) == ["fake0"]
+            assert CH.exchanges["fake1"].requests == requests
+            assert CH.markets_loaded["fake1"].wait(5)
+            assert PM.available_exchanges() == names
+            assert PM.market_index.has_symbol("fake1", "ETH/BTC")
+            # Written into the sandbox, without a torn temporary file
+            markets = os.path.join(os.path.dirname(config_path), "data",
+                                   "markets")
+            assert sorted(os.listdir(markets)) == ["fake0.json",
+                                                   "fake1.json"]
+        finally:
+            PM.close()
+
+
+def test_ccxt_rate_limit_is_turned_off():
+    configs = {}
+
+    def factory(exchange, exchange_config):
+        configs[exchange] = exchange_config
+        return FakeExchange(exchange, latency=0)
+    with sandbox(["fake0"]) as config_path:
+        with open("keys.json", "w") as file:
+            json.dump({"fake0": {"apiKey": "key"}}, file)
+        ConnectionHandler(config_path, config.ConnectionConfigLoader,
+                          "keys.json", exchange_factory=factory)
+    assert configs["fake0"] == {"enableRateLimit": False, "apiKey": "key"}
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from TraderBetty.managers import ingest
+from TraderBetty.managers.store import book_to_records
+
+
+def trade(i, timestamp):
+    return {"id": i, "timestamp": timestamp, "symbol": "ETH/BTC",
+            "order": None, "type": "limit", "side": "buy",
+            "takerOrMaker": "taker", "price": 0.05, "amount": 1.0,
+            "cost": 0.05, "fee": {"cost": 0.0001, "currency": "BTC"}}
+
+
+def test_trades_frame_keeps_trades_without_timestamp():
+    trades = ingest.trades_frame([trade(1, 1500000000000), trade(2, None)],
+                                 "Fake")
+    assert list(trades["id"]) == ["1", "2"]
+    assert trades["timestamp"].iloc[0] == 1500000000000
+    assert pd.isna(trades["timestamp"].iloc[1])
+    assert pd.isna(trades["datetime"].iloc[1])
+    assert trades["date"].iloc[0] == pd.Timestamp("2017-07-14")
+
+
+def test_undated_trades_reach_the_ledger(PM):
+    trades = [trade("a", 1500000000000), trade("b", None)]
+    assert PM.update_trades("fake0", ingest.trades_frame(trades, "Fake0")) \
+        == 2
+    assert {"a", "b"} <= PM.ledger.ids("fake0")
+
+
+def test_order_book_frame_pads_the_shorter_side():
+    records = book_to_records({"timestamp": 1000,
+                               "bids": [[9.0, 1.0], [8.0, 2.0]],
+                               "asks": [[11.0, 3.0, 0]]})
+    frame = ingest.order_book_frame(records)
+    assert list(frame[("bids", "price")]) == [9.0, 8.0]
+    assert frame[("asks", "volume")].iloc[0] == 3.0
+    assert pd.isna(frame[("asks", "price")].iloc[1])
@@ -0,0 +1,33 @@
+import pandas as pd
+
+from TraderBetty.managers import ingest
+
+
+def stored(PM, exchange, symbol, freq):
+    PM.flush(force=True)
+    path = "data/ohlcv/ohlcv_%s_%s_%s.csv" % (
+        exchange, symbol.replace("/", "_"), freq)
+    return pd.read_csv(path, sep=";")
+
+
+def test_sync_after_get_ohlcv_appends_no_duplicates(PM):
+    candles = PM.exchanges["fake0"].fetch_ohlcv("ETH/BTC", "1h")
+    PM.append_ohlcv("fake0", "ETH/BTC", "1h",
+                    ingest.ohlcv_frame(candles[:50]))
+    PM.get_ohlcv("fake0", "ETH/BTC", "1h")
+    PM.sync_ohlcv("fake0", "ETH/BTC", "1h")
+    candles = stored(PM, "fake0", "ETH/BTC", "1h")
+    assert len(candles) > 400
+    assert candles["timestamp"].is_unique
+
+
+def test_backfill_fills_gaps_inside_the_series(PM):
+    fake = PM.exchanges["fake0"]
+    candles = fake.fetch_ohlcv("ETH/BTC", "1h", limit=100)[:-1]
+    holey = candles[:20] + candles[25:60] + candles[61:]
+    PM.update_ohlcv("fake0", "ETH/BTC", "1h", ingest.ohlcv_frame(holey))
+    assert len(PM.ohlcv_gaps("fake0", "ETH/BTC", "1h")) == 2
+    assert PM.backfill_ohlcv("fake0", "ETH/BTC", "1h") == 6
+    assert PM.ohlcv_gaps("fake0", "ETH/BTC", "1h") == []
+    timestamps = stored(PM, "fake0", "ETH/BTC", "1h")["timestamp"]
+    assert list(timestamps) == [c[0] for c in candles]
@@ -0,0 +1,49 @@
+from TraderBetty.managers.orders import CANCELED, CLOSED, FILL
+from TraderBetty.strategies.arbitrage import OnExchangeArbitrageStrategy
+from TraderBetty.trader import ArbitrageTrader
+
+from conftest import arbitrage_legs
+
+
+def test_bulk_refresh_costs_one_request_per_exchange(PM):
+    trader = ArbitrageTrader(PM, OnExchangeArbitrageStrategy())
+    for _ in range(20):
+        trader.limit_buy_order("fake0", "ETH/BTC", 1, 0.01)
+    fake = PM.exchanges["fake0"]
+    requests = fake.requests
+    assert PM.orders.refresh_all() == {"fake0": 0}
+    assert fake.requests - requests == 1
+    assert len(PM.orders.live("fake0")) == 20
+
+
+def test_refresh_emits_fill_events(PM):
+    trader = ArbitrageTrader(PM, OnExchangeArbitrageStrategy())
+    events = []
+    PM.orders.subscribe(lambda event, exchange, order: events.append(
+        (event, order["id"])))
+    ids = [trader.limit_buy_order("fake0", "ETH/BTC", 1, 0.01)
+           for _ in range(3)]
+    fake = PM.exchanges["fake0"]
+    fake.fill_order(ids[0])
+    fake.fill_order(ids[1], 0.5)
+    fake.cancel_order(ids[2])
+    PM.orders.refresh_all()
+    assert (FILL, ids[0]) in events and (CLOSED, ids[0]) in events
+    assert (FILL, ids[1]) in events and (CLOSED, ids[1]) not in events
+    assert (CANCELED, ids[2]) in events
+    assert [order["id"] for order in PM.orders.live()] == [ids[1]]
+    assert PM.orders.get("fake0", ids[0])["status"] == "closed"
+
+
+def test_failing_refresh_still_unwinds_the_legs(PM, trader, monkeypatch):
+    fake = PM.exchanges["fake0"]
+
+    def fail(*args, **kwargs):
+        raise IOError("connection reset")
+    monkeypatch.setattr(fake, "fetch_open_orders", fail)
+    legs = arbitrage_legs(trader, 1.5)
+    execution = trader.executor.execute(legs)
+    assert not execution.success
+    assert legs[2].status == "canceled"
+    assert fake.orders[legs[2].order["id"]]["status"] == "canceled"
+    assert legs[0].hedge is not None and legs[1].hedge is not None
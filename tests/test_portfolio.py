@@ -0,0 +1,17 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_slow_fan_out_does_not_hold_up_another_job(PM):
+    released = threading.Event()
+    exchanges = PM.available_exchanges()
+    with ThreadPoolExecutor(max_workers=1) as job:
+        slow = job.submit(PM._fan_out, lambda ex: released.wait(5),
+                          exchanges)
+        try:
+            fast = PM._fan_out(lambda ex: ex.upper(), exchanges)
+            assert not slow.done()
+        finally:
+            released.set()
+        assert fast == {ex: ex.upper() for ex in exchanges}
+        assert all(slow.result().values())
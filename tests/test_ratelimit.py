@@ -0,0 +1,39 @@
+import time
+
+from TraderBetty.benchmarks import make_exchanges
+from TraderBetty.managers.ratelimit import RateLimiter, TokenBucket
+
+
+def test_bucket_spaces_out_requests():
+    bucket = TokenBucket(rate=20)
+    start = time.monotonic()
+    waits = [bucket.acquire() for _ in range(5)]
+    elapsed = time.monotonic() - start
+    assert waits[0] == 0
+    assert 0.18 <= elapsed < 0.4
+
+
+def test_exchanges_spend_their_own_budget():
+    # 50 ms between two requests on every exchange
+    exchanges = make_exchanges(2, latency=0, rate_limit=50)
+    limiter = RateLimiter(exchanges)
+    assert limiter.bucket("fake0") is not limiter.bucket("fake1")
+    start = time.monotonic()
+    futures = [limiter.submit(exchange, "fetch_ticker", "ETH/BTC")
+               for _ in range(5) for exchange in exchanges]
+    for future in futures:
+        future.result()
+    elapsed = time.monotonic() - start
+    # Four waits per exchange, side by side instead of eight in a row
+    assert 0.18 <= elapsed < 0.35
+    limiter.shutdown()
+
+
+def test_weighted_endpoints_cost_more():
+    exchanges = make_exchanges(1, latency=0, rate_limit=50)
+    limiter = RateLimiter(exchanges)
+    start = time.monotonic()
+    limiter.call("fake0", "fetch_tickers")
+    limiter.call("fake0", "fetch_ticker", "ETH/BTC")
+    # fetch_tickers takes two requests' worth of the budget
+    assert time.monotonic() - start >= 0.09
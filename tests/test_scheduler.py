@@ -0,0 +1,52 @@
+import logging
+import threading
+
+from TraderBetty.managers.scheduler import COALESCE, JobScheduler
+
+
+def noop():
+    pass
+
+
+def test_runs_due_while_running_are_skipped_or_coalesced():
+    scheduler = JobScheduler()
+    skipping = scheduler.add("skipping", noop, 1)
+    coalescing = scheduler.add("coalescing", noop, 1, overrun=COALESCE)
+    for job in [skipping, coalescing]:
+        job.running = True
+        for _ in range(3):
+            scheduler._dispatch(job, 0)
+    assert skipping.skipped == 3 and not skipping.pending
+    # However many runs were missed, one is made afterwards
+    assert coalescing.coalesced == 3 and coalescing.pending
+    assert scheduler._ready == []
+
+
+def test_one_worker_is_kept_for_the_fastest_jobs():
+    scheduler = JobScheduler(max_workers=2)
+    scheduler.add("tickers", noop, 10)
+    scheduler.add("trades", noop, 900)
+    scheduler._busy = 1
+    scheduler._ready = [(900, 0, "trades")]
+    assert scheduler._next_ready() is None
+    scheduler._ready.append((10, 5, "tickers"))
+    assert scheduler._next_ready() == (10, 5, "tickers")
+    scheduler._busy = 0
+    assert scheduler._next_ready() == (900, 0, "trades")
+
+
+def test_failing_jobs_are_logged_and_keep_running(caplog):
+    scheduler = JobScheduler(max_workers=1)
+    ran = threading.Event()
+
+    def fail():
+        ran.set()
+        raise ValueError("no connection")
+    scheduler.add("failing", fail, 60)
+    with caplog.at_level(logging.ERROR):
+        scheduler.start()
+        assert ran.wait(5)
+        scheduler.stop()
+    assert scheduler.report()["failing"]["errors"] == 1
+    assert "Job failing failed" in caplog.text
+    assert "no connection" in caplog.text
@@ -0,0 +1,59 @@
+import gc
+import weakref
+
+from TraderBetty.managers.store import OrderBookStore
+
+
+def book(timestamp, price):
+    return {"timestamp": timestamp, "bids": [[price - 1, 1.0]],
+            "asks": [[price + 1, 2.0]]}
+
+
+def test_older_snapshots_do_not_break_reads(tmp_path):
+    store = OrderBookStore(str(tmp_path), batch_size=2)
+    assert store.append("fake0", "ETH/BTC", book(1000, 10))
+    assert store.append("fake0", "ETH/BTC", book(3000, 30))
+    assert not store.append("fake0", "ETH/BTC", book(2000, 20))
+    assert not store.append("fake0", "ETH/BTC", book(3000, 31))
+    assert store.append("fake0", "ETH/BTC", book(4000, 40))
+    books = list(store.snapshots("fake0", "ETH/BTC", start=2000, end=4000))
+    assert [b["timestamp"] for b in books] == [3000, 4000]
+    assert books[0]["bids"][0, 0] == 29
+
+
+def test_last_timestamp_is_read_back_from_the_file(tmp_path):
+    store = OrderBookStore(str(tmp_path))
+    store.append("fake0", "ETH/BTC", book(3000, 30))
+    store.flush()
+    store = OrderBookStore(str(tmp_path))
+    assert not store.append("fake0", "ETH/BTC", book(2000, 20))
+    assert store.append("fake0", "ETH/BTC", book(4000, 40))
+    timestamps = store.read("fake0", "ETH/BTC")["timestamp"]
+    assert list(timestamps) == [3000, 3000, 4000, 4000]
+
+
+def test_torn_record_is_cut_off(tmp_path):
+    store = OrderBookStore(str(tmp_path))
+    store.append("fake0", "ETH/BTC", book(1000, 10))
+    store.flush()
+    path = store._file("fake0", "ETH/BTC")
+    with open(path, "ab") as file:
+        file.write(b"\0" * 7)
+    store = OrderBookStore(str(tmp_path))
+    assert list(store.read("fake0", "ETH/BTC")["timestamp"]) == [1000, 1000]
+    assert store.append("fake0", "ETH/BTC", book(2000, 20))
+    store.flush()
+    assert list(OrderBookStore(str(tmp_path)).read(
+        "fake0", "ETH/BTC")["timestamp"]) == [1000, 1000, 2000, 2000]
+
+
+def test_discarded_stores_are_flushed_and_collected(tmp_path):
+    store = OrderBookStore(str(tmp_path))
+    store.append("fake0", "ETH/BTC", book(1000, 10))
+    collected = weakref.ref(store)
+    del store
+    gc.collect()
+    assert collected() is None
+    timestamps = OrderBookStore(str(tmp_path)).read("fake0", "ETH/BTC")[
+        "timestamp"]
+    assert list(timestamps) == [1000, 1000]
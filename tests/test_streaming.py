@@ -0,0 +1,114 @@
+import json
+import time
+
+import pytest
+
+from TraderBetty.fake_stream import ReplayServer, make_recording
+from TraderBetty.managers.streaming import (BitstampFeed, Feed,
+                                            LocalOrderBook, SequenceGap,
+                                            StreamManager)
+
+
+def replay_books(messages):
+    """The books after all messages, as a client without losses has them."""
+    books = {}
+    for message in messages:
+        if message["type"] == "ticker":
+            continue
+        book = books.setdefault(message["symbol"],
+                                LocalOrderBook(message["symbol"]))
+        apply = (book.apply_snapshot if message["type"] == "snapshot" else
+                 book.apply_update)
+        apply(message["bids"], message["asks"], message["sequence"],
+              message["timestamp"])
+    return books
+
+
+def test_gap_resets_the_book_until_the_next_snapshot():
+    book = LocalOrderBook("ETH/BTC")
+    book.apply_update([[1.0, 1.0]], [], 11)
+    book.apply_snapshot([[0.9, 1.0]], [[1.1, 1.0]], 10)
+    # The update buffered before the snapshot is applied on top of it
+    assert book.sequence == 11 and book.best_bid() == 1.0
+    assert not book.apply_update([[0.8, 1.0]], [], 11)
+    with pytest.raises(SequenceGap):
+        book.apply_update([[0.8, 1.0]], [], 13)
+    assert not book.synced and book.bids == {}
+    book.apply_snapshot([[0.7, 2.0]], [[1.2, 2.0]], 20)
+    assert book.synced and book.to_ccxt()["bids"] == [[0.7, 2.0]]
+
+
+def test_stream_resyncs_books_after_dropped_updates():
+    pytest.importorskip("websockets")
+    messages = make_recording(updates=2000, seed=1)
+    updates = [i for i, message in enumerate(messages)
+               if message["type"] == "update" and
+               message["symbol"] == "ETH/BTC"]
+    server = ReplayServer(messages, drop=[updates[20], updates[100]],
+                          interval=0.0002)
+    streams = StreamManager({"fake0": Feed(server.start())})
+    symbols = ["ETH/BTC", "BTC/USDT", "LTC/BTC"]
+    streams.subscribe("fake0", symbols)
+    streams.start()
+    expected = replay_books(messages)
+    try:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            books = [streams.order_book("fake0", symbol)
+                     for symbol in symbols]
+            if all(book is not None and book["nonce"] ==
+                   expected[symbol].sequence
+                   for book, symbol in zip(books, symbols)):
+                break
+            time.sleep(0.05)
+    finally:
+        streams.stop()
+        server.stop()
+    assert streams.stats["gaps"] == 2 and streams.stats["resyncs"] == 2
+    for book, symbol in zip(books, symbols):
+        view = expected[symbol].to_ccxt()
+        assert book["bids"] == view["bids"] and book["asks"] == view["asks"]
+
+
+def test_stale_stream_falls_back_to_rest(PM):
+    streams = StreamManager({"fake0": Feed("ws://unused")})
+    streams._apply("fake0", {
+        "type": "snapshot", "symbol": "ETH/BTC", "sequence": 1,
+        "timestamp": 1, "bids": [[0.01, 1.0]], "asks": [[0.02, 1.0]]})
+    PM.streams = streams
+    fake = PM.exchanges["fake0"]
+    requests = fake.requests
+    assert PM.get_order_book("fake0", "ETH/BTC")["bids"] == [[0.01, 1.0]]
+    assert fake.requests == requests
+    streams.books[("fake0", "ETH/BTC")].updated -= 60
+    assert PM.get_order_book("fake0", "ETH/BTC")["bids"] != [[0.01, 1.0]]
+    assert fake.requests == requests + 1
+    PM.streams = None
+
+
+def test_bitstamp_messages_are_normalized():
+    feed = BitstampFeed()
+    subscriptions = [json.loads(m) for m in feed.subscribe_message(
+        {"BTC/USD"}, ("book", "ticker"))]
+    assert [m["data"]["channel"] for m in subscriptions] == [
+        "order_book_btcusd", "live_trades_btcusd"]
+    streams = StreamManager({"bitstamp": feed})
+    for raw in [
+            {"event": "bts:subscription_succeeded",
+             "channel": "order_book_btcusd", "data": {}},
+            {"event": "data", "channel": "order_book_btcusd",
+             "data": {"microtimestamp": "1600000000000001",
+                      "bids": [["10000.0", "1.5"]],
+                      "asks": [["10001.0", "0.5"]]}},
+            {"event": "trade", "channel": "live_trades_btcusd",
+             "data": {"microtimestamp": "1600000000000002",
+                      "price": 10000.5, "amount": 0.1}}]:
+        with streams._lock:
+            for message in feed.parse(json.dumps(raw)):
+                streams._apply("bitstamp", message)
+    book = streams.order_book("bitstamp", "BTC/USD")
+    assert book["bids"] == [[10000.0, 1.5]]
+    assert book["timestamp"] == 1600000000000
+    ticker = streams.ticker("bitstamp", "BTC/USD")
+    assert ticker["bid"] == 10000.0 and ticker["ask"] == 10001.0
+    assert ticker["last"] == 10000.5
@@ -0,0 +1,43 @@
+import pytest
+
+
+def test_paging_keeps_trades_sharing_the_last_timestamp(PM):
+    fake = PM.exchanges["fake0"]
+    # Five trades per millisecond, so pages end within a timestamp
+    start = fake._trades[0]["timestamp"]
+    for i, trade in enumerate(fake._trades):
+        trade["timestamp"] = start + i // 5
+    trades = PM.get_trades("fake0")
+    assert isinstance(trades, list)
+    assert len(trades) == len(fake._trades)
+
+
+def test_full_page_of_one_timestamp_is_fetched_whole(PM):
+    fake = PM.exchanges["fake1"]
+    start = fake._trades[0]["timestamp"]
+    fake._trades = [dict(trade, id="same-%d" % i, timestamp=start)
+                    for i, trade in enumerate(fake._trades[:10])] + [
+        dict(trade, id="later-%d" % i, timestamp=start + 1 + i)
+        for i, trade in enumerate(fake._trades[10:30])]
+    assert PM.sync_trades("fake1", limit=7) == 30
+    ids = PM.ledger.ids("fake1")
+    assert {"same-%d" % i for i in range(10)} <= ids
+    assert {"later-%d" % i for i in range(20)} <= ids
+
+
+def test_only_missing_symbol_support_switches_to_per_symbol(PM,
+                                                           monkeypatch):
+    errors = pytest.importorskip("ccxt.errors")
+    fake = PM.exchanges["fake0"]
+
+    def fail(*args, **kwargs):
+        raise errors.AuthenticationError("invalid key")
+    monkeypatch.setattr(fake, "fetch_my_trades", fail)
+    assert PM.sync_all_trades(["fake0"]) == {"fake0": 0}
+    assert "fake0" not in PM._per_symbol_trades
+
+    def fail(*args, **kwargs):
+        raise errors.ArgumentsRequired("symbol required")
+    monkeypatch.setattr(fake, "fetch_my_trades", fail)
+    PM.sync_all_trades(["fake0"])
+    assert "fake0" in PM._per_symbol_trades
@@ -0,0 +1,22 @@
+from TraderBetty.fake_exchange import FakeExchange
+from TraderBetty.managers.markets import MarketIndex
+from TraderBetty.strategies.triangular import TriangularArbitrageScanner
+
+
+def make_scanner():
+    ex = FakeExchange("fake", symbols=["LTC/BTC", "LTC/ETH", "ETH/BTC"],
+                      latency=0)
+    ex.load_markets()
+    return TriangularArbitrageScanner(MarketIndex({ex.id: ex}), ex.id)
+
+
+def test_quotes_missing_from_a_snapshot_expire():
+    scanner = make_scanner()
+    # Selling LTC for ETH far above the LTC/BTC ask is a phantom triangle
+    scanner.update({"LTC/BTC": {"bid": 0.01, "ask": 0.01},
+                    "LTC/ETH": {"bid": 1.0, "ask": 1.0},
+                    "ETH/BTC": {"bid": 0.05, "ask": 0.05}})
+    assert scanner.evaluate()["return"].max() > 1
+    table = scanner.scan({"LTC/BTC": {"bid": 0.01, "ask": 0.01},
+                          "ETH/BTC": {"bid": 0.05, "ask": 0.05}})
+    assert table.empty
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from TraderBetty.managers.valuation import ValuationEngine
+
+
+def prices(pairs):
+    """Price matrix of base rows and quote columns."""
+    coins = sorted({coin for pair in pairs for coin in pair.split("/")})
+    frame = pd.DataFrame(np.nan, index=coins, columns=coins)
+    for pair, price in pairs.items():
+        base, quote = pair.split("/")
+        frame.loc[base, quote] = price
+    return frame
+
+
+def test_edges_go_both_ways():
+    engine = ValuationEngine({"ex": prices({"ETH/BTC": 0.05})})
+    assert np.isclose(engine.rates_to("BTC")["ETH"], 0.05)
+    assert np.isclose(engine.rates_to("ETH")["BTC"], 20)
+
+
+def test_stale_outlier_is_outvoted_by_the_median():
+    engine = ValuationEngine({"a": prices({"ETH/BTC": 0.05}),
+                              "b": prices({"ETH/BTC": 0.051}),
+                              "stale": prices({"ETH/BTC": 0.5})})
+    assert np.isclose(engine.rates_to("BTC")["ETH"], 0.051)
+    assert np.isclose(engine.rates_to("ETH")["BTC"], 1 / 0.051)
+
+
+def test_paths_are_cut_after_max_hops():
+    chain = prices({"A/B": 2.0, "B/C": 3.0, "C/D": 5.0})
+    rates = ValuationEngine({"ex": chain}, max_hops=3).rates_to("D")
+    assert np.isclose(rates["A"], 30)
+    rates = ValuationEngine({"ex": chain}, max_hops=2).rates_to("D")
+    assert pd.isna(rates["A"]) and np.isclose(rates["B"], 15)
+
+
+def test_unreached_exchanges_are_left_out_of_the_valuation(PM):
+    PM.update_ex_price("fake1", "ETH/BTC", 1000.0)
+    PM.unavailable.add("fake1")
+    PM.balances.loc["ETH", "total"] = 1.0
+    values = PM.get_ttl_values(quotes=("BTC",))
+    assert values.loc["ETH", "BTC"] < 1.0
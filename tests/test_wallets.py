@@ -0,0 +1,154 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from TraderBetty.etherscan import MAX_ADDRESSES, Scanner
+from TraderBetty.managers.wallets import IotaWallet
+
+
+def balance(address):
+    """Balance the stub node reports, encoded in the last two characters."""
+    if address[-2:].isdigit():
+        return int(address[-2:])
+    return (ord(address[-2]) - 65) * 26 + ord(address[-1]) - 65
+
+
+class StubNode(object):
+    """Local HTTP server answering like an IRI node and etherscan."""
+    def __init__(self):
+        self.requests = []
+        self.fail = set()
+        self.clients = set()
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def answer(self, addresses, payload):
+                node.requests.append(addresses)
+                node.clients.add(self.client_address)
+                if node.fail & set(addresses):
+                    self.reply(500, {"error": "node is syncing"})
+                else:
+                    self.reply(200, payload)
+
+            def do_POST(self):
+                length = int(self.headers["Content-Length"])
+                addresses = json.loads(self.rfile.read(length))["addresses"]
+                self.answer(addresses, {"balances": [
+                    str(balance(address)) for address in addresses]})
+
+            def do_GET(self):
+                query = parse_qs(urlsplit(self.path).query)
+                addresses = query["address"][0].split(",")
+                self.answer(addresses, {
+                    "status": "1", "message": "OK",
+                    "result": [{"account": address.lower(),
+                                "balance": str(balance(address))}
+                               for address in addresses]})
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def node():
+    node = StubNode()
+    yield node
+    node.stop()
+
+
+def iota_address(i):
+    return "9" * 79 + chr(65 + i // 26) + chr(65 + i % 26)
+
+
+def write_config(tmp_path, node, iota=(), ether=(), interval=15):
+    path = tmp_path / "config.ini"
+    path.write_text(
+        "[iota]\nuri=%s\naddresses=%s\ninterval=%s\nchunk_size=50\n"
+        "[ether_wallet]\naddresses=%s\ninterval=%s\n" % (
+            node.url, ",".join(iota), interval, ",".join(ether), interval))
+    keys = tmp_path / "keys.json"
+    keys.write_text(json.dumps({"etherscan": {"apiKey": "key"}}))
+    return str(path), str(keys)
+
+
+def test_iota_balances_are_checked_in_chunks(tmp_path, node):
+    addresses = [iota_address(i) for i in range(200)]
+    config, keys = write_config(tmp_path, node, iota=addresses + ["SHORT"])
+    wallet = IotaWallet(config)
+    try:
+        balances = wallet.check_balance()["IOTA"]
+        assert list(balances) == addresses
+        assert sum(balances.values()) == sum(range(200))
+        assert sorted(len(chunk) for chunk in node.requests) == [50] * 4
+        # Connections are kept open and reused
+        assert len(node.clients) <= 4
+    finally:
+        wallet.close()
+
+
+def test_cached_balances_are_served_until_they_expire(tmp_path, node):
+    addresses = [iota_address(i) for i in range(10)]
+    config, keys = write_config(tmp_path, node, iota=addresses)
+    wallet = IotaWallet(config)
+    try:
+        first = wallet.check_balance()
+        assert wallet.check_balance() == first
+        assert len(node.requests) == 1
+        assert wallet.ttl == 15 * 60
+        wallet.ttl = 0
+        wallet.check_balance()
+        assert len(node.requests) == 2
+    finally:
+        wallet.close()
+
+
+def test_failed_chunks_keep_their_last_balances(tmp_path, node):
+    addresses = [iota_address(i) for i in range(100)]
+    config, keys = write_config(tmp_path, node, iota=addresses)
+    wallet = IotaWallet(config)
+    try:
+        node.fail.add(addresses[0])
+        # Half the addresses never had a balance, no partial sum
+        assert wallet.check_balance() == {}
+        node.fail.clear()
+        first = wallet.check_balance(refresh=True)
+        node.fail.add(addresses[0])
+        assert wallet.check_balance(refresh=True) == first
+    finally:
+        wallet.close()
+
+
+def test_etherscan_chunks_and_dedupes_addresses(tmp_path, node):
+    addresses = ["0xAB%038d" % i for i in range(45)]
+    config, keys = write_config(
+        tmp_path, node, ether=addresses + [addresses[0].lower()])
+    scanner = Scanner(config, keys, base_url=node.url + "/api")
+    try:
+        balances = scanner.check_balance()["ETH"]
+        assert list(balances) == addresses
+        assert sorted(len(chunk) for chunk in node.requests) == [
+            5, MAX_ADDRESSES, MAX_ADDRESSES]
+    finally:
+        scanner.close()